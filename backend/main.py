@@ -1,26 +1,58 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, Request, UploadFile, File
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, UploadFile, File, Query
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional, Literal
 from rag.graph import get_answer
-from rag.pinecone_utils import get_pinecone_index
-from rag.embeddings import get_embeddings
-import os, json, shutil
-from langchain_openai import ChatOpenAI
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-import PyPDF2
+from rag.pinecone_utils import get_pinecone_index, live_namespace, document_chunk_ids, delete_ids
+from rag.blue_green import rebuild, get_rebuild_stats
+from rag.embeddings import get_embeddings, get_embedding_batch_stats
+from rag.hybrid_search import invalidate_bm25_index, tombstone_documents
+from rag.claims import index_claims, clear_claims, list_conflicts
+from rag.dedup import dedup_records, clear_lsh_index, forget_file, pop_orphaned_files, get_dedup_stats
+from rag.docstore import put_chunks, pinecone_records, delete_chunks, clear_namespace, get_docstore_stats
+from rag.llm import get_llm
+from rag.resilience import get_resilience_stats
+from rag.llm_usage import invoke_llm, get_llm_usage_stats, get_llm_usage_report
+from rag.slow_log import get_slow_log_stats
+from rag.sessions import create_session, delete_session, get_session_stats, SESSION_TTL_SECONDS
+from rag.response_format import shape_result, encode_response, get_response_stats, RESPONSE_COMPRESS_MIN_BYTES
+from rag.warmup import warm_up, STARTUP_REPORT
+from rag.chunker import get_chunker
+from rag.coalesce import single_flight, normalize_query, get_coalesce_stats
+from rag.corpus_scan import get_scan_stats
+from rag.lexical_shards import get_shard_stats
+from rag.map_reduce import get_map_reduce_stats
+from rag.pdf_extract import extract_pdf_text, get_pdf_stats
+import os, json, shutil, asyncio
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 
 limiter = Limiter(key_func=get_remote_address)
 
-app = FastAPI(title="Envint RAG API", description="Hospital Performance RAG with Conflict Detection")
+# Set WARMUP_ON_STARTUP=0 to skip the warm-up phase (e.g. for local debugging).
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") != "0"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /health answers immediately while /ready
+    # stays 503 until the lexical index and clients are loaded.
+    task = asyncio.create_task(warm_up()) if WARMUP_ON_STARTUP else None
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+
+
+app = FastAPI(title="Envint RAG API", description="Hospital Performance RAG with Conflict Detection", lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -31,9 +63,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Skips responses that are already compressed (brotli, see rag/response_format.py)
+app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_COMPRESS_MIN_BYTES,
+                   compresslevel=int(os.environ.get("GZIP_LEVEL", "6")))
 
 class QueryRequest(BaseModel):
     query: str
+    # Latency budget in ms (default QUERY_BUDGET_MS); see rag/graph.py
+    budget_ms: Optional[int] = Field(None, ge=0)
+    # Follow-up questions in a session reuse the previous retrieval; see rag/sessions.py
+    session_id: Optional[str] = Field(None, min_length=1, max_length=64)
 
 class ChunkMeta(BaseModel):
     id: str
@@ -45,11 +84,45 @@ class ExplainRequest(BaseModel):
     query: str
     chunks: List[ChunkMeta]
 
+def _query_mode(request: Request) -> str:
+    return request.query_params.get("mode", "answer")
+
+def _not_answer_mode(request: Request) -> bool:
+    return _query_mode(request) != "answer"
+
+def _not_retrieve_mode(request: Request) -> bool:
+    return _query_mode(request) != "retrieve"
+
+def _not_map_reduce_mode(request: Request) -> bool:
+    return _query_mode(request) != "map_reduce"
+
+# One tier per mode, each exempt from the others' limits. /api/query?mode=retrieve
+# skips the LLM, so it gets a much higher tier; map_reduce makes up to
+# MAP_MAX_PARTITIONS + 1 DeepSeek calls per query, so it gets a lower one.
 @app.post("/api/query")
-@limiter.limit("10/minute")
-async def process_query(request: Request, body: QueryRequest):
-    result = await get_answer(body.query)
-    return result
+@limiter.limit("10/minute", exempt_when=_not_answer_mode)
+@limiter.limit("120/minute", exempt_when=_not_retrieve_mode)
+@limiter.limit("2/minute", exempt_when=_not_map_reduce_mode)
+async def process_query(request: Request, body: QueryRequest, mode: Literal["answer", "retrieve", "map_reduce"] = "answer",
+                        fields: Optional[str] = None,
+                        provenance: Literal["compact", "full", "refs"] = "compact"):
+    # Identical concurrent queries share one pipeline execution
+    key = (mode, normalize_query(body.query), body.budget_ms, body.session_id)
+    result = await single_flight(key, lambda: get_answer(body.query, mode=mode, budget_ms=body.budget_ms,
+                                                         session_id=body.session_id))
+    # Shaped per caller: coalesced callers share `result`
+    return encode_response(request, shape_result(result, fields, provenance))
+
+@app.post("/api/sessions")
+async def start_session():
+    """Start a conversation session; pass its id as session_id to /api/query."""
+    return {"session_id": create_session(), "ttl_seconds": SESSION_TTL_SECONDS}
+
+@app.delete("/api/sessions/{session_id}")
+async def end_session(session_id: str):
+    if not delete_session(session_id):
+        return {"status": "error", "message": f"Session {session_id} not found"}
+    return {"status": "success", "message": f"Session {session_id} ended"}
 
 @app.post("/api/explain-chunks")
 @limiter.limit("15/minute")
@@ -82,16 +155,10 @@ Return ONLY a JSON array of objects with this format:
   {{"chunk_id": "...", "title": "short descriptive title", "relevance": "why this chunk matters most", "key_claims": ["claim 1", "claim 2"], "stance": "supports/contradicts/neutral"}}
 ]"""
 
-    llm = ChatOpenAI(
-        model="deepseek-chat",
-        api_key=api_key,
-        base_url="https://api.deepseek.com",
-        max_tokens=800,
-        temperature=0.3
-    )
+    llm = get_llm(max_tokens=800, temperature=0.3)
 
     try:
-        response = llm.invoke(prompt)
+        response, _ = await asyncio.to_thread(invoke_llm, llm, prompt, "explain_chunks", query=body.query)
         content = response.content
         if "```json" in content:
             content = content.split("```json")[1].split("```")[0].strip()
@@ -113,12 +180,7 @@ def _parse_file(file_path: str, filename: str):
     metadata = {"filename": filename, "source": file_path}
 
     if ext == "pdf":
-        with open(file_path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                t = page.extract_text()
-                if t:
-                    content += t + "\n"
+        content = extract_pdf_text(file_path)
     elif ext in ["txt", "md"]:
         with open(file_path, "r", encoding="utf-8") as f:
             raw = f.read()
@@ -134,104 +196,216 @@ def _parse_file(file_path: str, filename: str):
     else:
         return []
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = splitter.create_documents([content], metadatas=[metadata])
+    chunks = get_chunker().create_chunks(content, metadata)
     return chunks
 
 
-def _ingest_chunks(chunks, filename_prefix="doc"):
-    """Embed and upsert chunks to Pinecone."""
-    if not chunks:
-        return 0
+def _ingest_chunks(chunks, filename_prefix="doc", build=None):
+    """Embed and upsert chunks to Pinecone. Returns (ids upserted, dedup stats).
 
-    texts = [c.page_content for c in chunks]
-    vectors = get_embeddings(texts)
-    index = get_pinecone_index()
+    With `build` (a blue_green.ShadowBuild) the chunks go to its namespace and
+    tables instead of the live ones.
+    """
+    if not chunks:
+        return [], {}
 
     records = []
-    for i, (chunk, vec) in enumerate(zip(chunks, vectors)):
+    for i, chunk in enumerate(chunks):
         meta = chunk.metadata.copy()
         meta["text"] = chunk.page_content
         records.append({
             "id": f"{meta.get('filename', filename_prefix)}_chunk_{i}",
-            "values": vec,
             "metadata": meta,
         })
 
-    # Batch upsert
+    # Skip or tag near-duplicates before paying for their embeddings
+    records, dedup_stats = dedup_records(records, index=build.lsh_index if build else None)
+    if not records:
+        return [], dedup_stats
+
+    vectors = get_embeddings([r["metadata"]["text"] for r in records])
+    for record, vec in zip(records, vectors):
+        record["values"] = vec
+    index = get_pinecone_index()
+    namespace = build.namespace if build else live_namespace()
+
+    # Text and full metadata go to the docstore (Pinecone keeps the text too
+    # unless DOCSTORE_SLIM_PINECONE, see rag/docstore.py)
+    put_chunks(records, namespace)
     batch_size = 100
     for i in range(0, len(records), batch_size):
-        index.upsert(vectors=records[i:i + batch_size])
-
-    return len(records)
+        index.upsert(vectors=pinecone_records(records[i:i + batch_size]), namespace=namespace)
+
+    # Extract numeric claims and refresh the contradiction table
+    index_claims(records, index=build.claims_index if build else None)
+    if build:
+        build.track(records)
+
+    return [r["id"] for r in records], dedup_stats
+
+
+def _safe_filename(filename: str) -> str:
+    """Reject names that would escape data/."""
+    if not filename or filename in (".", "..") or os.path.basename(filename) != filename or "\\" in filename:
+        raise ValueError(f"Invalid filename: {filename!r}")
+    return filename
+
+
+def _delete_document_chunks(filename, build=None):
+    """Delete one document's vectors, claims and LSH signatures (from `build`,
+    or the live index). Cost is O(chunks in the document). Returns the count."""
+    namespace = build.namespace if build else live_namespace()
+    ids = document_chunk_ids(filename, namespace)
+    delete_ids(ids, namespace)
+    delete_chunks(ids, namespace)
+    clear_claims(filename, index=build.claims_index if build else None)
+    forget_file(filename, index=build.lsh_index if build else None)
+    if build:
+        build.forget(ids)
+    else:
+        # Hidden from BM25 right away; no lexical rebuild
+        tombstone_documents([filename])
+    if _repromote_duplicates(build, exclude={filename}) and not build:
+        invalidate_bm25_index()
+    return len(ids)
+
+
+def _repromote_duplicates(build=None, exclude=frozenset()) -> list[str]:
+    """Re-ingest files whose chunks were skipped (DEDUP_POLICY=skip) as
+    duplicates of chunks that were just deleted or replaced, so their content
+    is indexed again. Returns the re-ingested filenames."""
+    repromoted, seen = [], set(exclude)
+    index = build.lsh_index if build else None
+    while orphaned := [f for f in pop_orphaned_files(index) if f not in seen]:
+        for fname in orphaned:
+            seen.add(fname)
+            fpath = os.path.join(DATA_DIR, fname)
+            if os.path.isfile(fpath):
+                _ingest_chunks(_parse_file(fpath, fname), fname, build)
+                repromoted.append(fname)
+    return repromoted
+
+
+def _replace_document(filename, content: bytes):
+    """Save a document to data/ and (re-)ingest it. Chunks of the previous
+    version beyond the new chunk count are deleted instead of orphaned."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    file_path = os.path.join(DATA_DIR, filename)
+    old_ids = set(document_chunk_ids(filename))
+    with open(file_path, "wb") as f:
+        f.write(content)
+
+    # Parse and ingest
+    ids, dedup_stats = _ingest_chunks(_parse_file(file_path, filename), filename)
+    orphans = old_ids - set(ids)
+    delete_ids(orphans)
+    delete_chunks(orphans, live_namespace())
+
+    # Duplicates that were skipped against the old version's chunks come back
+    repromoted = _repromote_duplicates(exclude={filename})
+
+    # The old version's chunks leave BM25 now; the rebuild on the next query adds the new ones
+    if old_ids:
+        tombstone_documents([filename])
+    invalidate_bm25_index()
+    return {"filename": filename, "chunks_created": len(ids), "chunks_deleted": len(orphans),
+            "near_duplicates": dedup_stats, "reingested": repromoted}
 
 
 @app.post("/api/upload-file")
 async def upload_file(file: UploadFile = File(...)):
     """Upload a document, save to data/, parse, chunk, embed, and upsert to Pinecone."""
     try:
-        # Save file
-        os.makedirs(DATA_DIR, exist_ok=True)
-        file_path = os.path.join(DATA_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Parse and ingest
-        chunks = _parse_file(file_path, file.filename)
-        count = _ingest_chunks(chunks, file.filename)
-
-        # Invalidate BM25 cache so it rebuilds on next query
-        try:
-            from rag.hybrid_search import _build_bm25_index
-            import rag.hybrid_search as hs
-            hs._bm25_index = None
-        except Exception:
-            pass
+        filename = _safe_filename(file.filename)
+        content = await file.read()
+        result = await asyncio.to_thread(_replace_document, filename, content)
+        return {
+            "status": "success",
+            **result,
+            "message": f"Ingested {filename} → {result['chunks_created']} chunks upserted to Pinecone"
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
 
+
+@app.put("/api/documents/{filename}")
+async def replace_document(filename: str, file: UploadFile = File(...)):
+    """Replace a document's contents; chunks the new version no longer has are deleted."""
+    try:
+        filename = _safe_filename(filename)
+        content = await file.read()
+        result = await asyncio.to_thread(_replace_document, filename, content)
         return {
             "status": "success",
-            "filename": file.filename,
-            "chunks_created": count,
-            "message": f"Ingested {file.filename} → {count} chunks upserted to Pinecone"
+            **result,
+            "message": f"Replaced {filename} → {result['chunks_created']} chunks upserted, "
+                       f"{result['chunks_deleted']} stale chunks deleted"
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-@app.post("/api/recreate-embeddings")
-async def recreate_embeddings():
-    """Delete all vectors from Pinecone, then re-ingest every file in data/."""
+@app.delete("/api/documents/{filename}")
+async def delete_document(filename: str):
+    """Delete one document: its file in data/, vectors, claims, LSH signatures and BM25 entries."""
     try:
-        # 1. Clear the index
-        index = get_pinecone_index()
-        index.delete(delete_all=True)
+        filename = _safe_filename(filename)
+        file_path = os.path.join(DATA_DIR, filename)
+        deleted = await asyncio.to_thread(_delete_document_chunks, filename)
+        existed = os.path.isfile(file_path)
+        if existed:
+            os.remove(file_path)
+        if not deleted and not existed:
+            return {"status": "error", "message": f"Document {filename} not found"}
+        return {
+            "status": "success",
+            "filename": filename,
+            "chunks_deleted": deleted,
+            "message": f"Deleted {filename} ({deleted} chunks)"
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
 
-        # 2. Re-ingest all files from data/
-        total_chunks = 0
-        files_processed = 0
 
+def _ingest_data_dir(build):
+    """Ingest every file in data/ into the shadow build, then any file that
+    was uploaded or replaced while that ran, until nothing changed."""
+    seen = {}
+    while True:
+        pending = []
         if os.path.exists(DATA_DIR):
             for fname in sorted(os.listdir(DATA_DIR)):
                 fpath = os.path.join(DATA_DIR, fname)
-                if os.path.isfile(fpath):
-                    chunks = _parse_file(fpath, fname)
-                    count = _ingest_chunks(chunks, fname)
-                    total_chunks += count
-                    files_processed += 1
+                if os.path.isfile(fpath) and seen.get(fname) != os.path.getmtime(fpath):
+                    pending.append(fname)
+        if not pending:
+            break
+        for fname in pending:
+            fpath = os.path.join(DATA_DIR, fname)
+            seen[fname] = os.path.getmtime(fpath)
+            _ingest_chunks(_parse_file(fpath, fname), fname, build)
+
+    # Documents deleted while the rebuild ran must not come back with it
+    for fname in [f for f in seen if not os.path.isfile(os.path.join(DATA_DIR, f))]:
+        _delete_document_chunks(fname, build)
+        del seen[fname]
+    return {"files_processed": len(seen), "total_chunks": build.upserted}
 
-        # Invalidate BM25 cache
-        try:
-            import rag.hybrid_search as hs
-            hs._bm25_index = None
-        except Exception:
-            pass
 
+@app.post("/api/recreate-embeddings")
+async def recreate_embeddings(force: bool = False):
+    """Re-ingest every file in data/ into a shadow index version, validate it,
+    then swap it live. Queries keep using the current version meanwhile.
+
+    force=true skips the guard against a shadow much smaller than the live index.
+    """
+    try:
+        result = await asyncio.to_thread(rebuild, _ingest_data_dir, force)
         return {
             "status": "success",
-            "files_processed": files_processed,
-            "total_chunks": total_chunks,
-            "message": f"Cleared index and re-ingested {files_processed} files → {total_chunks} chunks"
+            **result,
+            "message": f"Re-ingested {result['files_processed']} files → {result['total_chunks']} chunks "
+                       f"into {result['namespace']} and swapped it live"
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -242,14 +416,14 @@ async def delete_embeddings():
     """Delete all vectors from the Pinecone index."""
     try:
         index = get_pinecone_index()
-        index.delete(delete_all=True)
+        namespace = live_namespace()
+        index.delete(delete_all=True, namespace=namespace)
+        clear_namespace(namespace)
+        clear_claims()
+        clear_lsh_index()
 
         # Invalidate BM25 cache
-        try:
-            import rag.hybrid_search as hs
-            hs._bm25_index = None
-        except Exception:
-            pass
+        invalidate_bm25_index()
 
         return {
             "status": "success",
@@ -259,7 +433,55 @@ async def delete_embeddings():
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/api/conflicts")
+async def get_conflicts(topic: Optional[str] = None, filename: Optional[str] = None):
+    """List the contradictions pre-computed from the numeric claim index (no LLM)."""
+    conflicts = list_conflicts(topic=topic, filename=filename)
+    return {"count": len(conflicts), "conflicts": conflicts}
+
+
+@app.get("/api/dedup-stats")
+async def dedup_stats():
+    """Near-duplicate detection counters and index space saved since startup."""
+    return get_dedup_stats()
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """Runtime counters for this worker process."""
+    return {
+        "coalescing": get_coalesce_stats(),
+        "lexical_rebuild": get_scan_stats(),
+        "lexical_shards": get_shard_stats(),
+        "docstore": get_docstore_stats(),
+        "map_reduce": get_map_reduce_stats(),
+        "pdf_extraction": get_pdf_stats(),
+        "embedding_batches": get_embedding_batch_stats(),
+        "resilience": get_resilience_stats(),
+        "slow_queries": get_slow_log_stats(),
+        "index_rebuild": get_rebuild_stats(),
+        "responses": get_response_stats(),
+        "sessions": get_session_stats(),
+        "llm_usage": get_llm_usage_stats(),
+    }
+
+
+@app.get("/api/llm-usage")
+async def llm_usage(minutes: int = Query(60, ge=1), top: int = Query(10, ge=0)):
+    """LLM tokens, cost and latency per endpoint, per time bucket and for the top-spending queries."""
+    return get_llm_usage_report(minutes, top)
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 only once warm-up has loaded the index and clients."""
+    status_code = 200 if STARTUP_REPORT["ready"] else 503
+    body = {"status": "ready" if STARTUP_REPORT["ready"] else "warming_up", **STARTUP_REPORT}
+    return JSONResponse(status_code=status_code, content=body)
+
+
@@ -0,0 +1,281 @@
+"""
+Zero-downtime (blue/green) rebuild of the indexes behind /api/query.
+
+/api/recreate-embeddings used to delete every vector and re-ingest in place,
+so for the whole re-ingest queries saw an empty or partial index and the
+BM25 corpus could be rebuilt from a half-filled one. A rebuild now:
+
+  1. Ingests into a fresh Pinecone namespace (`v<UTC timestamp>`), with its
+     own in-memory LSH and claim tables. Queries keep using the live
+     namespace, lexical index, claims and LSH index meanwhile.
+  2. Validates the shadow: its vector count (polled, since index stats are
+     eventually consistent) must equal what was upserted and be at least
+     REBUILD_MIN_COUNT_RATIO of the live count; sampled chunks queried by
+     their own vectors must come back in the top REBUILD_SAMPLE_TOP_K. The
+     overlap with the live namespace's answers is reported, not enforced
+     (the contents may legitimately have changed).
+  3. Builds the shadow's lexical index (rag/lexical_store.py keeps one per
+     namespace), then swaps the live-namespace pointer — a marker record in
+     Pinecone that every worker and host re-reads within
+     LIVE_POINTER_TTL_SECONDS, switching its vector namespace and lexical
+     index (see rag/pinecone_utils.py) — and persists the new claim and LSH
+     tables.
+  4. Deletes the old namespace's vectors, docstore rows and lexical files after
+     INDEX_GC_DELAY_SECONDS, letting in-flight queries finish. Earlier
+     versions that a crash left behind are swept at the next rebuild.
+
+A namespace is only ever deleted after re-reading the shared pointer from
+Pinecone and confirming it points elsewhere (`collect`). The sweep also
+spares versions newer than the live one for REBUILD_STALE_SECONDS: they may
+be another host's rebuild in progress.
+
+A failed ingest or validation deletes the shadow and leaves the live
+version untouched. One rebuild runs at a time (cross-process flock).
+"""
+import calendar
+import contextlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from rag.claims import new_claims_index, replace_claims_index
+from rag.dedup import new_lsh_index, replace_lsh_index
+from rag.docstore import clear_namespace, drop_namespace
+from rag.hybrid_search import build_and_publish
+from rag.lexical_store import LEXICAL_INDEX_DIR, build_lock, lexical_dir, remove_lexical_index
+from rag.pinecone_utils import (
+    INDEX_VERSION_DIR, get_pinecone_index, live_namespace, namespace_vector_count,
+    read_live_pointer, search_pinecone, set_live_namespace,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no lock needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+REBUILD_VALIDATION_SAMPLES = int(os.environ.get("REBUILD_VALIDATION_SAMPLES", "8"))
+REBUILD_SAMPLE_TOP_K = 5
+REBUILD_MIN_HIT_RATE = float(os.environ.get("REBUILD_MIN_HIT_RATE", "0.75"))
+REBUILD_MIN_COUNT_RATIO = float(os.environ.get("REBUILD_MIN_COUNT_RATIO", "0.5"))
+REBUILD_COUNT_TIMEOUT = float(os.environ.get("REBUILD_COUNT_TIMEOUT", "120"))
+INDEX_GC_DELAY_SECONDS = float(os.environ.get("INDEX_GC_DELAY_SECONDS", "30"))
+REBUILD_STALE_SECONDS = float(os.environ.get("REBUILD_STALE_SECONDS", str(6 * 3600)))
+
+# Only namespaces this module created are ever garbage-collected
+_VERSION_RE = re.compile(r"^v\d{8}T\d{6}$")
+
+# Last rebuild (or the one in progress)
+REBUILD_STATS: dict = {}
+
+
+class ShadowBuild:
+    """A namespace being filled, plus its claim / LSH tables and validation samples."""
+
+    def __init__(self):
+        self.namespace = time.strftime("v%Y%m%dT%H%M%S", time.gmtime())
+        self.lsh_index = new_lsh_index()
+        self.claims_index = new_claims_index()
+        self.ids: set[str] = set()
+        self.samples: list[dict] = []
+        # Every chunk of the shadow is ingested through the docstore
+        clear_namespace(self.namespace)
+
+    @property
+    def upserted(self) -> int:
+        return len(self.ids)
+
+    def track(self, records: list[dict]):
+        """Count upserted records ({id, values, metadata}) and reservoir-sample them."""
+        for record in records:
+            if record["id"] in self.ids:
+                continue  # a file re-ingested during the rebuild overwrote it
+            self.ids.add(record["id"])
+            if len(self.samples) < REBUILD_VALIDATION_SAMPLES:
+                self.samples.append(record)
+            else:
+                slot = random.randrange(self.upserted)
+                if slot < REBUILD_VALIDATION_SAMPLES:
+                    self.samples[slot] = record
+
+    def forget(self, ids):
+        """Un-count chunks deleted from the shadow (their document was deleted)."""
+        self.ids.difference_update(ids)
+        self.samples = [r for r in self.samples if r["id"] in self.ids]
+
+
+@contextlib.contextmanager
+def rebuild_lock():
+    """Cross-process rebuild lock. Yields False if another rebuild holds it."""
+    os.makedirs(INDEX_VERSION_DIR, exist_ok=True)
+    with open(os.path.join(INDEX_VERSION_DIR, "rebuild.lock"), "a+") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ─── Validation ─────────────────────────────────────────────────────────────
+
+def _wait_for_count(index, namespace: str, expected: int) -> int:
+    deadline = time.monotonic() + REBUILD_COUNT_TIMEOUT
+    while True:
+        count = namespace_vector_count(index, namespace)
+        if count >= expected or time.monotonic() >= deadline:
+            return count
+        time.sleep(1.0)
+
+
+def validate(build: ShadowBuild, live: str, force: bool = False) -> dict:
+    """Check the shadow namespace before it goes live. Returns a report with "ok"."""
+    index = get_pinecone_index()
+    count = _wait_for_count(index, build.namespace, build.upserted)
+    live_count = namespace_vector_count(index, live)
+
+    hits, overlaps = 0, []
+    for sample in build.samples:
+        shadow_ids = [m["id"] for m in search_pinecone(sample["values"], REBUILD_SAMPLE_TOP_K, build.namespace)]
+        hits += sample["id"] in shadow_ids
+        if live_count:
+            live_ids = {m["id"] for m in search_pinecone(sample["values"], REBUILD_SAMPLE_TOP_K, live)}
+            overlaps.append(len(live_ids & set(shadow_ids)) / max(len(live_ids | set(shadow_ids)), 1))
+    hit_rate = hits / len(build.samples) if build.samples else 1.0
+
+    problems = []
+    if count != build.upserted:
+        problems.append(f"shadow holds {count} vectors, {build.upserted} were upserted")
+    if not force and count < REBUILD_MIN_COUNT_RATIO * live_count:
+        problems.append(f"shadow holds {count} vectors vs {live_count} live (min ratio {REBUILD_MIN_COUNT_RATIO})")
+    if hit_rate < REBUILD_MIN_HIT_RATE:
+        problems.append(f"sampled chunks retrieved themselves {hit_rate:.0%} of the time (min {REBUILD_MIN_HIT_RATE:.0%})")
+    return {
+        "ok": not problems,
+        "problems": problems,
+        "vector_count": count,
+        "live_vector_count": live_count,
+        "samples": len(build.samples),
+        "sample_hit_rate": round(hit_rate, 3),
+        "live_overlap": round(sum(overlaps) / len(overlaps), 3) if overlaps else None,
+    }
+
+
+# ─── Swap and garbage collection ────────────────────────────────────────────
+
+def _publish_lexical(namespace: str):
+    if not LEXICAL_INDEX_DIR:
+        return  # private per-worker corpora rebuild when they see the new namespace
+    with build_lock(directory=lexical_dir(namespace)):
+        build_and_publish(namespace)
+
+
+def swap(build: ShadowBuild):
+    """Make the shadow live: lexical index first, then the pointer, then the tables."""
+    _publish_lexical(build.namespace)
+    set_live_namespace(build.namespace)
+    replace_claims_index(build.claims_index)
+    replace_lsh_index(build.lsh_index)
+
+
+def collect(namespace: str) -> bool:
+    """Delete a retired namespace's vectors, chunk texts and lexical index.
+
+    Does nothing (returns False) unless the shared pointer, re-read from
+    Pinecone, confirms the namespace is not live; raises if it cannot be read.
+    """
+    if read_live_pointer() == namespace:
+        logger.warning("Index version %r is live; not collecting it", namespace or "(default)")
+        return False
+    get_pinecone_index().delete(delete_all=True, namespace=namespace)
+    drop_namespace(namespace)
+    if LEXICAL_INDEX_DIR:
+        remove_lexical_index(namespace)
+    logger.info("Garbage-collected index version %r", namespace or "(default)")
+    return True
+
+
+def _collect_later(namespace: str):
+    def run():
+        try:
+            collect(namespace)
+        except Exception:
+            logger.exception("Garbage collection of index version %r failed", namespace)
+    timer = threading.Timer(INDEX_GC_DELAY_SECONDS, run)
+    timer.daemon = True
+    timer.start()
+
+
+def _version_time(namespace: str) -> float:
+    return calendar.timegm(time.strptime(namespace, "v%Y%m%dT%H%M%S"))
+
+
+def sweep_stale_versions(keep: set[str]) -> list[str]:
+    """Collect versions left behind by crashed rebuilds or missed GC timers.
+
+    Versions newer than the live one are spared until REBUILD_STALE_SECONDS
+    old: another host may still be filling them.
+    """
+    live = read_live_pointer()
+    live_time = _version_time(live) if _VERSION_RE.match(live) else 0.0
+    stats = get_pinecone_index().describe_index_stats()
+    stale = [
+        ns for ns in (stats.namespaces or {})
+        if _VERSION_RE.match(ns) and ns not in keep | {live}
+        and (_version_time(ns) < live_time or time.time() - _version_time(ns) > REBUILD_STALE_SECONDS)
+    ]
+    return [namespace for namespace in stale if collect(namespace)]
+
+
+# ─── Rebuild ────────────────────────────────────────────────────────────────
+
+def rebuild(ingest, force: bool = False) -> dict:
+    """Blue/green rebuild. `ingest(build)` fills the shadow and returns a dict
+    of counts for the report; raises RuntimeError if a rebuild is running or
+    ValueError if validation fails."""
+    with rebuild_lock() as acquired:
+        if not acquired:
+            raise RuntimeError("A rebuild is already in progress")
+
+        live = read_live_pointer()  # the shared pointer, not this process's cached copy
+        build = ShadowBuild()
+        t0 = time.perf_counter()
+        REBUILD_STATS.clear()
+        REBUILD_STATS.update(status="ingesting", namespace=build.namespace, previous=live, started=time.time())
+        swept = sweep_stale_versions(keep={live})
+
+        try:
+            counts = ingest(build)
+            REBUILD_STATS["status"] = "validating"
+            report = validate(build, live, force)
+            REBUILD_STATS["validation"] = report
+            if not report["ok"]:
+                raise ValueError("Validation failed: " + "; ".join(report["problems"]))
+            REBUILD_STATS["status"] = "swapping"
+            swap(build)
+        except BaseException:
+            REBUILD_STATS["status"] = "failed"
+            # collect() re-checks the shared pointer, in case the swap got through
+            with contextlib.suppress(Exception):
+                collect(build.namespace)
+            raise
+
+        _collect_later(live)
+        REBUILD_STATS.update(status="live", seconds=round(time.perf_counter() - t0, 1), **counts)
+        logger.info("Index version %s is live (previous %r collected in %.0fs)",
+                    build.namespace, live or "(default)", INDEX_GC_DELAY_SECONDS)
+        return {"namespace": build.namespace, "previous": live, "swept": swept, "validation": report, **counts}
+
+
+def get_rebuild_stats() -> dict:
+    return {"live_namespace": live_namespace(), **REBUILD_STATS}
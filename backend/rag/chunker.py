@@ -0,0 +1,191 @@
+"""
+Chunking engine shared by the upload API and the ingestion CLI.
+
+Produces exactly the chunks of LangChain's
+`RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)` (default
+separators, keep_separator=True, strip_whitespace=True), but:
+
+  - works on (start, end) offsets into the source text: splits, merges and
+    whitespace stripping never copy text, a chunk's string is sliced only
+    when `page_content` is read;
+  - shares one metadata dict per document instead of deep-copying it into
+    a LangChain `Document` per chunk;
+  - can size chunks in tokens instead of characters (CHUNK_UNIT=tokens);
+  - chunks many documents in one call, optionally across processes.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from rag.context import estimate_tokens
+
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "50"))
+# "chars" (default, matches the original splitter) or "tokens"
+CHUNK_UNIT = os.environ.get("CHUNK_UNIT", "chars")
+# Processes used by chunk_many(); 1 keeps batch chunking in-process
+CHUNK_WORKERS = int(os.environ.get("CHUNK_WORKERS", "1"))
+
+SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+class Chunk:
+    """One chunk of a document: offsets into the source text plus its metadata.
+
+    Exposes `page_content` and `metadata` like a LangChain Document, so code
+    written against the old splitter output keeps working.
+    """
+
+    __slots__ = ("source", "start", "end", "metadata")
+
+    def __init__(self, source: str, start: int, end: int, metadata: dict):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.metadata = metadata
+
+    @property
+    def page_content(self) -> str:
+        return self.source[self.start:self.end]
+
+    def __repr__(self):
+        return f"Chunk({self.start}:{self.end}, {self.page_content[:40]!r}…)"
+
+
+class Chunker:
+    """Offset-based equivalent of RecursiveCharacterTextSplitter."""
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 unit: str = CHUNK_UNIT, separators=SEPARATORS):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        if unit not in ("chars", "tokens"):
+            raise ValueError(f"unit must be 'chars' or 'tokens', got {unit!r}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        self.separators = tuple(separators)
+
+    def _length(self, text: str, start: int, end: int) -> int:
+        if self.unit == "chars":
+            return end - start
+        return estimate_tokens(text[start:end])
+
+    # ─── Splitting ────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _split_on(text: str, start: int, end: int, separator: str) -> list[tuple[int, int]]:
+        """Spans of text[start:end] split on `separator`, which starts each piece."""
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        spans = []
+        piece_start = start
+        pos = text.find(separator, start, end)
+        while pos != -1:
+            if pos > piece_start:
+                spans.append((piece_start, pos))
+            piece_start = pos
+            pos = text.find(separator, pos + len(separator), end)
+        if end > piece_start:
+            spans.append((piece_start, end))
+        return spans
+
+    def _split(self, text: str, start: int, end: int, separators: tuple, out: list):
+        # First separator present in the span; "" (per character) as a last resort
+        separator, remaining = separators[-1], ()
+        for i, s in enumerate(separators):
+            if not s:
+                separator = s
+                break
+            if text.find(s, start, end) != -1:
+                separator, remaining = s, separators[i + 1:]
+                break
+
+        good = []
+        for span in self._split_on(text, start, end, separator):
+            length = self._length(text, *span)
+            if length < self.chunk_size:
+                good.append((span, length))
+                continue
+            if good:
+                self._merge(text, good, out)
+                good = []
+            if remaining:
+                self._split(text, span[0], span[1], remaining, out)
+            else:
+                self._emit(text, span[0], span[1], out)
+        if good:
+            self._merge(text, good, out)
+
+    def _merge(self, text: str, splits: list, out: list):
+        """Pack adjacent splits into chunks with overlap (separator length is 0)."""
+        window: list[tuple[tuple[int, int], int]] = []
+        head = 0  # the current chunk is window[head:]; popping just advances head
+        total = 0
+        size, overlap = self.chunk_size, self.chunk_overlap
+        for span, length in splits:
+            if total + length > size:
+                if head < len(window):
+                    self._emit(text, window[head][0][0], window[-1][0][1], out)
+                    while total > overlap or (total + length > size and total > 0):
+                        total -= window[head][1]
+                        head += 1
+            window.append((span, length))
+            total += length
+        if head < len(window):
+            self._emit(text, window[head][0][0], window[-1][0][1], out)
+
+    @staticmethod
+    def _emit(text: str, start: int, end: int, out: list):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            out.append((start, end))
+
+    # ─── Public API ───────────────────────────────────────────────────────
+
+    def split_offsets(self, text: str) -> list[tuple[int, int]]:
+        """(start, end) offsets of every chunk of `text`."""
+        out: list[tuple[int, int]] = []
+        self._split(text, 0, len(text), self.separators, out)
+        return out
+
+    def split_text(self, text: str) -> list[str]:
+        return [text[s:e] for s, e in self.split_offsets(text)]
+
+    def create_chunks(self, text: str, metadata: dict | None = None) -> list[Chunk]:
+        """Chunks of one document; all of them share `metadata`."""
+        metadata = {} if metadata is None else metadata
+        return [Chunk(text, s, e, metadata) for s, e in self.split_offsets(text)]
+
+    def chunk_many(self, documents, workers: int | None = None) -> list[list[Chunk]]:
+        """Chunk an iterable of (text, metadata) pairs.
+
+        With `workers` > 1 (default CHUNK_WORKERS) the offset computation is
+        spread over a process pool (only the offsets travel back); worth it
+        for large batches.
+        """
+        workers = CHUNK_WORKERS if workers is None else workers
+        documents = list(documents)
+        texts = [text for text, _ in documents]
+        if workers and workers > 1 and len(texts) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                offsets = list(pool.map(self.split_offsets, texts, chunksize=max(1, len(texts) // (workers * 4))))
+        else:
+            offsets = [self.split_offsets(text) for text in texts]
+        return [
+            [Chunk(text, s, e, metadata) for s, e in spans]
+            for (text, metadata), spans in zip(documents, offsets)
+        ]
+
+
+_default_chunker = None
+
+
+def get_chunker() -> Chunker:
+    """Process-wide chunker configured from CHUNK_SIZE / CHUNK_OVERLAP / CHUNK_UNIT."""
+    global _default_chunker
+    if _default_chunker is None:
+        _default_chunker = Chunker()
+    return _default_chunker
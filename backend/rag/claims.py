@@ -0,0 +1,448 @@
+"""
+Numeric claim index — LLM-free detection of cross-department contradictions.
+
+At ingestion, a rule-based extractor pulls numeric claims out of each chunk:
+
+    (metric, entity, value, unit, kind, direction, period, source)
+
+e.g. "Patient satisfaction has improved by 20%" →
+    metric=patient_satisfaction, value=20, unit=%, kind=change, direction=up
+
+Claims from different source files are then cross-checked per topic:
+  - direction conflicts: one file reports a topic getting better while another
+    reports it getting worse (satisfaction +20% vs complaints +25%)
+  - level conflicts: the same metric is reported at clearly different levels
+    (SSI 1.2% vs HAI 4.5%, 102/102 positions vs 11/19 positions)
+
+The claims and the pre-computed contradiction table are persisted as JSON, so
+retrieval can attach known conflicts for the retrieved chunks instantly. An
+upload only compares the pairs that involve its file's claims; entries between
+other files are kept as they are (`update_contradictions`).
+"""
+import contextlib
+import datetime
+import json
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no lock needed
+    fcntl = None
+
+CLAIMS_INDEX_PATH = os.environ.get(
+    "CLAIMS_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "claims_index.json"),
+)
+
+# Two levels of the same metric conflict when they differ by more than this
+# fraction of the larger one (1.2% vs 4.5% → 0.73, 57.9% vs 100% → 0.42).
+LEVEL_CONFLICT_THRESHOLD = 0.3
+
+
+# ─── Lexicon ─────────────────────────────────────────────────────────────────
+# metric: (keyword regex, topic, polarity (+1 = higher is better), compare levels?)
+METRICS = {
+    "patient_satisfaction": (r"satisf", "patient_experience", +1, False),
+    "complaints":           (r"complain", "patient_experience", -1, False),
+    "wait_time":            (r"wait(?:ing)? times?", "patient_experience", -1, False),
+    "infection_rate":       (r"infection|\bssi\b|\bhais?\b|\bclabsi\b|\bcauti\b", "infection", -1, True),
+    "staffing_level":       (r"staff(?:ed|ing)|positions|coverage|vacanc", "staffing", +1, True),
+    "overtime":             (r"overtime", "overtime", -1, False),
+    "operating_costs":      (r"\bcosts?\b|expens|spending", "finance", -1, False),
+    "revenue":              (r"revenue", "finance", +1, False),
+    "uptime":               (r"uptime", "it_systems", +1, True),
+    "turnaround_time":      (r"turnaround|\btat\b", "laboratory", -1, False),
+    "compliance":           (r"complian|complet|adherence", "compliance", +1, False),
+}
+_METRIC_RES = {m: re.compile(spec[0], re.I) for m, spec in METRICS.items()}
+
+# Levels outside these ranges belong to something else ("Infection Prevention
+# training: 96.8%" is a completion rate, not an infection rate).
+PLAUSIBLE_LEVELS = {"infection_rate": (0, 30)}
+
+ENTITIES = {
+    "ICU": r"\bicu\b|intensive care",
+    "Emergency": r"\bed\b|emergency",
+    "Night Shift": r"night[- ]shift|\bnights?\b",
+    "Surgical": r"surg(?:ical|ery|eon)",
+    "Pediatrics": r"pediatric",
+    "Radiology": r"radiology|\bmri\b",
+    "Pharmacy": r"pharmac",
+    "Laboratory": r"\blab(?:oratory)?\b",
+}
+_ENTITY_RES = {e: re.compile(p, re.I) for e, p in ENTITIES.items()}
+
+_DIRECTIONS = {
+    "up": re.compile(r"improv|increas|\brose\b|\brise\b|\bup\b|\bsurg(?:e|ed|es|ing)\b|spike|higher|grew|doubl|exceed", re.I),
+    "down": re.compile(r"decreas|reduc|dropp|\bdrop\b|\bdown\b|\bfell\b|lower|declin|\bcut\b", re.I),
+}
+# Number is a reference point or someone else's claim, not this source's own
+# ("benchmark of 2%", "from 61% in Q4", "HR's claim of 100% staffing")
+_REFERENCE = re.compile(r"(benchmark|target|industry|average|national|from|compared to|versus|vs\.?|claim(?:s|ed)?)\W+(\w+\W+){0,3}$", re.I)
+# Number is a level even if a trend word is nearby ("dropped to 64%", "reached 4.5%")
+_LEVEL_CUE = re.compile(r"(\bto|\bat|reached|\bof|low of|high of|totaling|total|:)\s*$", re.I)
+
+# Metric keywords / trend words must sit this close to the number (chars before, after)
+METRIC_WINDOW = (80, 40)
+DIRECTION_WINDOW = (40, 25)
+_PERIOD = re.compile(r"\b(Q[1-4])\s*(20\d\d)\b")
+_BASELINE_CUE = re.compile(r"(from|compared to|versus|vs\.?|than|since)\b[^.;]{0,20}$", re.I)
+
+_NUMBER_RES = [
+    # 60-70% → 65
+    ("%", re.compile(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\s?(?:%|percent)")),
+    ("%", re.compile(r"(\d+(?:\.\d+)?)\s?(?:%|percent)")),
+    # 102 of 102, 11/19 → percentage
+    ("ratio", re.compile(r"\b(\d+)\s*(?:/|of|out of)\s*(\d+)\b(?!\.\d|/)")),
+    ("USD", re.compile(r"\$\s?(\d[\d,]*(?:\.\d+)?)\s?(K|M|million|thousand)?\b", re.I)),
+]
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+# ─── Extraction ──────────────────────────────────────────────────────────────
+
+def _sentences(text: str) -> list[str]:
+    """Split into sentences, re-joining PDF-wrapped lines but not headings/bullets."""
+    blocks, current = [], []
+    for line in text.splitlines():
+        s = line.strip()
+        heading = s.startswith("#") or (s.isupper() and len(s) < 100)
+        if not s or heading or s.startswith(("-", "*", "•")):
+            if current:
+                blocks.append(" ".join(current))
+                current = []
+            if heading:
+                blocks.append(s)
+            elif s:
+                current = [s]
+            continue
+        current.append(s)
+    if current:
+        blocks.append(" ".join(current))
+    return [sent for block in blocks for sent in _SENTENCE_SPLIT.split(block) if sent.strip()]
+
+
+def _nearest(patterns: dict, sentence: str, start: int, end: int, window=None):
+    """Name of the pattern matching closest to sentence[start:end], within `window`."""
+    lo, hi = (0, len(sentence)) if window is None else (max(0, start - window[0]), end + window[1])
+    best, best_dist = None, None
+    for name, pattern in patterns.items():
+        for m in pattern.finditer(sentence, lo, hi):
+            dist = start - m.end() if m.end() <= start else m.start() - end
+            if best_dist is None or dist < best_dist:
+                best, best_dist = name, dist
+    return best
+
+
+def _period(sentence: str, metadata: dict):
+    for m in _PERIOD.finditer(sentence):
+        if not _BASELINE_CUE.search(sentence[:m.start()]):
+            return f"{m.group(1)} {m.group(2)}"
+    date = metadata.get("date")
+    try:
+        # Reports are filed shortly after the quarter they cover
+        covered = datetime.date.fromisoformat(date) - datetime.timedelta(days=15)
+    except (TypeError, ValueError):
+        return None
+    return f"Q{(covered.month - 1) // 3 + 1} {covered.year}"
+
+
+def _parse_value(unit: str, m: re.Match):
+    if unit == "%" and m.lastindex == 2:
+        return (float(m.group(1)) + float(m.group(2))) / 2, "%"
+    if unit == "ratio":
+        num, den = int(m.group(1)), int(m.group(2))
+        if den == 0 or num > den:
+            return None
+        return round(num / den * 100, 1), "%"
+    if unit == "USD":
+        value = float(m.group(1).replace(",", ""))
+        scale = (m.group(2) or "").lower()
+        value *= {"k": 1e3, "thousand": 1e3, "m": 1e6, "million": 1e6}.get(scale, 1)
+        return value, "USD"
+    return float(m.group(1)), "%"
+
+
+def extract_claims(text: str, metadata: dict, chunk_id: str) -> list[dict]:
+    """Rule-based numeric claim extraction for one chunk."""
+    claims = []
+    last_metric = None
+    for sentence in _sentences(text):
+        if not any(ch.isdigit() for ch in sentence):
+            last_metric = _nearest(_METRIC_RES, sentence, len(sentence), len(sentence)) or last_metric
+            continue
+        taken = []
+        for unit, pattern in _NUMBER_RES:
+            for m in pattern.finditer(sentence):
+                if any(m.start() < end and m.end() > start for start, end in taken):
+                    continue
+                taken.append((m.start(), m.end()))
+                before = sentence[max(0, m.start() - 40):m.start()]
+                if _REFERENCE.search(before):
+                    continue
+                # "This represents a 94% increase..." refers back to the previous sentence
+                metric = _nearest(_METRIC_RES, sentence, m.start(), m.end(), METRIC_WINDOW) or last_metric
+                parsed = _parse_value(unit, m)
+                if metric is None or parsed is None:
+                    continue
+                value, value_unit = parsed
+
+                direction = _nearest(_DIRECTIONS, sentence, m.start(), m.end(), DIRECTION_WINDOW)
+                kind = "level" if direction is None or _LEVEL_CUE.search(before) else "change"
+                low, high = PLAUSIBLE_LEVELS.get(metric, (float("-inf"), float("inf")))
+                if kind == "level" and value_unit == "%" and not low <= value <= high:
+                    continue
+
+                claims.append({
+                    "metric": metric,
+                    "topic": METRICS[metric][1],
+                    "entity": _nearest(_ENTITY_RES, sentence, m.start(), m.end()) or metadata.get("department"),
+                    "value": value,
+                    "unit": value_unit,
+                    "kind": kind,
+                    "direction": direction,
+                    "period": _period(sentence, metadata),
+                    "source": metadata.get("filename", chunk_id),
+                    "department": metadata.get("department"),
+                    "chunk_id": chunk_id,
+                    "text": sentence[:300],
+                })
+        last_metric = _nearest(_METRIC_RES, sentence, len(sentence), len(sentence)) or last_metric
+    return claims
+
+
+# ─── Contradiction table ─────────────────────────────────────────────────────
+
+def _outcome(claim: dict):
+    """+1 if the claim reports the topic getting better, -1 if worse, None if no trend."""
+    if claim["direction"] is None:
+        return None
+    sign = 1 if claim["direction"] == "up" else -1
+    return sign * METRICS[claim["metric"]][2]
+
+
+def _describe(claim: dict) -> str:
+    value = f"{claim['value']:g}{claim['unit']}" if claim["unit"] == "%" else f"${claim['value']:,.0f}"
+    trend = f" {claim['direction']}" if claim["direction"] and claim["kind"] == "change" else ""
+    return f"{claim['source']} → {claim['metric'].replace('_', ' ')}{trend} {value}"
+
+
+def _conflict(a: dict, b: dict):
+    """(type, strength) if two claims of the same topic contradict, else None."""
+    if a["source"] == b["source"]:
+        return None
+    if a["period"] and b["period"] and a["period"] != b["period"]:
+        return None
+    oa, ob = _outcome(a), _outcome(b)
+    if a["kind"] == b["kind"] == "change" and oa is not None and ob is not None and oa != ob:
+        # Prefer pairs about the same metric, then larger magnitudes
+        strength = (a["metric"] == b["metric"], min(a["value"], b["value"]) if a["unit"] == b["unit"] else 0)
+        return "direction", strength
+    if (a["kind"] == b["kind"] == "level" and a["metric"] == b["metric"]
+            and a["unit"] == b["unit"] and METRICS[a["metric"]][3]):
+        high = max(a["value"], b["value"])
+        gap = abs(a["value"] - b["value"]) / high if high else 0
+        if gap > LEVEL_CONFLICT_THRESHOLD:
+            return "level", (True, gap)
+    return None
+
+
+def _best_conflicts(pairs) -> list[dict]:
+    """The strongest conflict per (topic, type, file pair) among claim pairs."""
+    best: dict[tuple, dict] = {}
+    for a, b in pairs:
+        conflict = _conflict(a, b)
+        if conflict is None:
+            continue
+        kind, strength = conflict
+        first, second = sorted((a, b), key=lambda c: c["source"])
+        key = (a["topic"], kind, first["source"], second["source"])
+        if key not in best or strength > best[key]["_strength"]:
+            best[key] = {"_strength": strength, "topic": a["topic"], "type": kind, "a": first, "b": second}
+    return list(best.values())
+
+
+def _table(entries: list[dict]) -> list[dict]:
+    contradictions = []
+    for n, entry in enumerate(sorted(entries, key=lambda e: (e["topic"], e["a"]["source"], e["b"]["source"], e["type"]))):
+        a, b = entry["a"], entry["b"]
+        contradictions.append({
+            "id": f"conflict_{n + 1}",
+            "topic": entry["topic"],
+            "type": entry["type"],
+            "metric": a["metric"] if a["metric"] == b["metric"] else f"{a['metric']} / {b['metric']}",
+            "sources": [a["source"], b["source"]],
+            "chunk_ids": [a["chunk_id"], b["chunk_id"]],
+            "summary": f"{_describe(a)} vs {_describe(b)}",
+            "claims": [a, b],
+        })
+    return contradictions
+
+
+def _by_topic(claims) -> dict[str, list[dict]]:
+    by_topic: dict[str, list[dict]] = {}
+    for c in claims:
+        by_topic.setdefault(c["topic"], []).append(c)
+    return by_topic
+
+
+def find_contradictions(claims: list[dict]) -> list[dict]:
+    """Cross-check claims of different source files; one entry per (topic, type, file pair)."""
+    pairs = (
+        (a, b)
+        for topic_claims in _by_topic(claims).values()
+        for i, a in enumerate(topic_claims)
+        for b in topic_claims[i + 1:]
+    )
+    return _table(_best_conflicts(pairs))
+
+
+def update_contradictions(contradictions: list[dict], claims: list[dict], sources: set[str]) -> list[dict]:
+    """The table after the claims of `sources` changed (`claims` is the new
+    full list): entries between other files are kept, and only pairs that
+    involve a claim of `sources` are compared, O(changed × topic size)."""
+    kept = [
+        {"topic": c["topic"], "type": c["type"], "a": c["claims"][0], "b": c["claims"][1]}
+        for c in contradictions if not sources.intersection(c["sources"])
+    ]
+    changed = _by_topic(c for c in claims if c["source"] in sources)
+    others = _by_topic(c for c in claims if c["source"] not in sources)
+    pairs = (
+        pair
+        for topic, topic_claims in changed.items()
+        for i, a in enumerate(topic_claims)
+        for pair in [*((a, b) for b in topic_claims[i + 1:]), *((a, b) for b in others.get(topic, ()))]
+    )
+    return _table(kept + _best_conflicts(pairs))
+
+
+# ─── Persistent index ────────────────────────────────────────────────────────
+_claims_index = None
+_claims_version = None
+_claims_lock = threading.Lock()
+
+
+def new_claims_index() -> dict:
+    return {"claims": [], "contradictions": []}
+
+
+def _file_version():
+    try:
+        st = os.stat(CLAIMS_INDEX_PATH)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _load() -> dict:
+    """Cached index, reloaded when another process (e.g. scripts.ingest) rewrote it."""
+    global _claims_index, _claims_version
+    version = _file_version()
+    if _claims_index is None or version != _claims_version:
+        if version is not None:
+            with open(CLAIMS_INDEX_PATH, "r", encoding="utf-8") as f:
+                _claims_index = json.load(f)
+        else:
+            _claims_index = new_claims_index()
+        _claims_version = version
+    return _claims_index
+
+
+def _save(index: dict):
+    global _claims_version
+    os.makedirs(os.path.dirname(CLAIMS_INDEX_PATH), exist_ok=True)
+    tmp_path = f"{CLAIMS_INDEX_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, CLAIMS_INDEX_PATH)
+    _claims_version = _file_version()
+
+
+@contextlib.contextmanager
+def _persisted_index():
+    """The persisted index, freshly loaded, locked against other threads and
+    processes until the block's changes are saved."""
+    with _claims_lock:
+        os.makedirs(os.path.dirname(CLAIMS_INDEX_PATH), exist_ok=True)
+        with open(f"{CLAIMS_INDEX_PATH}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = _load()
+                yield index
+                _save(index)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _index_for_update(index: dict | None):
+    """`index` (a shadow index, locked in-process only), or the persisted one."""
+    if index is None:
+        with _persisted_index() as persisted:
+            yield persisted
+    else:
+        with _claims_lock:
+            yield index
+
+
+def index_claims(records: list[dict], index: dict | None = None) -> int:
+    """Extract claims from upserted records ({id, metadata}) and refresh the table.
+
+    Claims previously indexed for the same files are replaced. Returns the
+    number of claims extracted. With `index` (from new_claims_index()) that
+    table is updated in memory instead of the persisted one.
+    """
+    new_claims, seen = [], set()
+    for r in records:
+        meta = r["metadata"]
+        for c in extract_claims(meta.get("text", ""), meta, r["id"]):
+            # Chunk overlap repeats sentences; keep one claim per (file, metric, value, sentence)
+            key = (c["source"], c["metric"], c["value"], c["text"][:80])
+            if key not in seen:
+                seen.add(key)
+                new_claims.append(c)
+
+    sources = {r["metadata"].get("filename", r["id"]) for r in records}
+    with _index_for_update(index) as index:
+        claims = [c for c in index["claims"] if c["source"] not in sources] + new_claims
+        index["claims"] = claims
+        index["contradictions"] = update_contradictions(index["contradictions"], claims, sources)
+    return len(new_claims)
+
+
+def clear_claims(filename: str | None = None, index: dict | None = None):
+    """Drop every claim (or just one file's) and update the table
+    (`index`, or the persisted one)."""
+    with _index_for_update(index) as index:
+        if filename is None:
+            index.update(new_claims_index())
+            return
+        index["claims"] = [c for c in index["claims"] if c["source"] != filename]
+        index["contradictions"] = update_contradictions(index["contradictions"], index["claims"], {filename})
+
+
+def replace_claims_index(index: dict):
+    """Persist `index` as the live claim table (blue/green swap)."""
+    with _persisted_index() as persisted:
+        persisted.clear()
+        persisted.update(index)
+
+
+def list_conflicts(topic: str | None = None, filename: str | None = None) -> list[dict]:
+    """Pre-computed contradictions, optionally filtered by topic or source file."""
+    return [
+        c for c in _load()["contradictions"]
+        if (topic is None or c["topic"] == topic) and (filename is None or filename in c["sources"])
+    ]
+
+
+def conflicts_for_chunks(chunk_ids: list[str]) -> list[dict]:
+    """Known contradictions that involve at least one of the given chunks."""
+    wanted = set(chunk_ids)
+    hits = [c for c in _load()["contradictions"] if wanted.intersection(c["chunk_ids"])]
+    # Conflicts where both sides were retrieved first
+    return sorted(hits, key=lambda c: -len(wanted.intersection(c["chunk_ids"])))
@@ -0,0 +1,67 @@
+"""
+Single-flight request coalescing for the query pipeline.
+
+When a dashboard tile refreshes for many viewers at once, identical queries
+arrive within milliseconds of each other. The first one (the "leader") runs
+the pipeline; every identical request that arrives while it is in flight
+awaits the leader's result instead of embedding, searching and calling the
+LLM again. Once the leader finishes the key is released, so later requests
+get a fresh answer — this is coalescing, not caching.
+
+Keys are (mode, normalized query, latency budget, session id). Coalescing is
+per worker process.
+"""
+import asyncio
+
+_in_flight: dict[tuple, asyncio.Task] = {}
+
+COALESCE_STATS = {
+    "requests": 0,
+    "executions": 0,
+    "coalesced": 0,
+    "max_waiters": 0,
+}
+_waiters: dict[tuple, int] = {}
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the coalescing key."""
+    return " ".join(query.split()).casefold()
+
+
+def _release(key: tuple, task: asyncio.Task):
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+        del _waiters[key]
+
+
+async def single_flight(key: tuple, fn):
+    """Await `fn()` for `key`, sharing one execution among concurrent callers.
+
+    The execution runs in its own task, so a caller that disconnects (and is
+    cancelled) never cancels the result the other callers are waiting for.
+    Exceptions are shared with every caller just like results.
+    """
+    COALESCE_STATS["requests"] += 1
+    task = _in_flight.get(key)
+    if task is None:
+        COALESCE_STATS["executions"] += 1
+        task = asyncio.ensure_future(fn())
+        _in_flight[key] = task
+        _waiters[key] = 1
+        task.add_done_callback(lambda t: _release(key, t))
+    else:
+        COALESCE_STATS["coalesced"] += 1
+        _waiters[key] += 1
+    COALESCE_STATS["max_waiters"] = max(COALESCE_STATS["max_waiters"], _waiters[key])
+    return await asyncio.shield(task)
+
+
+def get_coalesce_stats() -> dict:
+    requests = COALESCE_STATS["requests"]
+    return {
+        **COALESCE_STATS,
+        "in_flight": len(_in_flight),
+        # Share of requests served by another request's execution
+        "coalescing_ratio": round(COALESCE_STATS["coalesced"] / requests, 4) if requests else 0.0,
+    }
@@ -0,0 +1,144 @@
+"""
+Context builder for the LLM prompt.
+
+The naive format repeats a full metadata block per chunk and, because chunks
+are split with a 50-char overlap, adjacent chunks of one file repeat text too.
+`build_context` instead:
+  1. Groups retrieved chunks by source file.
+  2. Merges adjacent chunks ({file}_chunk_{i}, {file}_chunk_{i+1}) and strips
+     the overlapping text between them.
+  3. Emits the metadata once per source document.
+  4. Packs merged segments in priority order (best fused score first) into a
+     token budget, dropping or truncating the lowest-priority chunks first.
+"""
+import json
+import os
+import re
+
+# Rough DeepSeek/GPT-style estimate; good enough for budgeting, no tokenizer needed.
+CHARS_PER_TOKEN = 4
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Longest overlap we look for between neighbouring chunks (splitter overlap is 50
+# chars, but it snaps to whitespace so the real overlap can be a little longer).
+MAX_OVERLAP_CHARS = 200
+
+_CHUNK_ID_RE = re.compile(r"^(.*)_chunk_(\d+)$")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def naive_context(docs: list[dict]) -> str:
+    """The original per-chunk format (kept for comparisons and benchmarks)."""
+    docs_text = ""
+    for d in docs:
+        meta_safe = {k: v for k, v in d["metadata"].items() if k != "text"}
+        docs_text += f"---\nID: {d['id']}\nScore: {d['score']}\nMetadata: {json.dumps(meta_safe)}\nContent: {d['content']}\n"
+    return docs_text
+
+
+def _overlap(prev: str, nxt: str) -> int:
+    """Length of the longest suffix of `prev` that is a prefix of `nxt`."""
+    for n in range(min(len(prev), len(nxt), MAX_OVERLAP_CHARS), 0, -1):
+        if prev.endswith(nxt[:n]):
+            return n
+    return 0
+
+
+def _source_key(doc: dict) -> tuple[str, int | None]:
+    match = _CHUNK_ID_RE.match(doc["id"])
+    filename = doc["metadata"].get("filename") or (match.group(1) if match else doc["id"])
+    return filename, int(match.group(2)) if match else None
+
+
+def _group_sources(docs: list[dict], stats: dict) -> list[dict]:
+    """Group chunks per file and merge runs of adjacent chunk indices."""
+    sources: dict[str, dict] = {}
+    for priority, d in enumerate(docs):
+        filename, chunk_no = _source_key(d)
+        src = sources.setdefault(filename, {"filename": filename, "priority": priority, "metadata": d["metadata"], "chunks": []})
+        src["chunks"].append({"id": d["id"], "no": chunk_no, "priority": priority, "score": d["score"], "content": d["content"]})
+
+    for src in sources.values():
+        src["chunks"].sort(key=lambda c: (c["no"] is None, c["no"] if c["no"] is not None else c["priority"]))
+        segments = []
+        for c in src["chunks"]:
+            prev = segments[-1] if segments else None
+            if prev and c["no"] is not None and prev["last_no"] is not None and c["no"] == prev["last_no"] + 1:
+                cut = _overlap(prev["text"], c["content"])
+                stats["overlap_chars_stripped"] += cut
+                stats["chunks_merged"] += 1
+                prev["text"] += c["content"][cut:]
+                prev["ids"].append(c["id"])
+                prev["last_no"] = c["no"]
+                prev["priority"] = min(prev["priority"], c["priority"])
+                prev["score"] = max(prev["score"], c["score"])
+            else:
+                segments.append({"ids": [c["id"]], "text": c["content"], "last_no": c["no"], "priority": c["priority"], "score": c["score"]})
+        src["segments"] = segments
+    return sorted(sources.values(), key=lambda s: s["priority"])
+
+
+def _source_header(src: dict) -> str:
+    meta_safe = {k: v for k, v in src["metadata"].items() if k != "text"}
+    return f"=== Source: {src['filename']} ===\nMetadata: {json.dumps(meta_safe)}\n"
+
+
+def _segment_text(seg: dict, text: str) -> str:
+    return f"---\nID: {', '.join(seg['ids'])}\nScore: {seg['score']}\nContent: {text}\n"
+
+
+def build_context(docs: list[dict], token_budget: int | None = None) -> tuple[str, dict]:
+    """Build the packed documents block for the prompt. Returns (text, stats)."""
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    stats = {
+        "chunks_in": len(docs),
+        "sources": 0,
+        "chunks_merged": 0,
+        "overlap_chars_stripped": 0,
+        "segments_dropped": 0,
+        "segments_truncated": 0,
+        "token_budget": budget,
+    }
+    sources = _group_sources(docs, stats)
+    stats["sources"] = len(sources)
+
+    # Pack segments by priority; a source's header is paid for with its first segment.
+    segments = sorted(
+        ((src, pos, seg) for src in sources for pos, seg in enumerate(src["segments"])),
+        key=lambda item: item[2]["priority"],
+    )
+    kept: dict[str, list[tuple[int, str]]] = {}
+    used = 0
+    for src, pos, seg in segments:
+        header = _source_header(src) if src["filename"] not in kept else ""
+        block = _segment_text(seg, seg["text"])
+        cost = estimate_tokens(header + block)
+        if used + cost <= budget:
+            kept.setdefault(src["filename"], []).append((pos, block))
+            used += cost
+            continue
+
+        # Truncate to whatever room is left (always keep something of the top segment)
+        room_chars = (budget - used - estimate_tokens(header + _segment_text(seg, ""))) * CHARS_PER_TOKEN
+        if room_chars >= 200 or not kept:
+            text = seg["text"][:max(room_chars, 200)].rsplit(" ", 1)[0] + " …"
+            block = _segment_text(seg, text)
+            kept.setdefault(src["filename"], []).append((pos, block))
+            used += estimate_tokens(header + block)
+            stats["segments_truncated"] += 1
+        else:
+            stats["segments_dropped"] += 1
+
+    # Sources in priority order; segments within a source in document order
+    docs_text = ""
+    for src in sources:
+        if src["filename"] in kept:
+            docs_text += _source_header(src) + "".join(block for _, block in sorted(kept[src["filename"]]))
+
+    stats["naive_tokens"] = estimate_tokens(naive_context(docs))
+    stats["packed_tokens"] = estimate_tokens(docs_text)
+    stats["tokens_saved"] = stats["naive_tokens"] - stats["packed_tokens"]
+    return docs_text, stats
@@ -0,0 +1,261 @@
+"""
+Compact, columnar in-memory corpus for BM25.
+
+Replaces the list-of-dicts corpus + rank_bm25.BM25Okapi pair, which keeps a
+full metadata dict and a term-frequency dict per chunk (several GB per worker
+at 100k+ chunks). Here every per-chunk field lives in a flat column:
+
+  - ids / text      : one contiguous UTF-8 buffer each, sliced via offsets
+  - doc lengths     : array('I')
+  - department / filename / source : interned string table + array('I') refs
+  - other metadata  : interned JSON blob (chunks of one file share the same one)
+  - term frequencies: inverted postings in packed arrays (term → docs, tfs)
+
+Scoring reproduces BM25Okapi exactly (same k1/b/epsilon, same IDF floor), so
+rankings are unchanged; it only touches the postings of the query terms.
+"""
+import heapq
+import json
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+INTERNED_FIELDS = ("department", "filename", "source")
+_MISSING = 0xFFFFFFFF
+
+
+class CompactCorpus:
+    """Append chunks with `add()`, call `finalize()`, then query with `top_k()`."""
+
+    def __init__(self, tokenize):
+        self._tokenize = tokenize
+
+        # Interned strings shared by every column that references them
+        self.strings: list[str] = []
+        self._string_refs: dict[str, int] = {}
+
+        # Per-document columns
+        self.id_buf = bytearray()
+        self.id_offsets = array("Q", [0])
+        self.text_buf = bytearray()
+        self.text_offsets = array("Q", [0])
+        self.doc_len = array("I")
+        self.field_refs = {f: array("I") for f in INTERNED_FIELDS}
+        self.extra_refs = array("I")
+
+        # Vocabulary and postings. While building, postings are kept doc-major
+        # (doc_terms/doc_tfs, doc_nterms entries per doc); finalize() converts
+        # them to term-major.
+        self.vocab: dict[str, int] = {}
+        self._doc_terms = array("I")
+        self._doc_tfs = array("H")
+        self._doc_nterms = array("I")
+        self.term_offsets = array("Q")
+        self.post_docs = array("I")
+        self.post_tfs = array("H")
+        self.idf = array("d")
+
+        # Tombstones: indices of deleted docs, skipped by top_k until the
+        # next rebuild drops them (see tombstone())
+        self.deleted: set[int] = set()
+        # filename → indices of its docs, so tombstone() costs O(chunks of
+        # the file) rather than a scan of every doc (see _filename_index())
+        self._docs_by_filename: dict[str, array] | None = None
+        self.avgdl = 0.0
+
+    # ─── Building ─────────────────────────────────────────────────────────
+
+    def _intern(self, value: str) -> int:
+        ref = self._string_refs.get(value)
+        if ref is None:
+            ref = len(self.strings)
+            self.strings.append(value)
+            self._string_refs[value] = ref
+        return ref
+
+    def add(self, doc_id: str, metadata: dict):
+        """Append one chunk (its metadata must carry the chunk `text`)."""
+        text = metadata.get("text", "")
+        self.id_buf += doc_id.encode("utf-8")
+        self.id_offsets.append(len(self.id_buf))
+        self.text_buf += text.encode("utf-8")
+        self.text_offsets.append(len(self.text_buf))
+
+        extra = {}
+        for key, value in metadata.items():
+            if key == "text":
+                continue
+            if key in self.field_refs and isinstance(value, str):
+                continue
+            extra[key] = value
+        for field, refs in self.field_refs.items():
+            value = metadata.get(field)
+            refs.append(self._intern(value) if isinstance(value, str) else _MISSING)
+        self.extra_refs.append(self._intern(json.dumps(extra, sort_keys=True)) if extra else _MISSING)
+
+        tokens = self._tokenize(text)
+        self.doc_len.append(len(tokens))
+        counts = Counter(tokens)
+        self._doc_nterms.append(len(counts))
+        vocab = self.vocab
+        for term in counts:
+            if term not in vocab:
+                vocab[term] = len(vocab)
+        self._doc_terms.extend([vocab[term] for term in counts])
+        tfs = counts.values()
+        # tf is packed as uint16; clamp the (pathological) longer runs
+        self._doc_tfs.extend(tfs if max(tfs, default=0) <= 0xFFFF else [min(tf, 0xFFFF) for tf in tfs])
+
+    def finalize(self):
+        """Build term-major postings and BM25Okapi-compatible IDF values."""
+        n_terms = len(self.vocab)
+        doc_freq = array("Q", bytes(8 * n_terms))
+        for term_id in self._doc_terms:
+            doc_freq[term_id] += 1
+
+        self.term_offsets = array("Q", [0])
+        total = 0
+        for df in doc_freq:
+            total += df
+            self.term_offsets.append(total)
+
+        # Counting sort from doc-major to term-major order; docs stay ascending
+        cursor = array("Q", self.term_offsets[:-1])
+        self.post_docs = array("I", bytes(4 * total))
+        self.post_tfs = array("H", bytes(2 * total))
+        pos = 0
+        for doc, n_doc_terms in enumerate(self._doc_nterms):
+            for _ in range(n_doc_terms):
+                term_id = self._doc_terms[pos]
+                slot = cursor[term_id]
+                self.post_docs[slot] = doc
+                self.post_tfs[slot] = self._doc_tfs[pos]
+                cursor[term_id] = slot + 1
+                pos += 1
+        self._doc_terms = array("I")
+        self._doc_tfs = array("H")
+        self._doc_nterms = array("I")
+
+        n_docs = len(self.doc_len)
+        self.avgdl = sum(self.doc_len) / n_docs if n_docs else 0.0
+
+        # Same IDF (and negative-IDF floor) as rank_bm25.BM25Okapi._calc_idf
+        idf = array("d", bytes(8 * n_terms))
+        idf_sum = 0.0
+        negative = []
+        for term_id, df in enumerate(doc_freq):
+            value = math.log(n_docs - df + 0.5) - math.log(df + 0.5)
+            idf[term_id] = value
+            idf_sum += value
+            if value < 0:
+                negative.append(term_id)
+        if n_terms:
+            eps = EPSILON * (idf_sum / n_terms)
+            for term_id in negative:
+                idf[term_id] = eps
+        self.idf = idf
+        self._filename_index()
+        return self
+
+    # ─── Queries ──────────────────────────────────────────────────────────
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def doc_id(self, i: int) -> str:
+        return str(self.id_buf[self.id_offsets[i]:self.id_offsets[i + 1]], "utf-8")
+
+    def text(self, i: int) -> str:
+        return str(self.text_buf[self.text_offsets[i]:self.text_offsets[i + 1]], "utf-8")
+
+    def metadata(self, i: int) -> dict:
+        """Rebuild the chunk's metadata dict (including `text`) on demand."""
+        extra_ref = self.extra_refs[i]
+        meta = json.loads(self.strings[extra_ref]) if extra_ref != _MISSING else {}
+        for field, refs in self.field_refs.items():
+            ref = refs[i]
+            if ref != _MISSING:
+                meta[field] = self.strings[ref]
+        meta["text"] = self.text(i)
+        return meta
+
+    def scores(self, query_tokens: list[str], lo: int = 0, hi: int | None = None) -> dict[int, float]:
+        """Sparse BM25 scores {doc index: score} for docs matching any query term.
+
+        With a doc range [lo, hi) only that slice of each posting list is
+        scored (a shard, see rag/lexical_shards.py). IDF and avgdl stay
+        corpus-wide, so a doc's score is the same as in a full scan.
+        """
+        scores: dict[int, float] = {}
+        avgdl = self.avgdl
+        ranged = lo > 0 or hi is not None
+        for token in query_tokens:
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            idf = self.idf[term_id]
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            if ranged:
+                # Postings are doc-ascending
+                start = bisect_left(self.post_docs, lo, start, end)
+                if hi is not None:
+                    end = bisect_left(self.post_docs, hi, start, end)
+            for p in range(start, end):
+                doc = self.post_docs[p]
+                tf = self.post_tfs[p]
+                norm = tf + K1 * (1 - B + B * self.doc_len[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * (tf * (K1 + 1) / norm)
+        return scores
+
+    def top_k(self, query_tokens: list[str], k: int, lo: int = 0, hi: int | None = None) -> list[tuple[int, float]]:
+        """Top-k (doc index, score) pairs with score > 0, ties broken by index
+        (among docs [lo, hi) when given)."""
+        scores = self.scores(query_tokens, lo, hi)
+        deleted = self.deleted
+        best = heapq.nsmallest(k, ((-s, doc) for doc, s in scores.items() if s > 0 and doc not in deleted))
+        return [(doc, -neg) for neg, doc in best]
+
+    def tombstone(self, filenames) -> int:
+        """Hide every chunk of the given files from top_k without rebuilding.
+
+        IDF and average length still count the deleted chunks until the next
+        rebuild, as in any tombstoned index. Returns the chunks newly hidden.
+        """
+        docs_by_filename = self._filename_index()
+        before = len(self.deleted)
+        for filename in set(filenames):
+            self.deleted.update(docs_by_filename.get(filename, ()))
+        return len(self.deleted) - before
+
+    def _filename_index(self) -> dict[str, array]:
+        """filename → doc indices, built once per corpus (by finalize(), or on
+        the first tombstone of a mapped generation)."""
+        if self._docs_by_filename is None:
+            by_ref: dict[int, array] = {}
+            for i, ref in enumerate(self.field_refs["filename"]):
+                if ref != _MISSING:
+                    docs = by_ref.get(ref)
+                    if docs is None:
+                        docs = by_ref[ref] = array("I")
+                    docs.append(i)
+            self._docs_by_filename = {self.strings[ref]: docs for ref, docs in by_ref.items()}
+        return self._docs_by_filename
+
+    def iter_docs(self):
+        """Yield (id, metadata) for every chunk, e.g. to write a snapshot."""
+        for i in range(len(self)):
+            yield self.doc_id(i), self.metadata(i)
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the columnar buffers (excluding interned strs)."""
+        columns = [
+            self.id_buf, self.id_offsets, self.text_buf, self.text_offsets, self.doc_len,
+            self.extra_refs, self.term_offsets, self.post_docs, self.post_tfs, self.idf,
+            *self.field_refs.values(),
+        ]
+        return sum(len(c) * (c.itemsize if isinstance(c, array) else 1) for c in columns)
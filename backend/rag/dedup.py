@@ -0,0 +1,327 @@
+"""
+Near-duplicate chunk detection with MinHash + LSH.
+
+Re-uploads under a new name, overlapping splits and boilerplate-heavy chunks
+produce chunks that are almost, but not byte-for-byte, identical. They waste
+index space, LLM tokens and — worst — result slots in the top-5.
+
+  - Ingestion: every chunk gets a MinHash signature over word 3-gram shingles.
+    LSH banding (8 bands × 8 rows) finds candidate near-duplicates among the
+    already indexed chunks and the rest of the batch; candidates are confirmed
+    by estimated Jaccard similarity >= DEDUP_THRESHOLD. DEDUP_POLICY decides
+    what happens to a near-duplicate:
+        skip    : not embedded, not upserted
+        cluster : upserted, tagged with metadata["dup_of"] = representative id
+        off     : no detection
+  - Retrieval: `collapse_near_duplicates` keeps one result per cluster after
+    RRF, so a cluster occupies a single slot.
+
+The LSH index is one JSON file shared by every process that ingests (API
+workers, scripts.ingest). Each update reloads it if another process rewrote
+it and holds a cross-process lock from load to save, so no process drops
+the others' signatures.
+
+Under `skip`, a skipped chunk's content lives only in its representative.
+When the representative goes away (its document is deleted or replaced),
+the files whose chunks were skipped against it are listed by
+`pop_orphaned_files` so the caller can re-ingest them.
+"""
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no lock needed
+    fcntl = None
+
+DEDUP_POLICY = os.environ.get("DEDUP_POLICY", "cluster")
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+LSH_INDEX_PATH = os.environ.get(
+    "LSH_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "lsh_index.json"),
+)
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+VECTOR_BYTES = 384 * 4  # float32 embedding stored per vector
+
+# Each blake2b digest (64 bytes) yields 16 independent 32-bit hash values, so
+# 4 salted digests per shingle give the 64 "permutations" without per-value
+# arithmetic in Python.
+_SALTS = [f"minhash-{i}".encode() for i in range(NUM_PERM // 16)]
+_UNPACK = struct.Struct("<16I").unpack
+
+
+def _shingles(text: str) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> list[int]:
+    """64-value MinHash signature of the text's word 3-grams."""
+    rows = []
+    for shingle in _shingles(text):
+        data = shingle.encode("utf-8")
+        row = []
+        for salt in _SALTS:
+            row.extend(_UNPACK(hashlib.blake2b(data, digest_size=64, salt=salt).digest()))
+        rows.append(row)
+    return list(map(min, zip(*rows)))
+
+
+def band_keys(signature: list[int]) -> list[str]:
+    """LSH bucket keys, one per band."""
+    return [
+        f"{band}:" + hashlib.blake2b(json.dumps(signature[band * ROWS:(band + 1) * ROWS]).encode(), digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+def similarity(sig_a: list[int], sig_b: list[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+
+# ─── Persistent LSH index of ingested chunks ────────────────────────────────
+_lsh_index = None
+_lsh_version = None
+_lsh_lock = threading.Lock()
+
+DEDUP_STATS = {
+    "chunks_seen": 0,
+    "near_duplicates": 0,
+    "skipped": 0,
+    "clustered": 0,
+    "text_bytes_saved": 0,
+    "vector_bytes_saved": 0,
+}
+
+
+def new_lsh_index() -> dict:
+    # skipped_by: representative id -> files with chunks skipped as its duplicates
+    # orphaned:   files whose representatives were removed (see pop_orphaned_files)
+    return {"signatures": {}, "buckets": {}, "files": {}, "skipped_by": {}, "orphaned": []}
+
+
+def _file_version():
+    try:
+        st = os.stat(LSH_INDEX_PATH)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _load() -> dict:
+    """Cached index, reloaded when another process (e.g. scripts.ingest) rewrote it."""
+    global _lsh_index, _lsh_version
+    version = _file_version()
+    if _lsh_index is None or version != _lsh_version:
+        if version is not None:
+            with open(LSH_INDEX_PATH, "r", encoding="utf-8") as f:
+                _lsh_index = {**new_lsh_index(), **json.load(f)}
+        else:
+            _lsh_index = new_lsh_index()
+        _lsh_version = version
+    return _lsh_index
+
+
+def _save(index: dict):
+    global _lsh_version
+    os.makedirs(os.path.dirname(LSH_INDEX_PATH), exist_ok=True)
+    tmp_path = f"{LSH_INDEX_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, LSH_INDEX_PATH)
+    _lsh_version = _file_version()
+
+
+@contextlib.contextmanager
+def _persisted_index():
+    """The persisted index, freshly loaded, locked against other threads and
+    processes until the block's changes are saved."""
+    with _lsh_lock:
+        os.makedirs(os.path.dirname(LSH_INDEX_PATH), exist_ok=True)
+        with open(f"{LSH_INDEX_PATH}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = _load()
+                yield index
+                _save(index)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _index_for_update(index: dict | None):
+    """`index` (a shadow index, locked in-process only), or the persisted one."""
+    if index is None:
+        with _persisted_index() as persisted:
+            yield persisted
+    else:
+        with _lsh_lock:
+            index.setdefault("skipped_by", {})
+            index.setdefault("orphaned", [])
+            yield index
+
+
+def _forget(index: dict, chunk_ids) -> dict[str, list[int]]:
+    """Remove chunks' signatures; returns the removed {id: signature}."""
+    removed = {}
+    for chunk_id in chunk_ids:
+        signature = index["signatures"].pop(chunk_id, None)
+        if signature is None:
+            continue
+        removed[chunk_id] = signature
+        for key in band_keys(signature):
+            bucket = index["buckets"].get(key, [])
+            if chunk_id in bucket:
+                bucket.remove(chunk_id)
+                if not bucket:
+                    del index["buckets"][key]
+    return removed
+
+
+def _orphan(index: dict, chunk_ids):
+    """Representatives gone: queue the files of their skipped duplicates."""
+    for chunk_id in chunk_ids:
+        for filename in index["skipped_by"].pop(chunk_id, []):
+            if filename not in index["orphaned"]:
+                index["orphaned"].append(filename)
+
+
+def _find_duplicate(index: dict, signature: list[int]):
+    best, best_sim = None, 0.0
+    for key in band_keys(signature):
+        for candidate in index["buckets"].get(key, []):
+            sim = similarity(signature, index["signatures"][candidate])
+            if sim > best_sim:
+                best, best_sim = candidate, sim
+    return (best, best_sim) if best_sim >= DEDUP_THRESHOLD else (None, best_sim)
+
+
+def dedup_records(records: list[dict], policy: str | None = None, index: dict | None = None) -> tuple[list[dict], dict]:
+    """Apply the near-duplicate policy to records ({id, metadata}) before embedding.
+
+    Re-ingesting a file first forgets that file's previous chunks, so a file
+    never deduplicates against its own older version. Returns the records to
+    embed and upsert, plus stats for this batch.
+
+    With `index` (from new_lsh_index(), e.g. for a blue/green rebuild) the
+    records are checked against and added to that index instead of the
+    persisted one, which is left untouched.
+    """
+    policy = policy or DEDUP_POLICY
+    stats = {"chunks_seen": len(records), "near_duplicates": 0, "skipped": 0, "clustered": 0,
+             "text_bytes_saved": 0, "vector_bytes_saved": 0}
+    if policy == "off" or not records:
+        return records, stats
+
+    kept = []
+    with _index_for_update(index) as index:
+        removed = {}
+        for filename in {r["metadata"].get("filename") for r in records}:
+            removed.update(_forget(index, index["files"].pop(filename, [])))
+
+        for r in records:
+            signature = minhash(r["metadata"].get("text", ""))
+            duplicate_of, _ = _find_duplicate(index, signature)
+            if duplicate_of is not None:
+                stats["near_duplicates"] += 1
+                if policy == "skip":
+                    stats["skipped"] += 1
+                    stats["text_bytes_saved"] += len(r["metadata"].get("text", "").encode("utf-8"))
+                    stats["vector_bytes_saved"] += VECTOR_BYTES
+                    skipped_by = index["skipped_by"].setdefault(duplicate_of, [])
+                    if r["metadata"].get("filename", "") not in skipped_by:
+                        skipped_by.append(r["metadata"].get("filename", ""))
+                    continue
+                stats["clustered"] += 1
+                r["metadata"]["dup_of"] = duplicate_of
+
+            kept.append(r)
+            index["signatures"][r["id"]] = signature
+            for key in band_keys(signature):
+                index["buckets"].setdefault(key, []).append(r["id"])
+            index["files"].setdefault(r["metadata"].get("filename", ""), []).append(r["id"])
+
+        # Re-ingested chunks whose content changed no longer represent their duplicates
+        _orphan(index, [cid for cid, sig in removed.items() if index["signatures"].get(cid) != sig])
+
+    for key, value in stats.items():
+        DEDUP_STATS[key] += value
+    return kept, stats
+
+
+def forget_file(filename: str, index: dict | None = None):
+    """Drop a deleted file's signatures (from `index`, or the persisted index)."""
+    with _index_for_update(index) as index:
+        _orphan(index, _forget(index, index["files"].pop(filename, [])))
+
+
+def pop_orphaned_files(index: dict | None = None) -> list[str]:
+    """Files with chunks skipped as duplicates of chunks since removed. They
+    must be re-ingested, or that content is no longer indexed anywhere."""
+    with _index_for_update(index) as index:
+        orphaned, index["orphaned"] = index["orphaned"], []
+    return orphaned
+
+
+def clear_lsh_index():
+    """Forget every indexed signature (used when the vector index is wiped)."""
+    replace_lsh_index(new_lsh_index())
+
+
+def replace_lsh_index(index: dict):
+    """Persist `index` as the live LSH index (blue/green swap)."""
+    with _persisted_index() as persisted:
+        persisted.clear()
+        persisted.update(new_lsh_index(), **index)
+
+
+def get_dedup_stats() -> dict:
+    with _lsh_lock:
+        index = _load()
+    return {"policy": DEDUP_POLICY, "threshold": DEDUP_THRESHOLD, "indexed_chunks": len(index["signatures"]), **DEDUP_STATS}
+
+
+# ─── Retrieval-time collapse ────────────────────────────────────────────────
+
+@functools.lru_cache(maxsize=4096)
+def _cached_signature(text: str) -> tuple[int, ...]:
+    # Popular chunks come back query after query; don't re-hash them each time
+    return tuple(minhash(text))
+
+
+def collapse_near_duplicates(results: list[dict]) -> list[dict]:
+    """Keep the best-ranked result of each near-duplicate cluster.
+
+    Clusters come from the ingest-time `dup_of` tag when present, otherwise
+    from MinHash similarity of the candidates' text. Collapsed ids are listed
+    under the survivor's "near_duplicates" key.
+    """
+    kept, signatures = [], []
+    for r in results:
+        meta = r.get("metadata", {})
+        cluster = meta.get("dup_of", r["id"])
+        signature = _cached_signature(meta.get("text", ""))
+        for survivor, survivor_sig in zip(kept, signatures):
+            survivor_cluster = survivor["metadata"].get("dup_of", survivor["id"])
+            if cluster == survivor_cluster or similarity(signature, survivor_sig) >= DEDUP_THRESHOLD:
+                survivor.setdefault("near_duplicates", []).append(r["id"])
+                break
+        else:
+            kept.append(r)
+            signatures.append(signature)
+    return kept
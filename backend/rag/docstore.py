@@ -0,0 +1,272 @@
+"""
+Local document store: chunk text and full metadata, keyed by chunk id.
+
+Pinecone holds every chunk's full `text` in its metadata: every vector
+query returns it, the lexical rebuild has to fetch all of it back, and the
+40 KB metadata limit caps the chunk size. This store keeps a local copy:
+
+  - Ingestion writes each chunk's text and metadata here, then upserts its
+    vector. With DOCSTORE_SLIM_PINECONE=1 the upsert carries slim metadata
+    (every field except `text`; the other fields are short and stay
+    filterable) and this store becomes the only copy of the text.
+  - Queries hydrate the text of candidates that lack it with one batch
+    lookup (see `hydrate`), after fusion has cut them down to a few; chunks
+    missing here are fetched from Pinecone.
+  - With slim metadata, the lexical index is rebuilt from this store instead
+    of a Pinecone scan once the namespace is complete.
+
+Set DOCSTORE_SLIM_PINECONE=1 only when DOCSTORE_PATH is on storage that
+every host shares and that survives redeploys. The default deployment
+(Render's disk is wiped on redeploy; scripts.ingest runs from another
+machine) keeps the text in Pinecone, which stays the source of truth: the
+lexical rebuild always scans it and backfills this store as a cache.
+
+Rows are keyed by (namespace, chunk id) so a blue/green shadow namespace has
+its own copy. A namespace is marked complete only by a scan in which every
+chunk had its text (`corpus_docs`).
+
+One SQLite file (DOCSTORE_PATH) in WAL mode, shared by every worker process;
+each thread uses its own connection.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+DOCSTORE_PATH = os.environ.get(
+    "DOCSTORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "docstore.sqlite3"),
+)
+# Drop `text` from Pinecone metadata (only with DOCSTORE_PATH on shared,
+# persistent storage, see above)
+DOCSTORE_SLIM_PINECONE = os.environ.get("DOCSTORE_SLIM_PINECONE", "0") == "1"
+# SQLite's default limit on bound parameters per statement is 999 on old builds
+LOOKUP_BATCH = 500
+
+DOCSTORE_STATS = {
+    "chunks_written": 0,
+    "lookups": 0,
+    "chunks_hydrated": 0,
+    "chunks_missing": 0,
+    "backfilled": 0,
+    "pinecone_fetched": 0,
+    "scan_dropped": 0,
+}
+
+_local = threading.local()
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    id        TEXT NOT NULL,
+    text      TEXT NOT NULL,
+    metadata  TEXT NOT NULL,
+    PRIMARY KEY (namespace, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS namespaces (
+    namespace TEXT PRIMARY KEY,
+    complete  INTEGER NOT NULL
+);
+"""
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DOCSTORE_PATH:
+        os.makedirs(os.path.dirname(DOCSTORE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DOCSTORE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn, _local.path = conn, DOCSTORE_PATH
+    return conn
+
+
+# ─── Writes ─────────────────────────────────────────────────────────────────
+
+def slim_metadata(metadata: dict) -> dict:
+    """What Pinecone keeps: everything but the text."""
+    return {k: v for k, v in metadata.items() if k != "text"}
+
+
+def pinecone_records(records: list[dict]) -> list[dict]:
+    """{id, values, metadata} records for upsert (metadata slimmed with
+    DOCSTORE_SLIM_PINECONE)."""
+    if not DOCSTORE_SLIM_PINECONE:
+        return [{"id": r["id"], "values": r["values"], "metadata": r["metadata"]} for r in records]
+    return [{"id": r["id"], "values": r["values"], "metadata": slim_metadata(r["metadata"])} for r in records]
+
+
+def put_chunks(records: list[dict], namespace: str):
+    """Store {id, metadata (with text)} records, replacing earlier versions."""
+    rows = [
+        (namespace, r["id"], r["metadata"].get("text", ""), json.dumps(slim_metadata(r["metadata"])))
+        for r in records
+    ]
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+    DOCSTORE_STATS["chunks_written"] += len(rows)
+
+
+def delete_chunks(ids, namespace: str):
+    ids = list(ids)
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(0, len(ids), LOOKUP_BATCH):
+            batch = ids[i:i + LOOKUP_BATCH]
+            conn.execute(f"DELETE FROM chunks WHERE namespace = ? AND id IN ({','.join('?' * len(batch))})",
+                         [namespace, *batch])
+
+
+def clear_namespace(namespace: str):
+    """Delete a namespace's chunks; it is then complete (an empty index)."""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM chunks WHERE namespace = ?", (namespace,))
+        conn.execute("INSERT OR REPLACE INTO namespaces VALUES (?, 1)", (namespace,))
+
+
+def drop_namespace(namespace: str):
+    """Forget a retired namespace entirely."""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM chunks WHERE namespace = ?", (namespace,))
+        conn.execute("DELETE FROM namespaces WHERE namespace = ?", (namespace,))
+
+
+def mark_complete(namespace: str):
+    """Every chunk of the namespace is stored here (rebuilds need not scan Pinecone)."""
+    _conn().execute("INSERT OR REPLACE INTO namespaces VALUES (?, 1)", (namespace,))
+
+
+def is_complete(namespace: str) -> bool:
+    row = _conn().execute("SELECT complete FROM namespaces WHERE namespace = ?", (namespace,)).fetchone()
+    return bool(row and row[0])
+
+
+# ─── Reads ──────────────────────────────────────────────────────────────────
+
+def _metadata(text: str, metadata_json: str) -> dict:
+    metadata = json.loads(metadata_json)
+    metadata["text"] = text
+    return metadata
+
+
+def get_chunks(ids, namespace: str) -> dict[str, dict]:
+    """id → full metadata (with text) for the ids that are stored."""
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    conn = _conn()
+    for i in range(0, len(ids), LOOKUP_BATCH):
+        batch = ids[i:i + LOOKUP_BATCH]
+        rows = conn.execute(
+            f"SELECT id, text, metadata FROM chunks WHERE namespace = ? AND id IN ({','.join('?' * len(batch))})",
+            [namespace, *batch],
+        )
+        for chunk_id, text, metadata_json in rows:
+            found[chunk_id] = _metadata(text, metadata_json)
+    DOCSTORE_STATS["lookups"] += 1
+    return found
+
+
+def _fetch_from_pinecone(ids: list[str], namespace: str) -> dict[str, dict]:
+    """Full metadata of chunks stored in Pinecone with their text (backfilled here)."""
+    from rag.corpus_scan import _fetch
+    from rag.pinecone_utils import get_pinecone_index
+
+    index = get_pinecone_index()
+    found = {}
+    for i in range(0, len(ids), 100):  # Pinecone fetch limit
+        for chunk_id, metadata in _fetch(index, ids[i:i + 100], namespace).items():
+            if metadata and "text" in metadata:
+                found[chunk_id] = dict(metadata)
+    if found:
+        put_chunks([{"id": chunk_id, "metadata": m} for chunk_id, m in found.items()], namespace)
+        DOCSTORE_STATS["pinecone_fetched"] += len(found)
+    return found
+
+
+def hydrate(results: list[dict], namespace: str, fetch_missing: bool = True) -> list[dict]:
+    """Fill in the text (and full metadata) of results whose metadata lacks
+    it, with one batch lookup; chunks missing here are fetched from Pinecone
+    unless `fetch_missing` is False. The results are updated in place."""
+    missing = [r for r in results if "text" not in r.get("metadata", {})]
+    if not missing:
+        return results
+    found = get_chunks([r["id"] for r in missing], namespace)
+    absent = [r["id"] for r in missing if r["id"] not in found]
+    if absent and fetch_missing:
+        try:
+            found.update(_fetch_from_pinecone(absent, namespace))
+        except Exception as e:
+            # Counted as missing below; those results keep empty content
+            logger.warning("Fetching %d chunks from Pinecone failed: %s", len(absent), e)
+    for r in missing:
+        metadata = found.get(r["id"])
+        if metadata is None:
+            DOCSTORE_STATS["chunks_missing"] += 1
+            continue
+        r["metadata"] = {**r["metadata"], **metadata}
+        DOCSTORE_STATS["chunks_hydrated"] += 1
+    return results
+
+
+def iter_chunks(namespace: str):
+    """Yield {id, metadata (with text)} for every stored chunk, in id order."""
+    rows = _conn().execute(
+        "SELECT id, text, metadata FROM chunks WHERE namespace = ? ORDER BY id", (namespace,)
+    )
+    for chunk_id, text, metadata_json in rows:
+        yield {"id": chunk_id, "metadata": _metadata(text, metadata_json)}
+
+
+def count(namespace: str) -> int:
+    return _conn().execute("SELECT COUNT(*) FROM chunks WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+
+def corpus_docs(scan, namespace: str):
+    """Docs for a lexical rebuild of `namespace`: with DOCSTORE_SLIM_PINECONE,
+    from this store once it is complete; otherwise from `scan()` (a Pinecone
+    scan yielding pages of docs), backfilling this store with the text the
+    vectors carry and hydrating the rest from it. Only a scan in which no
+    chunk lacked its text marks the namespace complete."""
+    if DOCSTORE_SLIM_PINECONE and is_complete(namespace):
+        yield from iter_chunks(namespace)
+        return
+    page, dropped = [], [0]
+    for doc in scan():
+        page.append(doc)
+        if len(page) >= LOOKUP_BATCH:
+            yield from _backfill(page, namespace, dropped)
+            page = []
+    yield from _backfill(page, namespace, dropped)
+    if dropped[0]:
+        DOCSTORE_STATS["scan_dropped"] += dropped[0]
+    else:
+        mark_complete(namespace)
+
+
+def _backfill(docs: list[dict], namespace: str, dropped: list[int]):
+    with_text = [d for d in docs if "text" in d["metadata"]]
+    if with_text:
+        put_chunks(with_text, namespace)
+        DOCSTORE_STATS["backfilled"] += len(with_text)
+    # The scan just fetched these from Pinecone: only this store can add text
+    hydrate(docs, namespace, fetch_missing=False)
+    for doc in docs:
+        if "text" in doc["metadata"]:
+            yield doc
+        else:
+            dropped[0] += 1
+
+
+def get_docstore_stats() -> dict:
+    size = sum(os.path.getsize(path) for path in (DOCSTORE_PATH, DOCSTORE_PATH + "-wal") if os.path.exists(path))
+    return {**DOCSTORE_STATS, "path": DOCSTORE_PATH, "file_bytes": size, "slim_pinecone": DOCSTORE_SLIM_PINECONE}
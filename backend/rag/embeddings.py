@@ -8,45 +8,138 @@ Uses Matryoshka Representation Learning (MRL) with output_dimensionality=384
 to match our existing Pinecone index dimensions.
 """
 import os
-from google import genai
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from rag.resilience import call
 
 EMBEDDING_MODEL = "gemini-embedding-001"
 DIMENSIONS = 384  # Match existing Pinecone index
 
 _client = None
+_batcher_lock = threading.Lock()
 
 def _get_client():
     """Lazy client init — runs after load_dotenv() has been called."""
     global _client
     if _client is None:
+        from google import genai  # heavy SDK import deferred to first use
         api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY", "")
         _client = genai.Client(api_key=api_key)
     return _client
 
 
-def get_embedding(text: str) -> list[float]:
-    """Embed a single text string."""
-    client = _get_client()
-    result = client.models.embed_content(
+def _embed(texts: list[str], service: str = "gemini") -> list[list[float]]:
+    """One embed_content call for up to 100 texts (timeouts/retries/hedging per `service`)."""
+    result = call(service, lambda: _get_client().models.embed_content(
         model=EMBEDDING_MODEL,
-        contents=text,
+        contents=texts,
         config={"output_dimensionality": DIMENSIONS},
-    )
-    return result.embeddings[0].values
+    ))
+    return [e.values for e in result.embeddings]
+
+
+# ─── Query embedding micro-batcher ──────────────────────────────────────────
+# Concurrent queries each need one embedding. Instead of one embed_content call
+# per request, single-text requests are queued; a dispatcher thread collects
+# them for up to EMBED_BATCH_MAX_WAIT_MS (or until EMBED_BATCH_MAX_SIZE texts)
+# and sends a single batched call, then fans the vectors back out. Batches are
+# sent from a small pool so collection continues while a call is in flight.
+# EMBED_BATCH_MAX_WAIT_MS=0 disables batching.
+EMBED_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_SIZE = min(int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32")), 100)
+EMBED_BATCH_CONCURRENCY = int(os.environ.get("EMBED_BATCH_CONCURRENCY", "8"))
+
+EMBED_BATCH_STATS = {
+    "requests": 0,
+    "upstream_calls": 0,
+    "texts_sent": 0,
+    "largest_batch": 0,
+}
+
+
+class _EmbeddingBatcher:
+    def __init__(self, max_wait_ms: float, max_batch: int, concurrency: int):
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-batch")
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> list[float]:
+        future = Future()
+        self._queue.put((text, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._collect, name="embed-collector", daemon=True)
+                    self._thread.start()
+        return future.result()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = list(dict.fromkeys(text for text, _ in batch))  # identical texts embed once
+            # Stats are only written here, on the single collector thread
+            EMBED_BATCH_STATS["requests"] += len(batch)
+            EMBED_BATCH_STATS["upstream_calls"] += 1
+            EMBED_BATCH_STATS["texts_sent"] += len(texts)
+            EMBED_BATCH_STATS["largest_batch"] = max(EMBED_BATCH_STATS["largest_batch"], len(batch))
+            self._pool.submit(self._dispatch, batch, texts)
+
+    @staticmethod
+    def _dispatch(batch: list, texts: list[str]):
+        try:
+            vectors = dict(zip(texts, _embed(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+
+_batcher = None
+
+
+def get_embedding_batch_stats() -> dict:
+    calls = EMBED_BATCH_STATS["upstream_calls"]
+    return {
+        **EMBED_BATCH_STATS,
+        "max_wait_ms": EMBED_BATCH_MAX_WAIT_MS,
+        "max_batch": EMBED_BATCH_MAX_SIZE,
+        "mean_batch": round(EMBED_BATCH_STATS["requests"] / calls, 2) if calls else 0.0,
+    }
+
+
+def get_embedding(text: str) -> list[float]:
+    """Embed a single text string (micro-batched with concurrent callers)."""
+    global _batcher
+    if EMBED_BATCH_MAX_WAIT_MS <= 0:
+        return _embed([text])[0]
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = _EmbeddingBatcher(EMBED_BATCH_MAX_WAIT_MS, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_CONCURRENCY)
+    return _batcher.embed(text)
 
 
 def get_embeddings(texts: list[str]) -> list[list[float]]:
     """Embed a batch of text strings."""
-    client = _get_client()
     results = []
     # Gemini batch limit is 100 texts per call
     batch_size = 100
     for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        result = client.models.embed_content(
-            model=EMBEDDING_MODEL,
-            contents=batch,
-            config={"output_dimensionality": DIMENSIONS},
-        )
-        results.extend([e.values for e in result.embeddings])
+        results.extend(_embed(texts[i:i + batch_size], service="gemini_batch"))
     return results
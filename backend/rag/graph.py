@@ -1,19 +1,70 @@
 import os
 import json
-from typing import TypedDict, List
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from rag.hybrid_search import hybrid_search
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, List, Optional
+from rag.llm import get_llm
+from rag.llm_usage import invoke_llm
+from rag.context import CONTEXT_TOKEN_BUDGET, build_context
+from rag.hybrid_search import budgeted_hybrid_search
+from rag.sessions import session_search
+from rag.claims import conflicts_for_chunks
 from rag.prompts import CONFLICT_DETECTION_PROMPT
+from rag.slow_log import note, stage, start_trace, traced
+
+# Chunks retrieved per query. The context builder packs them into
+# CONTEXT_TOKEN_BUDGET tokens, so raising this no longer grows the prompt linearly.
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "5"))
+
+# Threads running the (I/O-bound) graph. asyncio's default executor is sized
+# from the CPU count — 5 threads on a 1-CPU instance — which capped concurrent
+# queries far below what the upstream APIs can take.
+QUERY_THREADS = int(os.environ.get("QUERY_THREADS", "32"))
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix="rag-query")
+
+# Latency budget. A query may carry budget_ms (default QUERY_BUDGET_MS, 0 =
+# unbounded); it becomes an absolute deadline in the graph state. The vector
+# leg gets VECTOR_BUDGET_SHARE of it before retrieval falls back to BM25
+# alone, and DeepSeek must answer before the deadline or the response falls
+# back to retrieval-only. Each fallback is listed in the response's "degraded".
+QUERY_BUDGET_MS = int(os.environ.get("QUERY_BUDGET_MS", "0"))
+VECTOR_BUDGET_SHARE = float(os.environ.get("VECTOR_BUDGET_SHARE", "0.4"))
+# Context kept for the LLM after a degraded retrieval: a lexical-only ranking
+# is less reliable past its first few chunks, and the prompt must fit the
+# time that is left.
+DEGRADED_CONTEXT_SHARE = float(os.environ.get("DEGRADED_CONTEXT_SHARE", "0.5"))
+# Claim-extraction calls in flight per map_reduce query (see rag/map_reduce.py)
+MAP_CONCURRENCY = int(os.environ.get("MAP_CONCURRENCY", "4"))
 
 class RAGState(TypedDict):
     query: str
     documents: List[dict]
+    known_conflicts: List[dict]
     answer_json: dict
+    deadline: Optional[float]         # perf_counter time, None = unbounded
+    vector_deadline: Optional[float]
+    degraded: List[str]               # legs skipped to stay within the budget
+    session_id: Optional[str]         # conversation session (see rag/sessions.py)
+    session: Optional[dict]           # how the session's turn was retrieved
 
 def retrieve_node(state: RAGState):
+    return retrieve(state, RETRIEVAL_TOP_K)
+
+def retrieve(state: RAGState, top_k: int):
+    """Hybrid (or session) retrieval of `top_k` chunks plus their known conflicts."""
     query = state["query"]
-    matches = hybrid_search(query, top_k=5)
+    session = None
+    if state.get("session_id"):
+        # Follow-ups rescore the previous turn's candidates when they cover the query
+        matches, degraded, session = session_search(
+            state["session_id"], query, top_k=top_k, vector_deadline=state.get("vector_deadline")
+        )
+    else:
+        matches, degraded = budgeted_hybrid_search(
+            query, top_k=top_k, vector_deadline=state.get("vector_deadline")
+        )
     
     docs = []
     for m in matches:
@@ -25,26 +76,41 @@ def retrieve_node(state: RAGState):
             "content": m["metadata"].get("text", ""),
             "metadata": m["metadata"]
         })
-    return {"documents": docs}
+    # Contradictions already found at ingestion between the retrieved chunks' claims
+    with stage("conflicts"):
+        known_conflicts = conflicts_for_chunks([d["id"] for d in docs])
+    return {"documents": docs, "known_conflicts": known_conflicts, "degraded": degraded, "session": session}
 
-def compute_confidence_breakdown(docs, llm_confidence):
+def compute_confidence_breakdown(docs, llm_confidence=None, degraded=()):
     """
     Compute a weighted confidence score from real signals.
     
+    When llm_confidence is None (retrieval-only mode) the LLM term is held at
+    a neutral 50 so the score reflects retrieval signals alone.
+    
+    When the vector leg was degraded there are no cosine scores: the two
+    terms derived from them (similarity and spread) are held at a neutral 50
+    instead of reading the missing scores as 0, and the label is capped at
+    "Medium" because half of the retrieval evidence is missing.
+    
     Weights:
       - retrieval_similarity : 40%  (avg cosine similarity of top-K)
       - llm_confidence       : 30%  (DeepSeek self-assessed relevance)
       - source_diversity     : 15%  (unique departments / total docs)
       - score_spread         : 15%  (1 - normalized gap between top-1 and top-5)
     """
+    vector_missing = "vector" in degraded
     scores = [d.get("vector_score", d["score"]) for d in docs] if docs else [0]
     
     # 1. Retrieval Similarity (0-100): avg of cosine sim scores
     avg_sim = sum(scores) / len(scores)
-    retrieval_similarity = min(100, max(0, avg_sim * 100))
+    retrieval_similarity = min(100, max(0, avg_sim * 100)) if not vector_missing else 50
     
-    # 2. LLM Confidence (0-100): from DeepSeek's self-assessment
+    # 2. LLM Confidence (0-100): from DeepSeek's self-assessment (neutral if absent)
     llm_conf = min(100, max(0, int(llm_confidence))) if llm_confidence else 50
+    llm_label = "LLM Self-Confidence" if llm_confidence is not None else "LLM Self-Confidence (not evaluated)"
+    if "llm" in degraded:
+        llm_label = "LLM Self-Confidence (skipped: budget exhausted)"
     
     # 3. Source Diversity (0-100): unique departments / total docs
     departments = set()
@@ -55,7 +121,9 @@ def compute_confidence_breakdown(docs, llm_confidence):
     source_diversity = min(100, max(0, diversity_ratio * 100))
     
     # 4. Score Spread (0-100): inverted — tight cluster = high confidence
-    if len(scores) >= 2:
+    if vector_missing:
+        score_spread = 50
+    elif len(scores) >= 2:
         spread = scores[0] - scores[-1]  # gap between best and worst
         # A spread of 0 means all scores are the same (good), spread of 0.5+ is bad
         score_spread = min(100, max(0, (1 - spread * 2) * 100))
@@ -80,96 +148,181 @@ def compute_confidence_breakdown(docs, llm_confidence):
     final_score = min(100, max(0, round(final_score, 1)))
     
     # Determine label
-    if final_score >= 70:
+    if final_score >= 70 and not vector_missing:
         label = "High"
     elif final_score >= 40:
         label = "Medium"
     else:
         label = "Low"
     
+    skipped = " (vector search skipped)" if vector_missing else ""
+    
     return {
         "final_score": final_score,
         "label": label,
         "breakdown": {
-            "retrieval_similarity": { "value": round(retrieval_similarity, 1), "weight": 40, "label": "Retrieval Similarity" },
-            "llm_confidence":      { "value": round(llm_conf, 1),              "weight": 30, "label": "LLM Self-Confidence" },
+            "retrieval_similarity": { "value": round(retrieval_similarity, 1), "weight": 40, "label": "Retrieval Similarity" + skipped },
+            "llm_confidence":      { "value": round(llm_conf, 1),              "weight": 30, "label": llm_label },
             "source_diversity":    { "value": round(source_diversity, 1),       "weight": 15, "label": "Source Diversity" },
-            "score_spread":        { "value": round(score_spread, 1),           "weight": 15, "label": "Score Consistency" },
+            "score_spread":        { "value": round(score_spread, 1),           "weight": 15, "label": "Score Consistency" + skipped },
         }
     }
 
 def generate_node(state: RAGState):
     query = state["query"]
     docs = state["documents"]
+    degraded = list(state.get("degraded", []))
+    deadline = state.get("deadline")
     
-    docs_text = ""
-    for d in docs:
-        # Exclude 'text' from metadata dump as it's printed as 'Content'
-        meta_safe = {k: v for k,v in d["metadata"].items() if k != "text"}
-        docs_text += f"---\nID: {d['id']}\nScore: {d['score']}\nMetadata: {json.dumps(meta_safe)}\nContent: {d['content']}\n"
-        
-    prompt = CONFLICT_DETECTION_PROMPT.format(query=query, documents=docs_text)
-    
-    api_key = os.environ.get("DEEPSEEK_API_KEY")
-    if not api_key:
-        raise ValueError("DEEPSEEK_API_KEY is not set")
-
-    llm = ChatOpenAI(
-        model="deepseek-chat", 
-        api_key=api_key, 
-        base_url="https://api.deepseek.com",
-        max_tokens=1024
-    )
+    # Merged, de-overlapped, metadata-once context packed to the token budget
+    # (a share of it when retrieval was degraded)
+    token_budget = int(CONTEXT_TOKEN_BUDGET * DEGRADED_CONTEXT_SHARE) if degraded else None
+    with stage("prompt_build"):
+        docs_text, context_stats = build_context(docs, token_budget=token_budget)
+        prompt = CONFLICT_DETECTION_PROMPT.format(query=query, documents=docs_text)
+    note(prompt_chars=len(prompt), context_tokens=context_stats["packed_tokens"])
     
-    response = llm.invoke(prompt)
+    llm = get_llm(max_tokens=1024)
     
+    t0 = time.perf_counter()
+    try:
+        with stage("llm"):
+            response, usage = invoke_llm(llm, prompt, "query", query=query, deadline=deadline)
+    except TimeoutError:
+        if deadline is None:
+            raise
+        # Out of budget: answer with the retrieval results and their confidence
+        degraded.append("llm")
+        answer_json = _retrieval_only_answer(docs, degraded)
+        answer_json["answer"] = "The answer could not be generated within the latency budget; see the retrieved sources."
+        return {"answer_json": answer_json, "degraded": degraded}
+    context_stats["llm_seconds"] = round(time.perf_counter() - t0, 3)
+    context_stats["llm_usage"] = usage
+    note(llm_response_chars=len(response.content))
+    
+    with stage("parse"):
+        answer_data = parse_answer(response.content)
+    return {"answer_json": finish_answer(answer_data, docs, degraded, context_stats)}
+
+def parse_answer(content: str) -> dict:
+    """The JSON object of an LLM response (fenced or bare), or a Low-confidence error answer."""
+    raw = content
     try:
-        content = response.content
         if "```json" in content:
             content = content.split("```json")[1].split("```")[0].strip()
         elif "```" in content:
             content = content.split("```")[1].strip()
             
-        answer_data = json.loads(content)
+        return json.loads(content)
     except Exception as e:
-        answer_data = {
+        return {
             "answer": "Failed to parse JSON response from LLM.",
             "conflicting_evidence": [],
             "confidence_level": "Low",
-            "reasoning": f"Error: {str(e)}\nRaw Response: {response.content}",
+            "reasoning": f"Error: {str(e)}\nRaw Response: {raw}",
             "llm_confidence": 20
         }
-    
+
+def finish_answer(answer_data: dict, docs, degraded, context_stats: dict) -> dict:
     # Extract DeepSeek's self-assessed confidence
     llm_conf = answer_data.pop("llm_confidence", 50)
     
     # Compute real weighted confidence
-    confidence_data = compute_confidence_breakdown(docs, llm_conf)
+    confidence_data = compute_confidence_breakdown(docs, llm_conf, degraded)
     
     # Override the simple text label with computed data
     answer_data["confidence_level"] = confidence_data["label"]
     answer_data["confidence_score"] = confidence_data["final_score"]
     answer_data["confidence_breakdown"] = confidence_data["breakdown"]
-    
-    return {"answer_json": answer_data}
-
-workflow = StateGraph(RAGState)
-workflow.add_node("retrieve", retrieve_node)
-workflow.add_node("generate", generate_node)
-workflow.set_entry_point("retrieve")
-workflow.add_edge("retrieve", "generate")
-workflow.add_edge("generate", END)
-
-app_graph = workflow.compile()
-
-async def get_answer(query: str):
-    final_state = app_graph.invoke({"query": query})
-    result = final_state["answer_json"]
-    # Use vector_score (cosine similarity) for display, not RRF fusion score
-    provenance = []
-    for doc in final_state["documents"]:
-        d = dict(doc)
-        d["score"] = d.get("vector_score", d["score"])  # cosine sim for display
-        provenance.append(d)
-    result["provenance"] = provenance
-    return result
+    answer_data["context_stats"] = context_stats
+    return answer_data
+
+def _retrieval_only_answer(docs, degraded):
+    confidence_data = compute_confidence_breakdown(docs, None, degraded)
+    return {
+        "mode": "retrieve",
+        "confidence_level": confidence_data["label"],
+        "confidence_score": confidence_data["final_score"],
+        "confidence_breakdown": confidence_data["breakdown"],
+    }
+
+def score_node(state: RAGState):
+    """Retrieval-only variant of generate_node: confidence from retrieval signals, no LLM."""
+    return {"answer_json": _retrieval_only_answer(state["documents"], state.get("degraded", []))}
+
+# Final node per query mode: "answer" runs DeepSeek, "retrieve" skips generation.
+GRAPH_MODES = {
+    "answer": ("generate", generate_node),
+    "retrieve": ("score", score_node),
+}
+
+# Modes with a graph of their own: "map_reduce" fans claim extraction out over
+# a deeper candidate set (see rag/map_reduce.py).
+QUERY_MODES = (*GRAPH_MODES, "map_reduce")
+
+_app_graphs = {}
+_graph_lock = threading.Lock()
+
+def get_app_graph(mode: str = "answer"):
+    """Compile the LangGraph workflow on first use (langgraph is slow to import)."""
+    if mode not in _app_graphs:
+        with _graph_lock:
+            if mode not in _app_graphs:
+                if mode == "map_reduce":
+                    from rag.map_reduce import build_workflow
+                    _app_graphs[mode] = build_workflow().compile()
+                    return _app_graphs[mode]
+
+                from langgraph.graph import StateGraph, END
+
+                final_name, final_node = GRAPH_MODES[mode]
+                workflow = StateGraph(RAGState)
+                workflow.add_node("retrieve", retrieve_node)
+                workflow.add_node(final_name, final_node)
+                workflow.set_entry_point("retrieve")
+                workflow.add_edge("retrieve", final_name)
+                workflow.add_edge(final_name, END)
+
+                _app_graphs[mode] = workflow.compile()
+    return _app_graphs[mode]
+
+async def get_answer(query: str, mode: str = "answer", budget_ms: int | None = None,
+                     session_id: str | None = None):
+    t0 = time.perf_counter()
+    budget_ms = QUERY_BUDGET_MS if budget_ms is None else budget_ms
+    trace = start_trace(query, mode, budget_ms)
+    inputs = {"query": query, "deadline": None, "vector_deadline": None, "degraded": [],
+              "session_id": session_id, "session": None}
+    if budget_ms > 0:
+        # Measured from arrival, so time queued for a graph thread counts too
+        inputs["deadline"] = t0 + budget_ms / 1000
+        # Without a generation step retrieval may use the whole budget
+        share = VECTOR_BUDGET_SHARE if mode != "retrieve" else 1.0
+        inputs["vector_deadline"] = t0 + budget_ms / 1000 * share
+    # The graph is synchronous; run it off the event loop so concurrent
+    # requests (and coalesced duplicates) keep being accepted meanwhile.
+    def run_graph():
+        trace.add_stage("queue", time.perf_counter() - t0)
+        # Bounds the parallel map steps of the map_reduce graph
+        return get_app_graph(mode).invoke(inputs, config={"max_concurrency": MAP_CONCURRENCY})
+    result = None
+    try:
+        final_state = await asyncio.get_running_loop().run_in_executor(_query_executor, traced(trace, run_graph))
+        result = final_state["answer_json"]
+        if mode == "retrieve":
+            result["retrieval_seconds"] = round(time.perf_counter() - t0, 3)
+        # Use vector_score (cosine similarity) for display, not RRF fusion score
+        provenance = []
+        for doc in final_state["documents"]:
+            d = dict(doc)
+            d["score"] = d.get("vector_score", d["score"])  # cosine sim for display
+            provenance.append(d)
+        result["provenance"] = provenance
+        result["known_conflicts"] = final_state.get("known_conflicts", [])
+        result["degraded"] = final_state.get("degraded", [])
+        if session_id:
+            result["session"] = final_state.get("session")
+        return result
+    finally:
+        # Slow (or failed-after-threshold) queries go to the slow-query log
+        trace.finish(result)
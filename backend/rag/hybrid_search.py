@@ -9,19 +9,54 @@ At query time:
 This ensures queries with exact keyword matches (e.g., "MRI machine") AND
 semantically similar passages both contribute to the final retrieval.
 """
+import logging
 import os
-import json
 import re
-from rank_bm25 import BM25Okapi
-from rag.pinecone_utils import get_pinecone_index, search_pinecone
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from rag.corpus_scan import scan_corpus, clear_checkpoint
+from rag.corpus_store import CompactCorpus
+from rag.lexical_shards import sharded_top_k
+from rag.lexical_store import (
+    LEXICAL_INDEX_DIR, add_tombstones, build_lock, current_generation, lexical_dir, open_generation, publish,
+    refresh_tombstones, retire_current,
+)
+from rag.pinecone_utils import live_namespace, search_pinecone
 from rag.embeddings import get_embedding
+from rag.dedup import collapse_near_duplicates
+from rag.docstore import corpus_docs, hydrate
+from rag.slow_log import current_trace, note, stage, traced
+
+logger = logging.getLogger(__name__)
+
+# Vector legs in flight. A leg that misses its deadline keeps its thread until
+# the SDK call returns, so this is sized above the query pool.
+_vector_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("VECTOR_LEG_THREADS", "48")), thread_name_prefix="vector-leg"
+)
 
 
 # ─── BM25 Corpus Cache ───────────────────────────────────────────────────────
 # We fetch all chunk texts from Pinecone once, then build the BM25 index.
+# The index is a CompactCorpus: ids, text, metadata and postings all live in
+# packed columns rather than per-chunk dicts (see rag/corpus_store.py).
+#
+# With LEXICAL_INDEX_DIR set (the default) the corpus is shared by every
+# worker process: one builder publishes a memory-mapped generation and each
+# worker maps it read-only (see rag/lexical_store.py). With it set to "" each
+# process keeps a private in-memory corpus instead.
+#
+# Each Pinecone namespace has its own lexical index; queries use the live
+# namespace's, so a blue/green swap (rag/blue_green.py) switches both.
 _bm25_index = None
-_bm25_corpus_ids = []
-_bm25_corpus_meta = []
+_bm25_namespace = None  # namespace the private index was built from
+_bm25_builds = 0  # private index builds so far (see index_version())
+_bm25_lock = threading.Lock()
+
+# Deleted documents are tombstoned in the lexical index instead of triggering
+# a rebuild; once this share of its chunks is dead it is rebuilt (compacted).
+LEXICAL_COMPACT_RATIO = float(os.environ.get("LEXICAL_COMPACT_RATIO", "0.2"))
 
 
 def _tokenize(text: str) -> list[str]:
@@ -29,79 +64,170 @@ def _tokenize(text: str) -> list[str]:
     return re.findall(r"\w+", text.lower())
 
 
-def _build_bm25_index():
-    """Fetch all vectors/metadata from Pinecone and build BM25 index."""
-    global _bm25_index, _bm25_corpus_ids, _bm25_corpus_meta
-
-    index = get_pinecone_index()
-    stats = index.describe_index_stats()
-    total = stats.total_vector_count
-
-    if total == 0:
-        _bm25_index = None
-        return
-
-    # Fetch all IDs first, then fetch their metadata
-    # Pinecone list() returns paginated IDs
-    all_ids = []
-    for ids_batch in index.list():
-        all_ids.extend(ids_batch)
-
-    # Fetch metadata in batches of 100
-    all_docs = []
-    batch_size = 100
-    for i in range(0, len(all_ids), batch_size):
-        batch_ids = all_ids[i:i + batch_size]
-        fetch_result = index.fetch(ids=batch_ids)
-        for vid, vec_data in fetch_result.vectors.items():
-            all_docs.append({
-                "id": vid,
-                "metadata": vec_data.metadata
-            })
-
-    # Build the BM25 corpus
-    tokenized_corpus = []
-    _bm25_corpus_ids = []
-    _bm25_corpus_meta = []
+def _scan_checkpoint_path(namespace: str | None = None) -> str:
+    # Interrupted shared rebuilds resume from here (see rag/corpus_scan.py)
+    return os.path.join(lexical_dir(namespace), "scan.checkpoint.jsonl") if LEXICAL_INDEX_DIR else ""
 
+
+def _index_corpus(all_docs) -> CompactCorpus:
+    """Tokenize an iterable of {id, metadata} docs into a CompactCorpus."""
+    corpus = CompactCorpus(_tokenize)
     for doc in all_docs:
-        text = doc["metadata"].get("text", "")
-        _bm25_corpus_ids.append(doc["id"])
-        _bm25_corpus_meta.append(doc["metadata"])
-        tokenized_corpus.append(_tokenize(text))
+        corpus.add(doc["id"], doc["metadata"])
+    return corpus.finalize()
 
-    _bm25_index = BM25Okapi(tokenized_corpus)
 
+def _corpus(namespace: str, checkpoint_path: str = ""):
+    """Every {id, metadata} doc of a namespace, from the docstore (a Pinecone
+    scan only for namespaces ingested before it, see rag/docstore.py)."""
+    return corpus_docs(lambda: scan_corpus(checkpoint_path, namespace=namespace), namespace)
 
-def get_bm25_index():
-    """Return cached BM25 index, building it on first call."""
+
+def build_and_publish(namespace: str | None = None) -> int:
+    """Read a namespace's chunks (default: live), write a new shared generation
+    of its lexical index and make it current."""
+    namespace = live_namespace() if namespace is None else namespace
+    docs = _corpus(namespace, _scan_checkpoint_path(namespace))
+    return publish(_index_corpus(docs), lexical_dir(namespace))
+
+
+def _load_shared_index():
+    """Map the current generation, building it first if nobody has published one."""
     global _bm25_index
-    if _bm25_index is None:
-        _build_bm25_index()
+
+    namespace = live_namespace()
+    directory = lexical_dir(namespace)
+    generation = current_generation(directory)
+    if generation is not None:
+        if _bm25_index is not None and _bm25_index.generation == generation:
+            return _bm25_index
+        mapped = open_generation(generation, _tokenize, directory)
+        if mapped is not None:
+            refresh_tombstones(mapped, directory)
+            _bm25_index = mapped
+            return _bm25_index
+
+    # Nothing published: exactly one process builds. Workers that already
+    # serve an older generation keep doing so instead of queueing behind it.
+    with build_lock(blocking=_bm25_index is None, directory=directory) as is_builder:
+        if not is_builder:
+            return _bm25_index
+        generation = current_generation(directory)
+        if generation is None:
+            generation = build_and_publish(namespace)
+        _bm25_index = open_generation(generation, _tokenize, directory)
+        if _bm25_index is not None:
+            refresh_tombstones(_bm25_index, directory)
     return _bm25_index
 
 
+def get_bm25_index():
+    """Return the BM25 index, building it on first call.
+
+    In shared mode this also picks up generations published and tombstones
+    written by other processes (a small file read and a stat per call).
+    """
+    global _bm25_index, _bm25_namespace, _bm25_builds
+    if LEXICAL_INDEX_DIR:
+        current = _bm25_index
+        if current is not None and current.generation == current_generation():
+            refresh_tombstones(current)
+            return current
+        with _bm25_lock:
+            return _load_shared_index()
+
+    namespace = live_namespace()
+    if _bm25_index is None or _bm25_namespace != namespace:
+        with _bm25_lock:
+            if _bm25_index is None or _bm25_namespace != namespace:
+                _bm25_index = _index_corpus(_corpus(namespace))
+                _bm25_namespace = namespace
+                _bm25_builds += 1
+    return _bm25_index
+
+
+def index_version() -> tuple:
+    """Identifies the contents of the live lexical index: it changes with
+    every rebuild (a new generation) and every tombstone applied, i.e. after
+    any upload, replace or delete, in this process or another worker."""
+    corpus = get_bm25_index()
+    if corpus is None:
+        return (None, 0)
+    built = corpus.generation if LEXICAL_INDEX_DIR else _bm25_builds
+    return (built, len(corpus.deleted))
+
+
+def invalidate_bm25_index():
+    """Mark the index stale so the next query rebuilds it.
+
+    In shared mode the current generation is unpublished; every worker keeps
+    serving its mapping until the next build publishes a replacement.
+    """
+    global _bm25_index
+    with _bm25_lock:
+        # A half-finished scan of the old contents must not seed the next build
+        clear_checkpoint(_scan_checkpoint_path())
+        if LEXICAL_INDEX_DIR:
+            retire_current()
+        else:
+            _bm25_index = None
+
+
+def republish_bm25_index() -> int | None:
+    """Rebuild the shared index now and publish it (after a bulk change made
+    outside the API, e.g. scripts/ingest.py); every worker switches to it on
+    its next query. Returns the generation, or None in private mode, where
+    only this process's corpus can be invalidated."""
+    invalidate_bm25_index()
+    if not LEXICAL_INDEX_DIR:
+        return None
+    namespace = live_namespace()
+    with build_lock(directory=lexical_dir(namespace)):
+        return build_and_publish(namespace)
+
+
+def tombstone_documents(filenames: list[str]) -> int:
+    """Remove documents from the lexical index without rebuilding it.
+
+    Returns the chunks hidden in this process's index. In shared mode the
+    tombstones are appended next to the generation being served, and every
+    worker applies them on its next query.
+    """
+    with _bm25_lock:
+        corpus = _bm25_index
+        if LEXICAL_INDEX_DIR:
+            generation = corpus.generation if corpus is not None else current_generation()
+            if generation is None:
+                return 0  # nothing built yet: the next build scans without them
+            add_tombstones(generation, filenames)
+            hidden = refresh_tombstones(corpus) if corpus is not None else 0
+        else:
+            hidden = corpus.tombstone(filenames) if corpus is not None else 0
+    if corpus is not None and len(corpus) and len(corpus.deleted) > LEXICAL_COMPACT_RATIO * len(corpus):
+        invalidate_bm25_index()
+    return hidden
+
+
 def bm25_search(query: str, top_k: int = 10) -> list[dict]:
     """Run BM25 keyword search, returning ranked results."""
     bm25 = get_bm25_index()
-    if bm25 is None:
+    if bm25 is None or not len(bm25):
         return []
 
     tokenized_query = _tokenize(query)
-    scores = bm25.get_scores(tokenized_query)
 
-    # Get top-K indices sorted by score descending
-    ranked_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+    # Top-K indices by score descending (only non-zero BM25 scores),
+    # scored by shard worker processes on large shared indexes
+    ranked = sharded_top_k(bm25, tokenized_query, top_k)
 
     results = []
-    for rank, idx in enumerate(ranked_indices):
-        if scores[idx] > 0:  # Only include matches with non-zero BM25 score
-            results.append({
-                "id": _bm25_corpus_ids[idx],
-                "score": float(scores[idx]),
-                "metadata": _bm25_corpus_meta[idx],
-                "rank": rank + 1
-            })
+    for rank, (idx, score) in enumerate(ranked):
+        results.append({
+            "id": bm25.doc_id(idx),
+            "score": float(score),
+            "metadata": bm25.metadata(idx),
+            "rank": rank + 1
+        })
     return results
 
 
@@ -141,6 +267,9 @@ def reciprocal_rank_fusion(
         fused_scores[doc_id] = fused_scores.get(doc_id, 0) + bm25_weight / (k + rank)
         if doc_id not in doc_data:
             doc_data[doc_id] = {"metadata": doc["metadata"]}
+        elif "text" not in doc_data[doc_id]["metadata"]:
+            # Slim vector metadata: BM25 already has the text, no docstore lookup needed
+            doc_data[doc_id]["metadata"] = doc["metadata"]
         doc_data[doc_id]["bm25_score"] = doc["score"]
         doc_data[doc_id]["bm25_rank"] = rank
 
@@ -163,21 +292,110 @@ def reciprocal_rank_fusion(
     return results
 
 
-def hybrid_search(query: str, top_k: int = 5) -> list[dict]:
+def _vector_leg(query: str, top_k: int, query_vector: list[float] | None = None,
+                include_values: bool = False) -> list[dict]:
+    if query_vector is None:
+        with stage("embed"):
+            query_vector = get_embedding(query)
+    with stage("vector"):
+        matches = search_pinecone(query_vector, top_k=top_k, include_values=include_values)
+    note(vector_candidates=len(matches))
+    return matches
+
+
+def search_legs(query: str, per_leg: int, vector_deadline: float | None = None,
+                query_vector: list[float] | None = None,
+                include_values: bool = False) -> tuple[list[dict], list[dict], list[str]]:
+    """Run the vector and BM25 legs, `per_leg` candidates each.
+
+    The vector leg (Gemini embedding, skipped if `query_vector` is given, +
+    Pinecone) runs on a worker thread while BM25 scores locally. With a
+    `vector_deadline` (absolute perf_counter time) it is waited for only
+    until then; if it is late or fails, its results are empty and "vector"
+    is reported in the returned list of degraded legs. The abandoned call
+    finishes in the background and its result is discarded.
+    """
+    trace = current_trace()
+    vector_leg = traced(trace, _vector_leg) if trace is not None else _vector_leg
+    vector_future = _vector_executor.submit(vector_leg, query, per_leg, query_vector, include_values)
+    degraded = []
+
+    # 2. BM25 search (meanwhile)
+    with stage("bm25"):
+        bm25_results = bm25_search(query, top_k=per_leg)
+    note(bm25_candidates=len(bm25_results))
+
+    # 1. Vector search via Pinecone
+    if vector_deadline is None:
+        vector_results = vector_future.result()
+    else:
+        try:
+            vector_results = vector_future.result(timeout=max(0.0, vector_deadline - time.perf_counter()))
+        except Exception as e:
+            kind = "timed out" if isinstance(e, FutureTimeout) else f"failed ({e})"
+            logger.warning("Vector leg %s; answering from BM25 only", kind)
+            vector_results = []
+            degraded.append("vector")
+    return vector_results, bm25_results, degraded
+
+
+def fuse(vector_results: list[dict], bm25_results: list[dict], top_k: int) -> list[dict]:
+    with stage("fusion"):
+        # 3. Fuse with RRF
+        fused = reciprocal_rank_fusion(vector_results, bm25_results)
+
+        # With DOCSTORE_SLIM_PINECONE vector matches lack text; the collapse needs it
+        hydrate(fused, live_namespace())
+
+        # 4. One slot per near-duplicate cluster
+        fused = collapse_near_duplicates(fused)
+    note(fused_candidates=len(fused))
+    return fused[:top_k]
+
+
+def budgeted_hybrid_search(query: str, top_k: int = 5, vector_deadline: float | None = None) -> tuple[list[dict], list[str]]:
     """
     Full hybrid search pipeline:
       1. Pinecone vector search (semantic similarity)
       2. BM25 keyword search (lexical matching)
       3. Reciprocal Rank Fusion to merge both
-    """
-    # 1. Vector search via Pinecone
-    query_vector = get_embedding(query)
-    vector_results = search_pinecone(query_vector, top_k=top_k * 2)
+      4. Near-duplicate collapse so each cluster fills one result slot
 
-    # 2. BM25 search
-    bm25_results = bm25_search(query, top_k=top_k * 2)
+    Both legs run concurrently (see search_legs). If the vector leg misses
+    `vector_deadline` the results are fused from BM25 alone and "vector" is
+    in the returned list of degraded legs.
+    """
+    vector_results, bm25_results, degraded = search_legs(query, top_k * 2, vector_deadline)
+    return fuse(vector_results, bm25_results, top_k), degraded
+
+
+def embed_query(query: str, deadline: float | None = None) -> list[float] | None:
+    """Query embedding, or None if it fails or misses `deadline`."""
+    trace = current_trace()
+    embed = traced(trace, get_embedding) if trace is not None else get_embedding
+    future = _vector_executor.submit(embed, query)
+    try:
+        with stage("embed"):
+            return future.result(timeout=None if deadline is None else max(0.0, deadline - time.perf_counter()))
+    except Exception as e:
+        logger.warning("Query embedding %s", "timed out" if isinstance(e, FutureTimeout) else f"failed ({e})")
+        return None
+
+
+def query_term_weights(query: str) -> dict[str, float]:
+    """IDF of each query term the lexical index knows (unknown terms are
+    omitted: no retrieval could match them)."""
+    bm25 = get_bm25_index()
+    if bm25 is None:
+        return {}
+    weights = {}
+    for token in _tokenize(query):
+        term_id = bm25.vocab.get(token)
+        if term_id is not None:
+            weights[token] = bm25.idf[term_id]
+    return weights
 
-    # 3. Fuse with RRF
-    fused = reciprocal_rank_fusion(vector_results, bm25_results)
 
-    return fused[:top_k]
+def hybrid_search(query: str, top_k: int = 5) -> list[dict]:
+    """Unbudgeted hybrid search: always waits for both legs."""
+    return budgeted_hybrid_search(query, top_k)[0]
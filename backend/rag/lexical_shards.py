@@ -0,0 +1,142 @@
+"""
+Sharded, multi-process BM25 scoring for large lexical indexes.
+
+Scoring walks the postings of the query terms in pure Python, so one query
+keeps one core busy; past a few hundred thousand chunks that scan dominates
+retrieval. With LEXICAL_SHARDS > 1, a query against a shared (memory-mapped,
+see rag/lexical_store.py) index of at least LEXICAL_SHARD_MIN_DOCS chunks is
+split into LEXICAL_SHARDS contiguous doc ranges, each scored by a worker
+process of a pool:
+
+  - Workers map the same generation file, so the index is shared through the
+    page cache rather than copied; each sends back only its top k.
+  - Exact: IDF and average doc length are stored corpus-wide in the file, so
+    a doc scores the same in its shard as in a full scan. Each shard returns
+    its top k under the same (score desc, doc index asc) order, and the
+    global top k is the top k of their union — the same ranking as
+    CompactCorpus.top_k on the whole index.
+  - Workers apply the generation's tombstones (.del file) themselves before
+    scoring.
+
+Private per-process corpora (LEXICAL_INDEX_DIR="") and small indexes are
+scored in-process, as is every query if the pool fails. The pool is per
+uvicorn worker: N workers × LEXICAL_SHARDS processes in total.
+
+Benchmark with `python -m scripts.bench_bm25_shards`.
+"""
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rag.lexical_store import MappedCorpus, refresh_tombstones
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_SHARDS = int(os.environ.get("LEXICAL_SHARDS", "0"))
+LEXICAL_SHARD_MIN_DOCS = int(os.environ.get("LEXICAL_SHARD_MIN_DOCS", "100000"))
+
+SHARD_STATS = {
+    "queries": 0,
+    "sharded": 0,
+    "fallbacks": 0,
+    "scatter_seconds": 0.0,
+}
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+# Worker side: generations mapped by this worker process, by path
+_worker_corpora: dict[str, MappedCorpus] = {}
+
+
+# ─── Worker ─────────────────────────────────────────────────────────────────
+
+def _score_shard(path: str, generation: int, tokens: list[str], lo: int, hi: int, k: int):
+    corpus = _worker_corpora.get(path)
+    if corpus is None:
+        # Keep the previous generation only until the next one is mapped
+        _worker_corpora.clear()
+        corpus = _worker_corpora[path] = MappedCorpus(path, None, generation)
+    refresh_tombstones(corpus, os.path.dirname(path))
+    return corpus.top_k(tokens, k, lo, hi)
+
+
+# ─── Pool ───────────────────────────────────────────────────────────────────
+
+def _get_pool(shards: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    if _pool is None or _pool_size != shards:
+        with _pool_lock:
+            if _pool is None or _pool_size != shards:
+                if _pool is not None:
+                    _pool.shutdown(wait=False, cancel_futures=True)
+                # forkserver: forking this multi-threaded server process directly is unsafe
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _pool = ProcessPoolExecutor(max_workers=shards, mp_context=multiprocessing.get_context(method))
+                _pool_size = shards
+    return _pool
+
+
+def _reset_pool():
+    global _pool, _pool_size
+    with _pool_lock:
+        pool, _pool, _pool_size = _pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shard_bounds(n_docs: int, shards: int) -> list[tuple[int, int]]:
+    edges = [n_docs * i // shards for i in range(shards + 1)]
+    return [(lo, hi) for lo, hi in zip(edges, edges[1:]) if lo < hi]
+
+
+def sharded_top_k(corpus, tokens: list[str], k: int, shards: int | None = None) -> list[tuple[int, float]]:
+    """corpus.top_k(tokens, k), scattered over the worker pool when it pays off."""
+    shards = LEXICAL_SHARDS if shards is None else shards
+    SHARD_STATS["queries"] += 1
+    if shards < 2 or not isinstance(corpus, MappedCorpus) or len(corpus) < LEXICAL_SHARD_MIN_DOCS:
+        return corpus.top_k(tokens, k)
+
+    t0 = time.perf_counter()
+    try:
+        pool = _get_pool(shards)
+        futures = [
+            pool.submit(_score_shard, corpus.path, corpus.generation, tokens, lo, hi, k)
+            for lo, hi in shard_bounds(len(corpus), shards)
+        ]
+        candidates = [pair for future in futures for pair in future.result()]
+    except Exception:
+        logger.exception("Sharded BM25 scoring failed; scoring in-process")
+        SHARD_STATS["fallbacks"] += 1
+        _reset_pool()
+        return corpus.top_k(tokens, k)
+    SHARD_STATS["sharded"] += 1
+    SHARD_STATS["scatter_seconds"] += time.perf_counter() - t0
+
+    # Same order as CompactCorpus.top_k: score desc, doc index asc
+    best = heapq.nsmallest(k, ((-score, doc) for doc, score in candidates))
+    return [(doc, -neg) for neg, doc in best]
+
+
+def warm_shards(corpus):
+    """Start the worker processes ahead of the first query that needs them."""
+    if LEXICAL_SHARDS >= 2 and isinstance(corpus, MappedCorpus) and len(corpus) >= LEXICAL_SHARD_MIN_DOCS:
+        pool = _get_pool(LEXICAL_SHARDS)
+        for future in [pool.submit(os.getpid) for _ in range(LEXICAL_SHARDS)]:
+            future.result()
+
+
+def get_shard_stats() -> dict:
+    n = SHARD_STATS["sharded"]
+    return {
+        **SHARD_STATS,
+        "shards": LEXICAL_SHARDS,
+        "min_docs": LEXICAL_SHARD_MIN_DOCS,
+        "scatter_seconds": round(SHARD_STATS["scatter_seconds"], 3),
+        "mean_scatter_ms": round(SHARD_STATS["scatter_seconds"] / n * 1000, 2) if n else 0.0,
+    }
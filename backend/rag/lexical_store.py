@@ -0,0 +1,323 @@
+"""
+Memory-mappable, versioned on-disk format for the BM25 corpus.
+
+With N uvicorn/gunicorn workers every worker used to scan Pinecone and hold
+its own CompactCorpus. Instead, one builder serializes the corpus into a
+single file and every worker maps it read-only: the columns are memoryviews
+over the mapping, so the pages are shared through the OS page cache and
+nothing is copied into the worker heap.
+
+Layout of LEXICAL_INDEX_DIR (the default Pinecone namespace's index; every
+other namespace gets the same layout in a subdirectory named after it, so
+swapping the live namespace swaps the lexical index with it):
+
+    bm25.<generation>.idx   one immutable file per build
+    bm25.<generation>.del   deleted filenames (tombstones), one JSON string
+                            per line, appended by per-document deletes
+    CURRENT                 the generation workers should serve
+    build.lock              flock held by the process that is building
+    <namespace>/            the same, for a blue/green namespace
+
+Publishing writes the new file, then atomically replaces CURRENT. Workers
+notice the new generation on their next query and remap; a worker still
+serving an older generation keeps a valid mapping even after the file is
+pruned (POSIX keeps unlinked, mapped files alive).
+
+File format: MAGIC, a little-endian u64 header length, a JSON header
+(section name → [typecode, offset, count]), then 8-byte aligned sections.
+"""
+import contextlib
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from rag.corpus_store import CompactCorpus, INTERNED_FIELDS
+from rag.pinecone_utils import live_namespace
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single-process only, no build lock
+    fcntl = None
+
+LEXICAL_INDEX_DIR = os.environ.get(
+    "LEXICAL_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "lexical"),
+)
+KEEP_GENERATIONS = 2
+
+MAGIC = b"BM25IDX1"
+_ALIGN = 8
+
+
+# ─── Serialization ──────────────────────────────────────────────────────────
+
+def _packed_strings(values) -> tuple[bytes, array]:
+    buf = bytearray()
+    offsets = array("Q", [0])
+    for value in values:
+        buf += value.encode("utf-8")
+        offsets.append(len(buf))
+    return bytes(buf), offsets
+
+
+def write_corpus(corpus: CompactCorpus, path: str):
+    """Serialize a finalized CompactCorpus to `path` (written atomically)."""
+    terms = sorted(corpus.vocab)
+    vocab_buf, vocab_offsets = _packed_strings(terms)
+    strings_buf, strings_offsets = _packed_strings(corpus.strings)
+
+    sections = {
+        "id_buf": ("B", corpus.id_buf),
+        "id_offsets": ("Q", corpus.id_offsets),
+        "text_buf": ("B", corpus.text_buf),
+        "text_offsets": ("Q", corpus.text_offsets),
+        "doc_len": ("I", corpus.doc_len),
+        "extra_refs": ("I", corpus.extra_refs),
+        **{f"field:{f}": ("I", corpus.field_refs[f]) for f in INTERNED_FIELDS},
+        "strings_buf": ("B", strings_buf),
+        "strings_offsets": ("Q", strings_offsets),
+        "vocab_buf": ("B", vocab_buf),
+        "vocab_offsets": ("Q", vocab_offsets),
+        "vocab_ids": ("I", array("I", (corpus.vocab[t] for t in terms))),
+        "term_offsets": ("Q", corpus.term_offsets),
+        "post_docs": ("I", corpus.post_docs),
+        "post_tfs": ("H", corpus.post_tfs),
+        "idf": ("d", corpus.idf),
+    }
+
+    layout, offset = {}, 0
+    for name, (typecode, data) in sections.items():
+        nbytes = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout[name] = [typecode, offset, nbytes]
+        offset += nbytes + (-nbytes % _ALIGN)
+    header = json.dumps({"n_docs": len(corpus), "avgdl": corpus.avgdl, "sections": layout}).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % _ALIGN)
+    base = len(MAGIC) + 8 + len(header)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, (_, data) in sections.items():
+            _, section_offset, nbytes = layout[name]
+            f.seek(base + section_offset)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _MappedStrings:
+    """Read-only list-like view over packed UTF-8 strings."""
+
+    def __init__(self, buf: memoryview, offsets: memoryview):
+        self._buf = buf
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self._buf[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+
+class _MappedVocab:
+    """Read-only term → term id lookup by binary search over the sorted terms."""
+
+    def __init__(self, buf: memoryview, offsets: memoryview, ids: memoryview):
+        self._buf = buf
+        self._offsets = offsets
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, term: str, default=None):
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self._ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._buf[self._offsets[mid]:self._offsets[mid + 1]].tobytes()
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return self._ids[mid]
+        return default
+
+
+class MappedCorpus(CompactCorpus):
+    """A CompactCorpus whose columns are zero-copy views over a mapped file."""
+
+    def __init__(self, path: str, tokenize, generation: int | None = None):
+        super().__init__(tokenize)
+        self.path = path
+        self.generation = generation
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if view[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a lexical index file")
+        (header_len,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(view[start:start + header_len]))
+        base = start + header_len
+
+        def section(name):
+            typecode, offset, nbytes = header["sections"][name]
+            return view[base + offset:base + offset + nbytes].cast(typecode)
+
+        self.id_buf = section("id_buf")
+        self.id_offsets = section("id_offsets")
+        self.text_buf = section("text_buf")
+        self.text_offsets = section("text_offsets")
+        self.doc_len = section("doc_len")
+        self.extra_refs = section("extra_refs")
+        self.field_refs = {f: section(f"field:{f}") for f in INTERNED_FIELDS}
+        self.strings = _MappedStrings(section("strings_buf"), section("strings_offsets"))
+        self.vocab = _MappedVocab(section("vocab_buf"), section("vocab_offsets"), section("vocab_ids"))
+        self.term_offsets = section("term_offsets")
+        self.post_docs = section("post_docs")
+        self.post_tfs = section("post_tfs")
+        self.idf = section("idf")
+        self.avgdl = header["avgdl"]
+        self.tombstones_read = 0  # bytes of the .del file already applied
+
+    def add(self, doc_id: str, metadata: dict):
+        raise TypeError("MappedCorpus is read-only")
+
+    def memory_bytes(self) -> int:
+        """Size of the shared mapping (page cache, not per-worker heap)."""
+        return len(self._mmap)
+
+
+# ─── Generations ────────────────────────────────────────────────────────────
+
+def lexical_dir(namespace: str | None = None) -> str:
+    """Directory of a namespace's lexical index (default: the live namespace)."""
+    namespace = live_namespace() if namespace is None else namespace
+    return os.path.join(LEXICAL_INDEX_DIR, namespace) if namespace else LEXICAL_INDEX_DIR
+
+
+def _generation_path(generation: int, directory: str) -> str:
+    return os.path.join(directory, f"bm25.{generation}.idx")
+
+
+def _tombstone_path(generation: int, directory: str) -> str:
+    return os.path.join(directory, f"bm25.{generation}.del")
+
+
+def current_generation(directory: str | None = None) -> int | None:
+    """Generation named by CURRENT, or None if nothing is published."""
+    directory = directory or lexical_dir()
+    try:
+        with open(os.path.join(directory, "CURRENT"), "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def open_generation(generation: int, tokenize, directory: str | None = None) -> MappedCorpus | None:
+    """Map a published generation; None if it has already been pruned."""
+    try:
+        return MappedCorpus(_generation_path(generation, directory or lexical_dir()), tokenize, generation)
+    except FileNotFoundError:
+        return None
+
+
+def publish(corpus: CompactCorpus, directory: str | None = None) -> int:
+    """Write `corpus` as a new generation and atomically make it CURRENT."""
+    directory = directory or lexical_dir()
+    os.makedirs(directory, exist_ok=True)
+    generation = max(time.time_ns(), (current_generation(directory) or 0) + 1)
+    write_corpus(corpus, _generation_path(generation, directory))
+
+    pointer = os.path.join(directory, "CURRENT")
+    with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(f"{pointer}.tmp", pointer)
+
+    _prune(KEEP_GENERATIONS, directory)
+    return generation
+
+
+def retire_current(directory: str | None = None):
+    """Unpublish the current generation so the next reader triggers a rebuild."""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(directory or lexical_dir(), "CURRENT"))
+
+
+def _prune(keep: int, directory: str):
+    generations = sorted({
+        int(name.split(".")[1])
+        for name in os.listdir(directory)
+        if name.startswith("bm25.") and name.endswith((".idx", ".del"))
+    })
+    for generation in generations[:-keep] if keep else generations:
+        for path in (_generation_path(generation, directory), _tombstone_path(generation, directory)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def add_tombstones(generation: int, filenames, directory: str | None = None):
+    """Record deleted files against a generation; every worker applies them."""
+    with open(_tombstone_path(generation, directory or lexical_dir()), "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(name) + "\n" for name in filenames))
+
+
+def refresh_tombstones(corpus: MappedCorpus, directory: str | None = None) -> int:
+    """Apply tombstones appended since the last call (one stat when unchanged)."""
+    path = _tombstone_path(corpus.generation, directory or lexical_dir())
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    if size == corpus.tombstones_read:
+        return 0
+    with open(path, "rb") as f:
+        f.seek(corpus.tombstones_read)
+        chunk = f.read(size - corpus.tombstones_read)
+    # Only whole lines: a concurrent append may still be in progress
+    complete = chunk[:chunk.rfind(b"\n") + 1]
+    corpus.tombstones_read += len(complete)
+    return corpus.tombstone(json.loads(line) for line in complete.splitlines())
+
+
+def remove_lexical_index(namespace: str):
+    """Delete a retired namespace's lexical index (workers still mapping it keep their pages)."""
+    directory = lexical_dir(namespace)
+    if not os.path.isdir(directory):
+        return
+    retire_current(directory)
+    _prune(0, directory)
+    for name in ("build.lock", "scan.checkpoint.jsonl"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, name))
+    if namespace:
+        with contextlib.suppress(OSError):
+            os.rmdir(directory)
+
+
+@contextlib.contextmanager
+def build_lock(blocking: bool = True, directory: str | None = None):
+    """Cross-process builder lock. Yields True if this process holds it."""
+    directory = directory or lexical_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "build.lock"), "a+") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,51 @@
+"""
+DeepSeek chat client shared by the graph and the API endpoints.
+
+ChatOpenAI instances are cached per (max_tokens, temperature) so every call
+reuses the same underlying HTTP connection pool instead of paying a fresh TLS
+handshake to api.deepseek.com on each request.
+"""
+import os
+import threading
+from rag.resilience import POLICIES
+
+DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_llm(max_tokens: int = 1024, temperature: float | None = None) -> "ChatOpenAI":
+    """Return a cached DeepSeek client for the given generation settings."""
+    api_key = os.environ.get("DEEPSEEK_API_KEY")
+    if not api_key:
+        raise ValueError("DEEPSEEK_API_KEY is not set")
+
+    key = (max_tokens, temperature)
+    llm = _clients.get(key)
+    if llm is None:
+        with _lock:
+            llm = _clients.get(key)
+            if llm is None:
+                from langchain_openai import ChatOpenAI  # heavy import deferred to first use
+                kwargs = {"temperature": temperature} if temperature is not None else {}
+                llm = ChatOpenAI(
+                    model=DEEPSEEK_MODEL,
+                    api_key=api_key,
+                    base_url=DEEPSEEK_BASE_URL,
+                    max_tokens=max_tokens,
+                    # Retries and timeouts are handled by rag.resilience; this
+                    # only bounds how long an abandoned call can hold a thread.
+                    max_retries=0,
+                    timeout=POLICIES["deepseek"].max_timeout,
+                    **kwargs,
+                )
+                _clients[key] = llm
+    return llm
+
+
+def warm_llm_connection():
+    """Open the pooled connection to DeepSeek with a cheap models listing call."""
+    llm = get_llm()
+    llm.root_client.models.list()
@@ -0,0 +1,183 @@
+"""
+Token, cost and latency accounting for DeepSeek calls.
+
+Every LLM call goes through `invoke_llm(llm, prompt, endpoint, query)`. It
+runs the call under rag.resilience and records the usage that comes back on
+the response:
+
+  - prompt tokens, of which cached-prefix tokens (DeepSeek's context cache,
+    billed at the lower DEEPSEEK_PRICE_CACHED_INPUT), and completion tokens;
+  - latency as the caller saw it, retries included;
+  - cost in USD from the DEEPSEEK_PRICE_* rates (per million tokens; set them
+    when DeepSeek's price list changes).
+
+Usage is aggregated per endpoint (totals plus latency percentiles over the
+last LATENCY_WINDOW calls), per USAGE_BUCKET_SECONDS time bucket (the last
+USAGE_BUCKETS are kept), and per normalized query for the USAGE_TOP_QUERIES
+biggest spenders. A call also notes its usage on the current query trace, so
+slow-query log entries carry it (see rag/slow_log.py).
+
+A call abandoned after a timeout may still be billed; its tokens are never
+seen and only the failure is counted.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from rag.coalesce import normalize_query
+from rag.resilience import call
+from rag.slow_log import note
+
+DEEPSEEK_PRICE_INPUT = float(os.environ.get("DEEPSEEK_PRICE_INPUT", "0.28"))
+DEEPSEEK_PRICE_CACHED_INPUT = float(os.environ.get("DEEPSEEK_PRICE_CACHED_INPUT", "0.028"))
+DEEPSEEK_PRICE_OUTPUT = float(os.environ.get("DEEPSEEK_PRICE_OUTPUT", "0.42"))
+USAGE_BUCKET_SECONDS = int(os.environ.get("USAGE_BUCKET_SECONDS", "60"))
+USAGE_BUCKETS = int(os.environ.get("USAGE_BUCKETS", "1440"))
+USAGE_TOP_QUERIES = int(os.environ.get("USAGE_TOP_QUERIES", "500"))
+LATENCY_WINDOW = 500
+
+_lock = threading.Lock()
+_endpoints: dict[str, dict] = {}
+_latencies: dict[str, deque] = {}
+_buckets: OrderedDict[int, dict[str, dict]] = OrderedDict()
+_queries: dict[str, dict] = {}
+
+
+def _empty() -> dict:
+    return {"calls": 0, "failures": 0, "prompt_tokens": 0, "cached_tokens": 0,
+            "completion_tokens": 0, "cost_usd": 0.0, "llm_seconds": 0.0}
+
+
+def _add(totals: dict, usage: dict | None, seconds: float):
+    totals["calls"] += 1
+    totals["llm_seconds"] += seconds
+    if usage is None:
+        totals["failures"] += 1
+        return
+    for key in ("prompt_tokens", "cached_tokens", "completion_tokens", "cost_usd"):
+        totals[key] += usage[key]
+
+
+# ─── Capture ────────────────────────────────────────────────────────────────
+
+def extract_usage(response) -> dict:
+    """Token counts from a LangChain chat response (zeros if it carries none)."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt = usage.get("input_tokens", 0)
+    completion = usage.get("output_tokens", 0)
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    # DeepSeek reports its context-cache hits under its own key
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    cached = token_usage.get("prompt_cache_hit_tokens", cached) or 0
+    if not usage and token_usage:
+        prompt = token_usage.get("prompt_tokens", 0)
+        completion = token_usage.get("completion_tokens", 0)
+    return {"prompt_tokens": prompt, "cached_tokens": cached, "completion_tokens": completion}
+
+
+def cost_usd(usage: dict) -> float:
+    uncached = usage["prompt_tokens"] - usage["cached_tokens"]
+    return (uncached * DEEPSEEK_PRICE_INPUT
+            + usage["cached_tokens"] * DEEPSEEK_PRICE_CACHED_INPUT
+            + usage["completion_tokens"] * DEEPSEEK_PRICE_OUTPUT) / 1_000_000
+
+
+def invoke_llm(llm, prompt: str, endpoint: str, query: str | None = None, deadline: float | None = None):
+    """`llm.invoke(prompt)` under the DeepSeek resilience policy, with its
+    usage recorded for `endpoint`. Returns (response, usage)."""
+    t0 = time.perf_counter()
+    try:
+        response = call("deepseek", lambda: llm.invoke(prompt), deadline=deadline)
+    except BaseException:
+        record(endpoint, None, time.perf_counter() - t0, query)
+        raise
+    seconds = time.perf_counter() - t0
+    usage = extract_usage(response)
+    usage["cost_usd"] = cost_usd(usage)
+    usage["llm_seconds"] = round(seconds, 3)
+    record(endpoint, usage, seconds, query)
+    note(**{f"llm_{key}": value for key, value in usage.items()})
+    return response, usage
+
+
+# ─── Aggregation ────────────────────────────────────────────────────────────
+
+def record(endpoint: str, usage: dict | None, seconds: float, query: str | None = None):
+    """Add one call (usage None = it failed) to every aggregate."""
+    bucket = int(time.time() // USAGE_BUCKET_SECONDS) * USAGE_BUCKET_SECONDS
+    with _lock:
+        _add(_endpoints.setdefault(endpoint, _empty()), usage, seconds)
+        if usage is not None:
+            _latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+        if bucket not in _buckets:
+            _buckets[bucket] = {}
+            while len(_buckets) > USAGE_BUCKETS:
+                _buckets.popitem(last=False)
+        _add(_buckets[bucket].setdefault(endpoint, _empty()), usage, seconds)
+
+        if query and usage is not None:
+            key = normalize_query(query)
+            if key not in _queries and len(_queries) >= USAGE_TOP_QUERIES:
+                # Keep the biggest spenders: the cheapest one makes room
+                del _queries[min(_queries, key=lambda q: _queries[q]["cost_usd"])]
+            entry = _queries.setdefault(key, {"query": query, "endpoints": set(), **_empty()})
+            entry["endpoints"].add(endpoint)
+            _add(entry, usage, seconds)
+
+
+def _rounded(totals: dict) -> dict:
+    successes = totals["calls"] - totals["failures"]
+    out = {**totals, "cost_usd": round(totals["cost_usd"], 6), "llm_seconds": round(totals["llm_seconds"], 3)}
+    if successes:
+        out["mean_prompt_tokens"] = round(totals["prompt_tokens"] / successes, 1)
+        out["mean_completion_tokens"] = round(totals["completion_tokens"] / successes, 1)
+        out["mean_cost_usd"] = round(totals["cost_usd"] / successes, 6)
+        out["cache_hit_rate"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0
+    return out
+
+
+def _percentile(ordered: list[float], q: float):
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else None
+
+
+def get_llm_usage_stats() -> dict:
+    """Per-endpoint totals and latency percentiles (for /api/metrics)."""
+    with _lock:
+        endpoints = {name: dict(totals) for name, totals in _endpoints.items()}
+        latencies = {name: sorted(samples) for name, samples in _latencies.items()}
+    overall = _empty()
+    for totals in endpoints.values():
+        for key in overall:
+            overall[key] += totals[key]
+    return {
+        "prices_per_million": {"input": DEEPSEEK_PRICE_INPUT, "cached_input": DEEPSEEK_PRICE_CACHED_INPUT,
+                               "output": DEEPSEEK_PRICE_OUTPUT},
+        "total": _rounded(overall),
+        "endpoints": {
+            name: {**_rounded(totals), "p50_ms": _percentile(latencies.get(name, []), 0.5),
+                   "p95_ms": _percentile(latencies.get(name, []), 0.95)}
+            for name, totals in endpoints.items()
+        },
+    }
+
+
+def get_llm_usage_report(minutes: int = 60, top: int = 10) -> dict:
+    """Usage stats plus per-bucket history for the last `minutes` and the
+    `top` queries by cost."""
+    since = time.time() - minutes * 60
+    with _lock:
+        buckets = [
+            {"start": start, **{name: _rounded(totals) for name, totals in per_endpoint.items()}}
+            for start, per_endpoint in _buckets.items() if start + USAGE_BUCKET_SECONDS > since
+        ]
+        queries = sorted(_queries.values(), key=lambda e: -e["cost_usd"])[:top]
+        top_queries = [{**_rounded({k: v for k, v in e.items() if k not in ("query", "endpoints")}),
+                        "query": e["query"], "endpoints": sorted(e["endpoints"])} for e in queries]
+    return {
+        **get_llm_usage_stats(),
+        "bucket_seconds": USAGE_BUCKET_SECONDS,
+        "buckets": buckets,
+        "top_queries": top_queries,
+    }
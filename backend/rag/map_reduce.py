@@ -0,0 +1,298 @@
+"""
+Map-reduce conflict detection: the `map_reduce` query mode.
+
+generate_node reads the top RETRIEVAL_TOP_K chunks in one DeepSeek prompt.
+Contradicting evidence often ranks lower than that, and raising the top k
+only makes the single prompt slower and more expensive (and the context
+budget truncates it anyway). This LangGraph variant reads MAP_REDUCE_TOP_K
+candidates instead:
+
+  1. retrieve — the usual hybrid (or session) retrieval, MAP_REDUCE_TOP_K deep.
+  2. partition — candidates are grouped by MAP_PARTITION_BY (a metadata field,
+     default department; the filename when it is missing). Groups above
+     MAP_PARTITION_MAX_CHUNKS are split in rank order; beyond
+     MAP_MAX_PARTITIONS groups, the smallest are merged.
+  3. extract (map) — one small prompt per partition (CLAIM_EXTRACTION_PROMPT,
+     MAP_CONTEXT_TOKENS of context) lists the claims relevant to the query.
+     The partitions fan out with LangGraph's Send; at most MAP_CONCURRENCY
+     run at once per query (the graph's max_concurrency, set in
+     rag.graph.get_answer) and MAP_GLOBAL_CONCURRENCY per process.
+  4. reduce — one prompt cross-references the extracted claims only
+     (CLAIM_REDUCE_PROMPT) and answers in the schema of the single-prompt path.
+
+With a latency budget the map steps must finish within MAP_BUDGET_SHARE of
+the time left after retrieval; a partition that misses it (or fails) is
+skipped and reported, and the reduce runs on the claims of the others. If
+no partition succeeds the answer falls back to retrieval-only, like
+generate_node when DeepSeek misses the deadline.
+
+Compare latency, tokens and cost with the single-prompt path with
+`python -m scripts.bench_map_reduce`.
+"""
+import operator
+import os
+import threading
+import time
+from typing import Annotated, List, Optional
+
+from rag.context import build_context
+from rag.graph import (
+    MAP_CONCURRENCY, RETRIEVAL_TOP_K, RAGState, _retrieval_only_answer, finish_answer, parse_answer, retrieve,
+)
+from rag.llm import get_llm
+from rag.llm_usage import invoke_llm
+from rag.prompts import CLAIM_EXTRACTION_PROMPT, CLAIM_REDUCE_PROMPT
+from rag.slow_log import note, stage
+
+MAP_REDUCE_TOP_K = int(os.environ.get("MAP_REDUCE_TOP_K", "20"))
+MAP_PARTITION_BY = os.environ.get("MAP_PARTITION_BY", "department")
+MAP_PARTITION_MAX_CHUNKS = int(os.environ.get("MAP_PARTITION_MAX_CHUNKS", "5"))
+MAP_MAX_PARTITIONS = int(os.environ.get("MAP_MAX_PARTITIONS", "6"))
+MAP_CONTEXT_TOKENS = int(os.environ.get("MAP_CONTEXT_TOKENS", "1200"))
+MAP_MAX_OUTPUT_TOKENS = 512
+MAP_GLOBAL_CONCURRENCY = int(os.environ.get("MAP_GLOBAL_CONCURRENCY", "16"))
+MAP_BUDGET_SHARE = float(os.environ.get("MAP_BUDGET_SHARE", "0.6"))
+# Claims per partition passed on to the reduce prompt
+MAP_MAX_CLAIMS = 12
+
+MAP_REDUCE_STATS = {
+    "queries": 0,
+    "partitions": 0,
+    "partitions_failed": 0,
+    "claims": 0,
+    "map_wall_seconds": 0.0,
+    "reduce_seconds": 0.0,
+}
+
+# Extraction calls in flight across every query of this process
+_map_slots = threading.BoundedSemaphore(MAP_GLOBAL_CONCURRENCY)
+
+
+class MapReduceState(RAGState):
+    map_deadline: Optional[float]                     # map steps must finish by then
+    extractions: Annotated[List[dict], operator.add]  # one per partition, from the map steps
+
+
+# ─── Partition ──────────────────────────────────────────────────────────────
+
+def partition_documents(docs: list[dict]) -> list[dict]:
+    """Group candidates into {key, documents} partitions (documents keep rank order)."""
+    groups: dict[str, list[dict]] = {}
+    for d in docs:
+        meta = d["metadata"]
+        key = str(meta.get(MAP_PARTITION_BY) or meta.get("filename") or d["id"])
+        groups.setdefault(key, []).append(d)
+
+    partitions = []
+    for key, members in groups.items():
+        for i in range(0, len(members), MAP_PARTITION_MAX_CHUNKS):
+            part = i // MAP_PARTITION_MAX_CHUNKS
+            partitions.append({"key": f"{key} ({part + 1})" if part else key,
+                               "documents": members[i:i + MAP_PARTITION_MAX_CHUNKS]})
+
+    # Too many small groups: merge the two smallest until the call count fits
+    while len(partitions) > max(1, MAP_MAX_PARTITIONS):
+        partitions.sort(key=lambda p: len(p["documents"]))
+        a, b = partitions.pop(0), partitions.pop(0)
+        partitions.append({"key": f"{a['key']} + {b['key']}", "documents": a["documents"] + b["documents"]})
+    rank = {d["id"]: i for i, d in enumerate(docs)}
+    for p in partitions:
+        p["documents"].sort(key=lambda d: rank[d["id"]])
+    return sorted(partitions, key=lambda p: rank[p["documents"][0]["id"]])
+
+
+# ─── Nodes ──────────────────────────────────────────────────────────────────
+
+def retrieve_wide_node(state: MapReduceState):
+    update = retrieve(state, MAP_REDUCE_TOP_K)
+    deadline = state.get("deadline")
+    if deadline is not None:
+        now = time.perf_counter()
+        update["map_deadline"] = now + max(0.0, deadline - now) * MAP_BUDGET_SHARE
+    return update
+
+
+def fan_out(state: MapReduceState):
+    """One Send per partition, or straight to reduce when nothing was retrieved."""
+    from langgraph.types import Send
+
+    partitions = partition_documents(state["documents"])
+    if not partitions:
+        return "reduce"
+    return [
+        Send("extract", {"query": state["query"], "partition": p, "map_deadline": state.get("map_deadline")})
+        for p in partitions
+    ]
+
+
+def extract_node(task: dict):
+    """Map step: the claims of one partition."""
+    partition = task["partition"]
+    deadline = task.get("map_deadline")
+    started = time.perf_counter()
+    report = {"key": partition["key"], "chunks": len(partition["documents"]), "started": started, "claims": []}
+
+    timeout = None if deadline is None else max(0.0, deadline - started)
+    if not _map_slots.acquire(timeout=timeout):
+        report.update(status="skipped: budget exhausted", seconds=0.0)
+        return {"extractions": [report]}
+    try:
+        docs_text, context_stats = build_context(partition["documents"], token_budget=MAP_CONTEXT_TOKENS)
+        report["segments_dropped"] = context_stats["segments_dropped"]
+        prompt = CLAIM_EXTRACTION_PROMPT.format(query=task["query"], documents=docs_text)
+        with stage("map_llm"):
+            response, usage = invoke_llm(get_llm(max_tokens=MAP_MAX_OUTPUT_TOKENS), prompt, "map_extract",
+                                         query=task["query"], deadline=deadline)
+        claims = parse_answer(response.content).get("claims")
+        report.update(status="ok", usage=usage, claims=_valid_claims(claims, partition["documents"]))
+    except Exception as e:
+        report["status"] = "timed out" if isinstance(e, TimeoutError) else f"failed: {e}"
+    finally:
+        _map_slots.release()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return {"extractions": [report]}
+
+
+def _valid_claims(claims, docs: list[dict]) -> list[dict]:
+    """Well-formed claims, each attributed to a chunk of the partition."""
+    by_id = {d["id"]: d for d in docs}
+    valid = []
+    for c in claims if isinstance(claims, list) else []:
+        if not isinstance(c, dict) or not c.get("claim"):
+            continue
+        # Merged segments are listed as "a, b": attribute to their first chunk
+        chunk_id = str(c.get("chunk_id", "")).split(",")[0].strip()
+        doc = by_id.get(chunk_id, docs[0])
+        meta = doc["metadata"]
+        valid.append({
+            "chunk_id": doc["id"],
+            "source": meta.get("filename", doc["id"]),
+            "department": meta.get("department", ""),
+            "date": c.get("date") or meta.get("date", ""),
+            "subject": str(c.get("subject", "")),
+            "claim": str(c["claim"]),
+        })
+    return valid[:MAP_MAX_CLAIMS]
+
+
+def reduce_node(state: MapReduceState):
+    """Cross-reference the extracted claims and answer."""
+    query = state["query"]
+    docs = state["documents"]
+    degraded = list(state.get("degraded", []))
+    extractions = state.get("extractions", [])
+    ok = [e for e in extractions if e["status"] == "ok"]
+    claims = [c for e in ok for c in e["claims"]]
+
+    map_usage = _sum_usage(e["usage"] for e in ok)
+    map_wall = max((e["started"] + e["seconds"] for e in extractions), default=0.0) - \
+        min((e["started"] for e in extractions), default=0.0)
+    map_stats = {
+        "candidates": len(docs),
+        "partitions": [{k: v for k, v in e.items() if k not in ("claims", "started")} | {"claims": len(e["claims"])}
+                       for e in extractions],
+        "claims": len(claims),
+        "map_seconds": round(map_wall, 3),
+        "map_usage": map_usage,
+    }
+    MAP_REDUCE_STATS["queries"] += 1
+    MAP_REDUCE_STATS["partitions"] += len(extractions)
+    MAP_REDUCE_STATS["partitions_failed"] += len(extractions) - len(ok)
+    MAP_REDUCE_STATS["claims"] += len(claims)
+    MAP_REDUCE_STATS["map_wall_seconds"] += map_wall
+    note(map_partitions=len(extractions), map_failed=len(extractions) - len(ok), map_claims=len(claims))
+
+    # Confidence is scored on the same top-k as the single-prompt path
+    scored_docs = docs[:RETRIEVAL_TOP_K]
+    if extractions and not ok:
+        degraded.append("llm")
+        answer_json = _retrieval_only_answer(scored_docs, degraded)
+        answer_json["answer"] = (f"No claims could be extracted ({len(extractions)} partitions "
+                                 f"failed or missed the budget); see the retrieved sources.")
+        answer_json["context_stats"] = {"map_reduce": map_stats}
+        return {"answer_json": answer_json, "degraded": degraded}
+    if len(ok) < len(extractions):
+        degraded.append("map")
+
+    prompt = CLAIM_REDUCE_PROMPT.format(
+        query=query, claims=_format_claims(claims) or "(no relevant claims found)",
+        n_chunks=len(docs), n_sources=len({d["metadata"].get("filename", d["id"]) for d in docs}),
+    )
+    note(prompt_chars=len(prompt))
+    t0 = time.perf_counter()
+    try:
+        with stage("reduce_llm"):
+            response, usage = invoke_llm(get_llm(max_tokens=1024), prompt, "map_reduce",
+                                         query=query, deadline=state.get("deadline"))
+    except TimeoutError:
+        if state.get("deadline") is None:
+            raise
+        degraded.append("llm")
+        answer_json = _retrieval_only_answer(scored_docs, degraded)
+        answer_json["answer"] = "The answer could not be generated within the latency budget; see the retrieved sources."
+        answer_json["context_stats"] = {"map_reduce": map_stats}
+        return {"answer_json": answer_json, "degraded": degraded}
+    reduce_seconds = time.perf_counter() - t0
+    MAP_REDUCE_STATS["reduce_seconds"] += reduce_seconds
+
+    total = _sum_usage([map_usage, usage])
+    # Parallel map calls each noted their own usage; the trace keeps the query's total
+    note(**{f"llm_{key}": value for key, value in total.items()})
+    context_stats = {
+        "map_reduce": {**map_stats, "reduce_usage": usage},
+        "llm_seconds": round(map_wall + reduce_seconds, 3),
+        "llm_usage": total,
+    }
+    with stage("parse"):
+        answer_data = parse_answer(response.content)
+    return {"answer_json": finish_answer(answer_data, scored_docs, degraded, context_stats), "degraded": degraded}
+
+
+def _format_claims(claims: list[dict]) -> str:
+    return "\n".join(
+        f"[{c['chunk_id']} | {c['source']} | {c['department'] or '-'} | {c['date'] or '-'}] "
+        + (f"{c['subject']}: " if c["subject"] else "") + c["claim"]
+        for c in claims
+    )
+
+
+def _sum_usage(usages) -> dict:
+    total = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    for usage in usages:
+        total["calls"] += usage.get("calls", 1)
+        for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            total[key] += usage.get(key, 0)
+        total["cost_usd"] += usage.get("cost_usd", 0.0)
+    total["cost_usd"] = round(total["cost_usd"], 6)
+    return total
+
+
+# ─── Graph ──────────────────────────────────────────────────────────────────
+
+def build_workflow():
+    """The map-reduce StateGraph (compiled by rag.graph.get_app_graph)."""
+    from langgraph.graph import StateGraph, END
+
+    workflow = StateGraph(MapReduceState)
+    workflow.add_node("retrieve", retrieve_wide_node)
+    workflow.add_node("extract", extract_node)
+    workflow.add_node("reduce", reduce_node)
+    workflow.set_entry_point("retrieve")
+    workflow.add_conditional_edges("retrieve", fan_out, ["extract", "reduce"])
+    workflow.add_edge("extract", "reduce")
+    workflow.add_edge("reduce", END)
+    return workflow
+
+
+def get_map_reduce_stats() -> dict:
+    n = MAP_REDUCE_STATS["queries"]
+    return {
+        **MAP_REDUCE_STATS,
+        "top_k": MAP_REDUCE_TOP_K,
+        "partition_by": MAP_PARTITION_BY,
+        "concurrency": MAP_CONCURRENCY,
+        "map_wall_seconds": round(MAP_REDUCE_STATS["map_wall_seconds"], 3),
+        "reduce_seconds": round(MAP_REDUCE_STATS["reduce_seconds"], 3),
+        "mean_partitions": round(MAP_REDUCE_STATS["partitions"] / n, 2) if n else 0.0,
+        "mean_claims": round(MAP_REDUCE_STATS["claims"] / n, 1) if n else 0.0,
+    }
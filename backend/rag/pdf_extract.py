@@ -0,0 +1,139 @@
+"""
+PDF text extraction with an on-disk cache and page-parallel parsing.
+
+PyPDF2 parsing is the slowest per-file step of ingestion and used to run
+again for every file on each /api/recreate-embeddings. Here:
+
+  - Extracted text is cached under PDF_CACHE_DIR, keyed by the SHA-256 of
+    the file bytes and EXTRACTOR_VERSION, so an unchanged PDF is parsed once
+    (renaming or re-uploading the same bytes is still a cache hit). Bump
+    EXTRACTOR_VERSION whenever the extraction logic changes.
+  - PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page
+    ranges that a process pool extracts concurrently (each worker opens the
+    file itself, so no parser state is pickled). Workers are started with
+    forkserver (spawn where unavailable): this runs inside the threaded API
+    process, which is unsafe to fork.
+  - Every page is timed. Timings are stored in the cache entry and pages
+    slower than PDF_SLOW_PAGE_SECONDS are logged and kept in PDF_STATS.
+
+The text is identical to the former inline loop: every non-empty page's
+text followed by a newline.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+EXTRACTOR_VERSION = "pypdf2-1"
+PDF_CACHE_DIR = os.environ.get(
+    "PDF_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "pdf_text"),
+)
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "24"))
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_SLOW_PAGE_SECONDS = float(os.environ.get("PDF_SLOW_PAGE_SECONDS", "2.0"))
+MAX_SLOW_PAGES = 50
+
+PDF_STATS = {
+    "files": 0,
+    "cache_hits": 0,
+    "pages_extracted": 0,
+    "extract_seconds": 0.0,
+    "slow_pages": [],
+}
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_path(digest: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{digest}.{EXTRACTOR_VERSION}.json")
+
+
+def _extract_range(path: str, start: int, stop: int) -> list[tuple[str, float]]:
+    """(text, seconds) for pages [start, stop) of the PDF at `path`."""
+    import PyPDF2
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        pages = []
+        for i in range(start, stop):
+            t0 = time.perf_counter()
+            text = reader.pages[i].extract_text() or ""
+            pages.append((text, time.perf_counter() - t0))
+        return pages
+
+
+def _page_count(path: str) -> int:
+    import PyPDF2
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _extract_pages(path: str) -> list[tuple[str, float]]:
+    n_pages = _page_count(path)
+    if n_pages < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+        return _extract_range(path, 0, n_pages)
+
+    # A few ranges per worker so one slow page range doesn't serialize the tail
+    n_ranges = min(n_pages, PDF_WORKERS * 4)
+    bounds = [n_pages * i // n_ranges for i in range(n_ranges + 1)]
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context(method)) as pool:
+        parts = pool.map(_extract_range, [path] * n_ranges, bounds[:-1], bounds[1:])
+        return [page for part in parts for page in part]
+
+
+def extract_pdf(path: str) -> dict:
+    """Extract a PDF's text (cached). Returns {text, pages, page_seconds, cached}."""
+    digest = _file_digest(path)
+    cache_path = _cache_path(digest)
+    PDF_STATS["files"] += 1
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        PDF_STATS["cache_hits"] += 1
+        return {**entry, "cached": True}
+
+    t0 = time.perf_counter()
+    pages = _extract_pages(path)
+    elapsed = time.perf_counter() - t0
+    entry = {
+        "text": "".join(text + "\n" for text, _ in pages if text),
+        "pages": len(pages),
+        "page_seconds": [round(seconds, 4) for _, seconds in pages],
+        "seconds": round(elapsed, 4),
+    }
+    PDF_STATS["pages_extracted"] += len(pages)
+    PDF_STATS["extract_seconds"] += elapsed
+
+    for page_no, seconds in enumerate(entry["page_seconds"], 1):
+        if seconds >= PDF_SLOW_PAGE_SECONDS:
+            logger.warning("Slow PDF page: %s page %d took %.1fs", os.path.basename(path), page_no, seconds)
+            PDF_STATS["slow_pages"].append({"file": os.path.basename(path), "page": page_no, "seconds": seconds})
+    del PDF_STATS["slow_pages"][:-MAX_SLOW_PAGES]
+
+    # A temp file of its own: concurrent extractions of the same PDF may race here
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=PDF_CACHE_DIR, suffix=".tmp", delete=False) as f:
+        json.dump(entry, f)
+    os.replace(f.name, cache_path)
+    return {**entry, "cached": False}
+
+
+def extract_pdf_text(path: str) -> str:
+    return extract_pdf(path)["text"]
+
+
+def get_pdf_stats() -> dict:
+    return {**PDF_STATS, "extract_seconds": round(PDF_STATS["extract_seconds"], 3)}
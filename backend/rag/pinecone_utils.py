@@ -1,24 +1,133 @@
+import logging
 import os
-from pinecone import Pinecone
+import re
+import threading
+import time
+from rag.embeddings import DIMENSIONS
+from rag.resilience import call
+
+_pc = None
+_index = None
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+# ─── Live namespace ─────────────────────────────────────────────────────────
+# Queries and uploads target the "live" namespace of the index. A blue/green
+# rebuild (see rag/blue_green.py) fills a fresh namespace and then swaps this
+# pointer. "" is Pinecone's default namespace, live until the first
+# blue/green rebuild.
+#
+# The pointer is a marker record in the index itself (LIVE_POINTER_NAMESPACE),
+# so every worker, every host and scripts/ingest.py read the same one; a
+# local file would be missed by other hosts and lost on redeploy. Each
+# process re-reads it at most every LIVE_POINTER_TTL_SECONDS (kept well below
+# INDEX_GC_DELAY_SECONDS) and keeps the last value it read, also on disk,
+# for when Pinecone cannot be reached.
+INDEX_VERSION_DIR = os.environ.get(
+    "INDEX_VERSION_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "index_versions"),
+)
+LIVE_POINTER_NAMESPACE = os.environ.get("LIVE_POINTER_NAMESPACE", "index-pointer")
+LIVE_POINTER_ID = "live"
+LIVE_POINTER_TTL_SECONDS = float(os.environ.get("LIVE_POINTER_TTL_SECONDS", "5"))
+_live: tuple[str, float] | None = None  # (namespace, monotonic time it was read)
+
+
+def _live_cache_path() -> str:
+    return os.path.join(INDEX_VERSION_DIR, "LIVE")
+
+
+def _read_live_cache() -> str:
+    try:
+        with open(_live_cache_path(), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def _write_live_cache(namespace: str):
+    os.makedirs(INDEX_VERSION_DIR, exist_ok=True)
+    tmp_path = f"{_live_cache_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(namespace)
+    os.replace(tmp_path, _live_cache_path())
+
+
+def read_live_pointer() -> str:
+    """The live namespace as stored in Pinecone (raises if unreachable)."""
+    index = get_pinecone_index()
+    result = call("pinecone", lambda: index.fetch(ids=[LIVE_POINTER_ID], namespace=LIVE_POINTER_NAMESPACE))
+    record = result.vectors.get(LIVE_POINTER_ID)
+    return (record.metadata or {}).get("namespace", "") if record is not None else ""
+
+
+def live_namespace() -> str:
+    """Namespace queries should hit (re-read when another process or host swaps it)."""
+    global _live
+    now = time.monotonic()
+    if _live is not None and now - _live[1] < LIVE_POINTER_TTL_SECONDS:
+        return _live[0]
+    try:
+        namespace = read_live_pointer()
+    except Exception as e:
+        namespace = _live[0] if _live is not None else _read_live_cache()
+        logger.warning("Reading the live namespace pointer failed (%s); using %r", e, namespace)
+    else:
+        if _live is None or namespace != _live[0]:
+            _write_live_cache(namespace)
+    _live = (namespace, now)
+    return namespace
+
+
+def set_live_namespace(namespace: str):
+    """Point every worker and host at `namespace` (within LIVE_POINTER_TTL_SECONDS)."""
+    global _live
+    pointer = [1.0] + [0.0] * (DIMENSIONS - 1)  # records need a non-zero vector
+    get_pinecone_index().upsert(
+        vectors=[{"id": LIVE_POINTER_ID, "values": pointer, "metadata": {"namespace": namespace, "set_at": time.time()}}],
+        namespace=LIVE_POINTER_NAMESPACE,
+    )
+    _write_live_cache(namespace)
+    _live = (namespace, time.monotonic())
+
+
+def namespace_vector_count(index, namespace: str) -> int:
+    """Vectors stored in one namespace (describe_index_stats is eventually consistent)."""
+    summary = (index.describe_index_stats().namespaces or {}).get(namespace)
+    return summary.vector_count if summary is not None else 0
+
 
 def get_pinecone_index():
+    """Return a cached Index handle, creating the Pinecone client on first use."""
+    global _pc, _index
+    if _index is not None:
+        return _index
+
     api_key = os.environ.get("PINECONE_API_KEY")
     if not api_key:
         raise ValueError("PINECONE_API_KEY is not set")
-    
-    pc = Pinecone(api_key=api_key)
-    index_name = os.environ.get("PINECONE_INDEX_NAME", "envint-rag")
-    
-    return pc.Index(index_name)
 
-def search_pinecone(query_vector: list[float], top_k: int = 5):
+    with _lock:
+        if _index is None:
+            from pinecone import Pinecone  # heavy SDK import deferred to first use
+            _pc = Pinecone(api_key=api_key)
+            index_name = os.environ.get("PINECONE_INDEX_NAME", "envint-rag")
+            _index = _pc.Index(index_name)
+    return _index
+
+def search_pinecone(query_vector: list[float], top_k: int = 5, namespace: str | None = None,
+                    include_values: bool = False):
     index = get_pinecone_index()
-    res = index.query(
+    namespace = live_namespace() if namespace is None else namespace
+    # Read-only and idempotent: eligible for hedging (see rag/resilience.py)
+    res = call("pinecone", lambda: index.query(
         vector=query_vector,
         top_k=top_k,
-        include_metadata=True
-    )
-    
+        include_metadata=True,
+        include_values=include_values,
+        namespace=namespace,
+    ))
+
     matches = []
     for match in res.get("matches", []):
         matches.append({
@@ -26,4 +135,30 @@ def search_pinecone(query_vector: list[float], top_k: int = 5):
             "score": match["score"],
             "metadata": match["metadata"]
         })
+        if include_values:
+            matches[-1]["values"] = match["values"]
     return matches
+
+
+# ─── Per-document ids ───────────────────────────────────────────────────────
+# Chunk ids are "{filename}_chunk_{i}", so a document's vectors can be listed
+# by id prefix (O(chunks in the document), no separate mapping to keep in sync).
+DELETE_BATCH_SIZE = 1000  # Pinecone's limit per delete call
+
+
+def document_chunk_ids(filename: str, namespace: str | None = None) -> list[str]:
+    """Ids of every chunk of `filename` stored in the namespace (default: live)."""
+    index = get_pinecone_index()
+    namespace = live_namespace() if namespace is None else namespace
+    prefix = f"{filename}_chunk_"
+    # The prefix also matches e.g. "{filename}_chunk_1.txt_chunk_0" of another file
+    own = re.compile(re.escape(prefix) + r"\d+")
+    return [vid for page in index.list(prefix=prefix, namespace=namespace) for vid in page if own.fullmatch(vid)]
+
+
+def delete_ids(ids, namespace: str | None = None):
+    index = get_pinecone_index()
+    namespace = live_namespace() if namespace is None else namespace
+    ids = list(ids)
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        index.delete(ids=ids[i:i + DELETE_BATCH_SIZE], namespace=namespace)
@@ -1,5 +1,3 @@
-from langchain_core.prompts import ChatPromptTemplate
-
 # System prompt for analyzing claims and detecting conflicts
 CONFLICT_DETECTION_PROMPT = """
 You are a highly analytical AI assistant in a hospital administration context.
@@ -36,5 +34,74 @@ The "llm_confidence" must be an integer 0-100 representing how confident you are
 ONLY output the JSON. Do not include markdown formatting or extra text outside the JSON.
 """
 
-conflict_prompt = ChatPromptTemplate.from_template(CONFLICT_DETECTION_PROMPT)
+# Map step of the map-reduce graph (rag/map_reduce.py): one small partition of
+# the candidates, claims only — no cross-referencing, no answer.
+CLAIM_EXTRACTION_PROMPT = """
+Extract the factual claims relevant to the query from the document passages below.
+<query>
+{query}
+</query>
+
+<documents>
+{documents}
+</documents>
+
+Rules:
+- One claim per statement of fact (figures, dates, statuses, trends); quote numbers exactly.
+- Only claims relevant to the query. Do not judge, compare or reconcile them.
+- "chunk_id" is the ID of the passage the claim comes from.
+
+Provide your response strictly in valid JSON format matching this schema:
+{{
+    "claims": [
+        {{"chunk_id": "file_chunk_3", "subject": "MRI machine", "claim": "The MRI machine is fully operational.", "date": "2024-03-15"}}
+    ]
+}}
+
+ONLY output the JSON. Do not include markdown formatting or extra text outside the JSON.
+"""
+
+# Reduce step: cross-references the extracted claims (never the passages).
+# Same output schema as CONFLICT_DETECTION_PROMPT.
+CLAIM_REDUCE_PROMPT = """
+You are a highly analytical AI assistant in a hospital administration context.
+Claims relevant to the query below were extracted from {n_chunks} retrieved document passages
+({n_sources} sources). Each line is: [chunk ID | source | department | date] subject: claim
+<query>
+{query}
+</query>
+
+<claims>
+{claims}
+</claims>
+
+Task:
+1. Cross-reference the claims to identify any contradictions or conflicts between sources (e.g., one report says satisfaction went up, another says complaints went up). Claims from different dates may describe a change over time rather than a conflict.
+2. Answer the query from the claims, flagging conflicts clearly and citing the chunk IDs.
+3. Determine your confidence level based on the consistency of the evidence (High: very consistent, Medium: some conflicting aspects, Low: highly contradictory).
+4. Rate your own confidence (0-100) that your answer directly and accurately addresses the user's question.
+
+Provide your response strictly in valid JSON format matching this schema:
+{{
+    "answer": "A concise summary answering the query, acknowledging any conflicts.",
+    "conflicting_evidence": [
+        "Document A -> Claim X",
+        "Document B -> Claim Y"
+    ],
+    "confidence_level": "High|Medium|Low",
+    "reasoning": "Explain HOW the conflict was identified, what evidence supports or contradicts the answer. Do NOT mention the confidence level or score in this field — it is computed separately by the system.",
+    "llm_confidence": 75
+}}
+
+ONLY output the JSON. Do not include markdown formatting or extra text outside the JSON.
+"""
+
+
+def __getattr__(name):
+    # `conflict_prompt` is built on first access so importing the prompt
+    # strings does not pull in langchain_core.
+    if name == "conflict_prompt":
+        from langchain_core.prompts import ChatPromptTemplate
+        return ChatPromptTemplate.from_template(CONFLICT_DETECTION_PROMPT)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,220 @@
+"""
+Timeouts, retries and hedged requests for the external service calls.
+
+Each service (Pinecone query, Gemini query embedding, DeepSeek) gets a
+policy. `call(service, fn)` runs `fn` on a worker thread and:
+
+  - Adaptive timeout: once enough samples exist, an attempt times out after
+    TIMEOUT_MULTIPLIER × the service's observed p99 (clamped to the policy's
+    min/max). Before that, the policy's initial timeout applies. A timed-out
+    SDK call cannot be interrupted; its thread is abandoned and its result
+    discarded.
+  - Retries: transient failures (timeouts, connection errors, 408/429/5xx)
+    are retried with full-jitter exponential backoff. Services whose policy
+    sets retry_timeouts=False (DeepSeek) do not retry timeouts: the abandoned
+    request keeps running and is billed, so a retry would pay twice for one
+    slow completion.
+  - Hedging (idempotent reads only): if an attempt has not answered after the
+    service's p`hedge_quantile` latency, one duplicate is sent and the first
+    answer wins.
+  - Deadline: an optional absolute `time.perf_counter()` deadline (a request's
+    latency budget) caps every attempt's timeout, and no retry starts once it
+    has passed.
+
+Latency samples are per attempt (the primary's duration, even when a hedge
+won), so `get_resilience_stats` can compare the observed p99 with the p99
+the callers would have seen without hedging.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+HEDGING_ENABLED = os.environ.get("HEDGING_ENABLED", "1") != "0"
+TIMEOUT_MULTIPLIER = float(os.environ.get("TIMEOUT_MULTIPLIER", "3"))
+MIN_SAMPLES = 20
+WINDOW = 500
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 2.0
+
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+TRANSIENT_NAMES = ("Timeout", "Connection", "RateLimit", "ServiceUnavailable", "InternalServer", "Unavailable")
+
+
+@dataclass
+class Policy:
+    initial_timeout: float
+    min_timeout: float
+    max_timeout: float
+    retries: int
+    hedge: bool = False
+    hedge_quantile: float = 0.9
+    retry_timeouts: bool = True
+
+
+POLICIES = {
+    "pinecone": Policy(initial_timeout=5.0, min_timeout=0.5, max_timeout=10.0, retries=2, hedge=True),
+    "gemini": Policy(initial_timeout=5.0, min_timeout=0.5, max_timeout=10.0, retries=2, hedge=True),
+    # Ingestion batches (up to 100 texts): slower, not worth duplicating
+    "gemini_batch": Policy(initial_timeout=30.0, min_timeout=5.0, max_timeout=60.0, retries=3),
+    # Generation is expensive and not idempotent in cost: never hedged, and
+    # only retried when the request surely did not run (the budget fallback
+    # in generate_node covers slow completions)
+    "deepseek": Policy(initial_timeout=60.0, min_timeout=10.0, max_timeout=90.0, retries=1, retry_timeouts=False),
+}
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("RESILIENCE_THREADS", "64")),
+                               thread_name_prefix="resilience")
+
+
+class _ServiceState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempt_latencies = deque(maxlen=WINDOW)   # primary attempt durations
+        self.observed_latencies = deque(maxlen=WINDOW)  # what callers waited
+        self.unhedged_latencies = deque(maxlen=WINDOW)  # what they would have waited
+        self.counters = {"calls": 0, "failures": 0, "retries": 0, "timeouts": 0,
+                         "hedges_sent": 0, "hedge_wins": 0}
+
+    def quantile(self, samples, q: float):
+        with self.lock:
+            ordered = sorted(samples)
+        if len(ordered) < MIN_SAMPLES:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.counters[key] += n
+
+
+_states = {name: _ServiceState() for name in POLICIES}
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    for attr in ("status_code", "status", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int) and value in TRANSIENT_STATUS:
+            return True
+    return any(name in type(exc).__name__ for name in TRANSIENT_NAMES)
+
+
+def is_timeout(exc: BaseException) -> bool:
+    """A timeout after the request was sent (our own or the SDK's)."""
+    return isinstance(exc, TimeoutError) or "Timeout" in type(exc).__name__
+
+
+def current_timeout(service: str) -> float:
+    policy, state = POLICIES[service], _states[service]
+    p99 = state.quantile(state.attempt_latencies, 0.99)
+    if p99 is None:
+        return policy.initial_timeout
+    return min(policy.max_timeout, max(policy.min_timeout, p99 * TIMEOUT_MULTIPLIER))
+
+
+def _timed(state: _ServiceState, fn, record: bool):
+    t0 = time.perf_counter()
+    result = fn()
+    if record:
+        with state.lock:
+            state.attempt_latencies.append(time.perf_counter() - t0)
+    return result
+
+
+def _attempt(service: str, fn, hedge: bool, t_call: float, deadline: float | None):
+    """One attempt, possibly hedged. Returns the first successful result."""
+    policy, state = POLICIES[service], _states[service]
+    start = time.perf_counter()
+    timeout = current_timeout(service)
+    if deadline is not None:
+        timeout = min(timeout, deadline - start)
+        if timeout <= 0:
+            state.count("timeouts")
+            raise TimeoutError(f"{service} call skipped: deadline already passed")
+    primary = _executor.submit(_timed, state, fn, True)
+
+    # The primary's own finishing time is the "no hedging" latency
+    def record_unhedged(future):
+        if future.exception() is None:
+            with state.lock:
+                state.unhedged_latencies.append(time.perf_counter() - t_call)
+    primary.add_done_callback(record_unhedged)
+
+    pending = {primary}
+    hedge_delay = state.quantile(state.attempt_latencies, policy.hedge_quantile) if hedge else None
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(pending, timeout=hedge_delay)
+        if not done:
+            state.count("hedges_sent")
+            pending.add(_executor.submit(_timed, state, fn, False))
+
+    last_error = None
+    while pending:
+        remaining = timeout - (time.perf_counter() - start)
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    state.count("hedge_wins")
+                return future.result()
+            last_error = future.exception()
+    if pending:
+        state.count("timeouts")
+        raise TimeoutError(f"{service} call timed out after {timeout:.2f}s")
+    raise last_error
+
+
+def call(service: str, fn, hedge: bool | None = None, deadline: float | None = None):
+    """Run `fn()` under the service's timeout / retry / hedging policy."""
+    policy, state = POLICIES[service], _states[service]
+    hedge = policy.hedge if hedge is None else hedge
+    hedge = hedge and HEDGING_ENABLED
+    state.count("calls")
+    t_call = time.perf_counter()
+
+    for attempt in range(policy.retries + 1):
+        try:
+            result = _attempt(service, fn, hedge, t_call, deadline)
+        except Exception as e:
+            out_of_time = deadline is not None and time.perf_counter() >= deadline
+            retryable = is_transient(e) and (policy.retry_timeouts or not is_timeout(e))
+            if attempt >= policy.retries or out_of_time or not retryable:
+                state.count("failures")
+                raise
+            state.count("retries")
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            logger.warning("%s call failed (%s), retry %d in %.2fs", service, e, attempt + 1, delay)
+            time.sleep(delay)
+            continue
+        with state.lock:
+            state.observed_latencies.append(time.perf_counter() - t_call)
+        return result
+
+
+def get_resilience_stats() -> dict:
+    stats = {"hedging_enabled": HEDGING_ENABLED}
+    for service, state in _states.items():
+        observed_p99 = state.quantile(state.observed_latencies, 0.99)
+        unhedged_p99 = state.quantile(state.unhedged_latencies, 0.99)
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        hedges = state.counters["hedges_sent"]
+        stats[service] = {
+            **state.counters,
+            "timeout_ms": ms(current_timeout(service)),
+            "hedge_win_rate": round(state.counters["hedge_wins"] / hedges, 3) if hedges else 0.0,
+            "p50_ms": ms(state.quantile(state.observed_latencies, 0.5)),
+            "p99_ms": ms(observed_p99),
+            "p99_unhedged_ms": ms(unhedged_p99),
+            "p99_reduction_ms": ms(unhedged_p99 - observed_p99) if observed_p99 is not None and unhedged_p99 is not None else None,
+        }
+    return stats
@@ -0,0 +1,152 @@
+"""
+Compact encoding of /api/query responses.
+
+A query response used to ship every retrieved chunk twice (`content` and
+`metadata.text`) as stdlib-encoded JSON. Callers now choose what they get:
+
+  - provenance=compact (default): each chunk's text once, in `content`;
+    `metadata` without `text`. provenance=full keeps the old shape,
+    provenance=refs drops the text altogether (id, score, metadata).
+  - fields=answer,confidence: only those top-level keys. A name also selects
+    the keys it prefixes (`confidence` → confidence_level / _score /
+    _breakdown).
+  - Accept: application/msgpack: MessagePack instead of JSON, for
+    service-to-service callers (needs ormsgpack or msgpack; JSON otherwise).
+  - Accept-Encoding: br compresses with brotli when the brotli package is
+    installed; gzip is handled for every endpoint by GZipMiddleware in main.py.
+
+JSON is encoded with orjson when installed (several times faster than the
+stdlib encoder FastAPI uses), falling back to json.dumps.
+
+Results are shared between coalesced callers, so shaping never mutates them.
+"""
+import json
+import os
+import time
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+try:
+    import ormsgpack as msgpack
+except ImportError:
+    try:
+        import msgpack
+    except ImportError:  # MessagePack requests get JSON
+        msgpack = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+RESPONSE_STATS = {
+    "responses": 0,
+    "json": 0,
+    "msgpack": 0,
+    "brotli": 0,
+    "bytes_encoded": 0,
+    "bytes_out": 0,
+    "encode_seconds": 0.0,
+}
+
+
+# ─── Shaping ────────────────────────────────────────────────────────────────
+
+def shape_provenance(provenance: list[dict], mode: str = "compact") -> list[dict]:
+    if mode == "full":
+        return provenance
+    shaped = []
+    for doc in provenance:
+        doc = dict(doc)
+        doc["metadata"] = {k: v for k, v in doc.get("metadata", {}).items() if k != "text"}
+        if mode == "refs":
+            doc.pop("content", None)
+        shaped.append(doc)
+    return shaped
+
+
+def select_fields(result: dict, fields: list[str] | None) -> dict:
+    if not fields:
+        return dict(result)
+    return {
+        key: value for key, value in result.items()
+        if any(key == f or key.startswith(f + "_") for f in fields)
+    }
+
+
+def shape_result(result: dict, fields: str | None = None, provenance: str = "compact") -> dict:
+    """Copy of `result` with the selected top-level fields and provenance shape."""
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    shaped = select_fields(result, wanted)
+    if "provenance" in shaped:
+        shaped["provenance"] = shape_provenance(shaped["provenance"], provenance)
+    return shaped
+
+
+# ─── Encoding ───────────────────────────────────────────────────────────────
+
+def dumps_json(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(payload) -> bytes:
+    if msgpack.__name__ == "ormsgpack":
+        return msgpack.packb(payload, default=str, option=msgpack.OPT_NON_STR_KEYS | msgpack.OPT_SERIALIZE_NUMPY)
+    return msgpack.packb(payload, default=str)
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(t in accept for t in MSGPACK_TYPES)
+
+
+def accepts_brotli(request: Request) -> bool:
+    encodings = [e.split(";")[0].strip() for e in request.headers.get("accept-encoding", "").split(",")]
+    return brotli is not None and "br" in encodings
+
+
+def encode_response(request: Request, payload) -> Response:
+    """Serialize `payload` in the negotiated format and encoding."""
+    t0 = time.perf_counter()
+    if wants_msgpack(request):
+        body, media_type = dumps_msgpack(payload), "application/msgpack"
+        RESPONSE_STATS["msgpack"] += 1
+    else:
+        body, media_type = dumps_json(payload), "application/json"
+        RESPONSE_STATS["json"] += 1
+    RESPONSE_STATS["bytes_encoded"] += len(body)
+
+    # GZipMiddleware adds "Vary: Accept-Encoding" itself when it compresses
+    headers = {"Vary": "Accept"}
+    if len(body) >= RESPONSE_COMPRESS_MIN_BYTES and accepts_brotli(request):
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+        headers.update({"Content-Encoding": "br", "Vary": "Accept, Accept-Encoding"})
+        RESPONSE_STATS["brotli"] += 1
+    RESPONSE_STATS["encode_seconds"] += time.perf_counter() - t0
+    RESPONSE_STATS["responses"] += 1
+    RESPONSE_STATS["bytes_out"] += len(body)  # gzip, if any, comes later
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def get_response_stats() -> dict:
+    n = RESPONSE_STATS["responses"]
+    return {
+        **RESPONSE_STATS,
+        "encode_seconds": round(RESPONSE_STATS["encode_seconds"], 3),
+        "mean_encode_ms": round(RESPONSE_STATS["encode_seconds"] / n * 1000, 3) if n else 0.0,
+        "json_encoder": "orjson" if orjson is not None else "json",
+        "msgpack_encoder": msgpack.__name__ if msgpack is not None else None,
+        "brotli": brotli is not None,
+    }
@@ -0,0 +1,263 @@
+"""
+Conversation sessions: follow-up questions reuse the previous retrieval.
+
+Analysts drill down ("Is the MRI operational?" → "What did Facilities say
+about the helium supply?"), and a follow-up usually needs chunks the first
+retrieval already saw. A query carrying a session id therefore keeps, per
+session:
+
+  - the candidate pool of its last full retrieval: SESSION_POOL_SIZE
+    candidates per leg, with their vectors (from Pinecone) and a small BM25
+    index over their text;
+  - the query embedding and fused scores of the previous turn, and the best
+    vector score the full index offered.
+
+A follow-up embeds its query and rescores the pool locally (cosine against
+the pooled vectors, BM25 over the pooled text, the usual RRF fusion and
+near-duplicate collapse) — no Pinecone query and no full BM25 scan. It falls
+back to a full hybrid search, which refills the pool, when the pool's
+coverage looks insufficient:
+
+  - term coverage: the IDF-weighted share of the query's terms (as known to
+    the full lexical index) that occur in the pool is below
+    SESSION_MIN_TERM_COVERAGE — the follow-up names things the pool never
+    mentions;
+  - vector coverage: the pool's best cosine score is below
+    SESSION_MIN_SCORE_RATIO × the best score the last full retrieval got
+    from Pinecone — the index likely holds better matches;
+  - the live namespace or the contents of its index changed since the pool
+    was filled (a document was uploaded, replaced or deleted; see
+    index_version()), or the pool has no vectors (its vector leg was
+    degraded).
+
+Sessions live in a per-process LRU store of at most SESSION_MAX entries,
+evicted SESSION_TTL_SECONDS after last use.
+"""
+import math
+import operator
+import os
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+from rag.corpus_store import CompactCorpus
+from rag.docstore import hydrate
+from rag.hybrid_search import _tokenize, embed_query, fuse, index_version, query_term_weights, search_legs
+from rag.pinecone_utils import live_namespace
+from rag.slow_log import note, stage
+
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "900"))
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "256"))
+SESSION_POOL_SIZE = int(os.environ.get("SESSION_POOL_SIZE", "30"))
+SESSION_MIN_TERM_COVERAGE = float(os.environ.get("SESSION_MIN_TERM_COVERAGE", "0.6"))
+SESSION_MIN_SCORE_RATIO = float(os.environ.get("SESSION_MIN_SCORE_RATIO", "0.85"))
+
+SESSION_STATS = {
+    "created": 0,
+    "expired": 0,
+    "evicted": 0,
+    "turns": 0,
+    "pool_hits": 0,
+    "full_retrievals": 0,
+    "pool_retrieval_seconds": 0.0,
+    "full_retrieval_seconds": 0.0,
+}
+
+_sessions: OrderedDict[str, "Session"] = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def _unit(values) -> array:
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return array("f", (v / norm for v in values))
+
+
+def _dot(a, b) -> float:
+    return sum(map(operator.mul, a, b))
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.last_used = time.monotonic()
+        self.turns = 0
+        self.lock = threading.Lock()  # one turn at a time per session
+
+        # Candidate pool of the last full retrieval
+        self.namespace: str | None = None
+        self.index_version: tuple | None = None
+        self.lexical: CompactCorpus | None = None
+        self.index_of: dict[str, int] = {}
+        self.vectors: dict[str, array] = {}  # unit-length
+        self.best_vector_score = 0.0
+
+        # Previous turn
+        self.query_vector: array | None = None
+        self.fused: dict[str, float] = {}
+
+    def fill_pool(self, namespace: str, version: tuple, vector_results: list[dict], bm25_results: list[dict]):
+        corpus = CompactCorpus(_tokenize)
+        index_of = {}
+        for doc in vector_results + bm25_results:
+            if doc["id"] not in index_of:
+                index_of[doc["id"]] = len(index_of)
+                corpus.add(doc["id"], doc["metadata"])
+        self.lexical = corpus.finalize()
+        self.index_of = index_of
+        self.vectors = {doc["id"]: _unit(doc["values"]) for doc in vector_results if doc.get("values")}
+        self.best_vector_score = max((doc["score"] for doc in vector_results), default=0.0)
+        self.namespace = namespace
+        self.index_version = version
+
+    def remember(self, query_vector, matches: list[dict]):
+        self.query_vector = _unit(query_vector) if query_vector is not None else None
+        self.fused = {m["id"]: m["score"] for m in matches}
+
+    def coverage(self, query: str, query_vector) -> dict:
+        weights = query_term_weights(query)
+        total = sum(weights.values())
+        covered = sum(w for term, w in weights.items() if self.lexical.vocab.get(term) is not None)
+        report = {"term_coverage": round(covered / total, 3) if total else 1.0}
+        if query_vector is not None and self.vectors:
+            unit = _unit(query_vector)
+            report["best_pool_score"] = round(max(_dot(unit, v) for v in self.vectors.values()), 4)
+            report["best_index_score"] = round(self.best_vector_score, 4)
+            if self.query_vector is not None:
+                report["query_similarity"] = round(_dot(unit, self.query_vector), 4)
+        report["sufficient"] = report["term_coverage"] >= SESSION_MIN_TERM_COVERAGE and (
+            "best_pool_score" not in report
+            or report["best_pool_score"] >= SESSION_MIN_SCORE_RATIO * self.best_vector_score
+        )
+        return report
+
+    def rescore(self, query: str, query_vector, per_leg: int) -> tuple[list[dict], list[dict]]:
+        """Both legs' rankings, computed within the pool."""
+        corpus = self.lexical
+        vector_results = []
+        if query_vector is not None:
+            unit = _unit(query_vector)
+            scored = sorted(((_dot(unit, v), doc_id) for doc_id, v in self.vectors.items()), reverse=True)
+            for score, doc_id in scored[:per_leg]:
+                vector_results.append({"id": doc_id, "score": score,
+                                       "metadata": corpus.metadata(self.index_of[doc_id])})
+        bm25_results = [
+            {"id": corpus.doc_id(i), "score": float(score), "metadata": corpus.metadata(i), "rank": rank + 1}
+            for rank, (i, score) in enumerate(corpus.top_k(_tokenize(query), per_leg))
+        ]
+        return vector_results, bm25_results
+
+
+# ─── Store ──────────────────────────────────────────────────────────────────
+
+def _evict(now: float):
+    """Drop expired sessions, then the least recently used beyond SESSION_MAX.
+    Caller holds _sessions_lock."""
+    while _sessions:
+        oldest = next(iter(_sessions.values()))
+        if now - oldest.last_used < SESSION_TTL_SECONDS:
+            break
+        del _sessions[oldest.id]
+        SESSION_STATS["expired"] += 1
+    while len(_sessions) > SESSION_MAX:
+        _sessions.popitem(last=False)
+        SESSION_STATS["evicted"] += 1
+
+
+def create_session() -> str:
+    return get_session(uuid.uuid4().hex).id
+
+
+def get_session(session_id: str) -> Session:
+    """The session with this id; an unknown or expired id starts a new one."""
+    now = time.monotonic()
+    with _sessions_lock:
+        _evict(now)
+        session = _sessions.get(session_id)
+        if session is None:
+            session = _sessions[session_id] = Session(session_id)
+            SESSION_STATS["created"] += 1
+            _evict(now)
+        session.last_used = now
+        _sessions.move_to_end(session_id)
+    return session
+
+
+def delete_session(session_id: str) -> bool:
+    with _sessions_lock:
+        return _sessions.pop(session_id, None) is not None
+
+
+# ─── Retrieval ──────────────────────────────────────────────────────────────
+
+def session_search(session_id: str, query: str, top_k: int = 5,
+                   vector_deadline: float | None = None) -> tuple[list[dict], list[str], dict]:
+    """Hybrid search for one turn of a session: within the previous turn's
+    candidate pool when it covers the query, otherwise a full search that
+    refills the pool. Returns (results, degraded legs, session report)."""
+    t0 = time.perf_counter()
+    session = get_session(session_id)
+    with session.lock:
+        session.turns += 1
+        SESSION_STATS["turns"] += 1
+        report = {"id": session.id, "turn": session.turns}
+        per_leg = top_k * 2
+        namespace = live_namespace()
+        version = index_version()
+
+        query_vector = embed_query(query, vector_deadline)
+        # A pool filled while the vector leg was down cannot rank semantically,
+        # and one filled before a delete or replace may hold stale chunks
+        if session.vectors and session.namespace == namespace and session.index_version == version:
+            with stage("pool_coverage"):
+                report["coverage"] = session.coverage(query, query_vector)
+            if report["coverage"]["sufficient"]:
+                with stage("pool_rescore"):
+                    vector_results, bm25_results = session.rescore(query, query_vector, per_leg)
+                degraded = ["vector"] if query_vector is None else []
+                matches = fuse(vector_results, bm25_results, top_k)
+                return _finish(session, report, "pool", query_vector, matches, degraded, t0)
+
+        # Full retrieval with a deeper candidate list per leg, kept as the pool
+        vector_results, bm25_results, degraded = search_legs(
+            query, max(SESSION_POOL_SIZE, per_leg), vector_deadline,
+            query_vector=query_vector, include_values=True,
+        )
+        if query_vector is None and "vector" not in degraded:
+            degraded.append("vector")
+        # The pool keeps every candidate's text, not only the fused ones'
+        hydrate(vector_results, namespace)
+        # Fused from the same per-leg depth as a session-less search
+        matches = fuse(vector_results[:per_leg], bm25_results[:per_leg], top_k)
+        session.fill_pool(namespace, version, vector_results, bm25_results)
+        return _finish(session, report, "full", query_vector, matches, degraded, t0)
+
+
+def _finish(session: Session, report: dict, retrieval: str, query_vector, matches, degraded, t0: float):
+    previous = session.fused
+    session.remember(query_vector, matches)
+    seconds = time.perf_counter() - t0
+    SESSION_STATS["pool_hits" if retrieval == "pool" else "full_retrievals"] += 1
+    SESSION_STATS[f"{retrieval}_retrieval_seconds"] += seconds
+    note(session_retrieval=retrieval, session_pool=len(session.index_of))
+    report.update(
+        retrieval=retrieval,
+        pool_size=len(session.index_of),
+        carried_over=sum(1 for m in matches if m["id"] in previous),
+        retrieval_ms=round(seconds * 1000, 1),
+    )
+    return matches, degraded, report
+
+
+def get_session_stats() -> dict:
+    pool, full = SESSION_STATS["pool_hits"], SESSION_STATS["full_retrievals"]
+    return {
+        **SESSION_STATS,
+        "active": len(_sessions),
+        "pool_hit_rate": round(pool / (pool + full), 3) if pool + full else 0.0,
+        "mean_pool_retrieval_ms": round(SESSION_STATS["pool_retrieval_seconds"] / pool * 1000, 1) if pool else 0.0,
+        "mean_full_retrieval_ms": round(SESSION_STATS["full_retrieval_seconds"] / full * 1000, 1) if full else 0.0,
+        "pool_retrieval_seconds": round(SESSION_STATS["pool_retrieval_seconds"], 3),
+        "full_retrieval_seconds": round(SESSION_STATS["full_retrieval_seconds"], 3),
+    }
@@ -0,0 +1,226 @@
+"""
+Slow-query log with per-stage timings and sampled profiles.
+
+Every /api/query execution carries a QueryTrace. The pipeline marks its
+stages (`with stage("bm25"): ...`) and records counts (`note(...)`); both
+are no-ops outside a traced query. When the query finishes after
+SLOW_QUERY_MS or later, one JSON line is appended to this process's log
+file (rotated at SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS files kept):
+
+  {"ts", "query", "mode", "budget_ms", "total_ms", "stages": {name: ms},
+   "counts": {...}, "degraded": [...], "response_bytes", "failed"?, "profile"?}
+
+Stages are wall-clock time per stage. The vector leg runs alongside BM25,
+so embed + vector and bm25 overlap rather than add up.
+
+Profiling is opt-in: with SLOW_QUERY_PROFILE_RATE > 0 that fraction of
+queries is sampled every SLOW_QUERY_PROFILE_INTERVAL_MS (stacks of the
+threads working on the query, via sys._current_frames). Slowness is only
+known at the end, so the sample is kept when the query turns out slow and
+dropped otherwise — i.e. about that fraction of slow queries gets a profile.
+It is stored in collapsed-stack form ("frame;frame;frame": count), ready for
+flamegraph.pl or speedscope.
+
+Each worker process writes its own file, SLOW_QUERY_LOG with the pid
+before the extension (slow_queries.<pid>.jsonl): rotating one file shared by
+several processes loses records or writes them into the rotated file.
+Summarize all of them with `python -m scripts.slow_queries`.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "2000"))
+SLOW_QUERY_LOG = os.environ.get(
+    "SLOW_QUERY_LOG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "slow_queries.jsonl"),
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", "5"))
+SLOW_QUERY_PROFILE_RATE = float(os.environ.get("SLOW_QUERY_PROFILE_RATE", "0"))
+SLOW_QUERY_PROFILE_INTERVAL_MS = float(os.environ.get("SLOW_QUERY_PROFILE_INTERVAL_MS", "10"))
+MAX_STACK_DEPTH = 64
+
+SLOW_LOG_STATS = {
+    "traced": 0,
+    "logged": 0,
+    "profiled": 0,
+    "profile_samples": 0,
+}
+
+_current: contextvars.ContextVar = contextvars.ContextVar("query_trace", default=None)
+_log = None
+_log_lock = threading.Lock()
+
+
+# ─── Trace ──────────────────────────────────────────────────────────────────
+
+class QueryTrace:
+    def __init__(self, query: str, mode: str, budget_ms=None):
+        self.query = query
+        self.mode = mode
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.counts: dict = {}
+        self.threads: set[int] = set()
+        self.profile: Counter | None = None
+        self._profiler = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        SLOW_LOG_STATS["traced"] += 1
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def start_profiler(self):
+        self.profile = Counter()
+        self._profiler = threading.Thread(target=self._sample, name="slow-query-profiler", daemon=True)
+        self._profiler.start()
+
+    def _sample(self):
+        interval = SLOW_QUERY_PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self.threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.profile[_collapse(frame)] += 1
+
+    def finish(self, result: dict | None) -> bool:
+        """Stop profiling and log the query if it was slow (result None = it
+        raised). Returns True if logged."""
+        self._stop.set()
+        if self._profiler is not None:
+            self._profiler.join()
+        total_ms = (time.perf_counter() - self.started) * 1000
+        if total_ms < SLOW_QUERY_MS:
+            return False
+        entry = {
+            "ts": round(time.time(), 3),
+            "query": self.query,
+            "mode": self.mode,
+            "budget_ms": self.budget_ms,
+            "total_ms": round(total_ms, 1),
+            "stages": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            "counts": self.counts,
+            "degraded": result.get("degraded", []) if result is not None else [],
+            "response_bytes": len(json.dumps(result, default=str).encode("utf-8")) if result is not None else 0,
+        }
+        if result is None:
+            entry["failed"] = True
+        if self.profile:
+            entry["profile"] = dict(self.profile.most_common())
+            SLOW_LOG_STATS["profiled"] += 1
+            SLOW_LOG_STATS["profile_samples"] += sum(self.profile.values())
+        _write(entry)
+        return True
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def start_trace(query: str, mode: str, budget_ms=None) -> QueryTrace:
+    trace = QueryTrace(query, mode, budget_ms)
+    if SLOW_QUERY_PROFILE_RATE > 0 and random.random() < SLOW_QUERY_PROFILE_RATE:
+        trace.start_profiler()
+    return trace
+
+
+def traced(trace: QueryTrace, fn):
+    """Wrap `fn` so that, on whichever thread runs it, it belongs to `trace`."""
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        with trace._lock:
+            trace.threads.add(ident)
+        token = _current.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+            with trace._lock:
+                trace.threads.discard(ident)
+    return run
+
+
+def current_trace() -> QueryTrace | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage of the current query (no-op when untraced)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - t0)
+
+
+def note(**counts):
+    """Record counts / sizes on the current query (no-op when untraced)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.counts.update(counts)
+
+
+# ─── Log file ───────────────────────────────────────────────────────────────
+
+def process_log_path(path: str = SLOW_QUERY_LOG, pid: int | str | None = None) -> str:
+    """The log file of process `pid` (default: this one): slow_queries.<pid>.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+def _get_log() -> logging.Logger:
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or ".", exist_ok=True)
+                handler = RotatingFileHandler(
+                    process_log_path(), maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                    backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8",
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                log = logging.getLogger("rag.slow_queries")
+                log.setLevel(logging.INFO)
+                log.propagate = False
+                log.addHandler(handler)
+                _log = log
+    return _log
+
+
+def _write(entry: dict):
+    _get_log().info(json.dumps(entry, ensure_ascii=False))
+    SLOW_LOG_STATS["logged"] += 1
+
+
+def get_slow_log_stats() -> dict:
+    return {
+        **SLOW_LOG_STATS,
+        "threshold_ms": SLOW_QUERY_MS,
+        "profile_rate": SLOW_QUERY_PROFILE_RATE,
+        "path": process_log_path(),
+    }
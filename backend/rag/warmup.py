@@ -0,0 +1,126 @@
+"""
+Startup warm-up — pays the cold-start costs before the first user query does.
+
+Phases run concurrently in worker threads:
+  1. gemini    : create the Gemini embedding client
+  2. pinecone  : create the Pinecone client + Index handle
+  3. bm25      : map the shared lexical index (building it if none is published)
+  4. deepseek  : open the pooled TLS connection to DeepSeek (best effort)
+  5. graph     : import langgraph and compile the RAG workflows
+
+The app is "ready" once every required phase has succeeded. DeepSeek is
+optional: without it, only /api/query generation is affected.
+
+A required phase that fails (e.g. a Pinecone blip during a deploy) is retried
+with exponential backoff (WARMUP_RETRY_BASE_SECONDS doubling up to
+WARMUP_RETRY_MAX_SECONDS) until it succeeds, so /ready recovers on its own
+instead of answering 503 for the life of the process.
+"""
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_PHASES = ("gemini", "pinecone", "bm25", "graph")
+WARMUP_RETRY_BASE_SECONDS = float(os.environ.get("WARMUP_RETRY_BASE_SECONDS", "1"))
+WARMUP_RETRY_MAX_SECONDS = float(os.environ.get("WARMUP_RETRY_MAX_SECONDS", "30"))
+
+STARTUP_REPORT = {
+    "ready": False,
+    "started_at": None,
+    "total_seconds": None,
+    "phases": {},
+    "retries": 0,
+}
+
+
+def _warm_gemini():
+    from rag.embeddings import _get_client
+    _get_client()
+
+
+def _warm_pinecone():
+    from rag.pinecone_utils import get_pinecone_index
+    get_pinecone_index()
+
+
+def _warm_bm25():
+    from rag.hybrid_search import get_bm25_index
+    from rag.lexical_shards import warm_shards
+    warm_shards(get_bm25_index())
+
+
+def _warm_deepseek():
+    if not os.environ.get("DEEPSEEK_API_KEY"):
+        return "skipped"
+    from rag.llm import warm_llm_connection
+    warm_llm_connection()
+
+
+def _warm_graph():
+    from rag.graph import get_app_graph, QUERY_MODES
+    for mode in QUERY_MODES:
+        get_app_graph(mode)
+
+
+PHASES = {
+    "gemini": _warm_gemini,
+    "pinecone": _warm_pinecone,
+    "bm25": _warm_bm25,
+    "deepseek": _warm_deepseek,
+    "graph": _warm_graph,
+}
+
+
+def _failed_required() -> list[str]:
+    return [p for p in REQUIRED_PHASES if STARTUP_REPORT["phases"].get(p, {}).get("status") != "ok"]
+
+
+async def _run_phase(name: str, fn):
+    attempts = STARTUP_REPORT["phases"].get(name, {}).get("attempts", 0) + 1
+    STARTUP_REPORT["phases"][name] = {"status": "running", "seconds": None, "attempts": attempts}
+    t0 = time.perf_counter()
+    try:
+        outcome = await asyncio.to_thread(fn)
+        status, error = outcome or "ok", None
+    except Exception as e:
+        status, error = "error", str(e)
+        logger.warning("Warm-up phase %s failed: %s", name, e)
+    STARTUP_REPORT["phases"][name] = {
+        "status": status,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "attempts": attempts,
+        **({"error": error} if error else {}),
+    }
+
+
+async def warm_up() -> dict:
+    """Run all warm-up phases concurrently, retrying failed required phases
+    until they succeed, and return the timing report."""
+    STARTUP_REPORT["ready"] = False
+    STARTUP_REPORT["started_at"] = time.time()
+    STARTUP_REPORT["phases"] = {}
+    STARTUP_REPORT["retries"] = 0
+    t0 = time.perf_counter()
+
+    await asyncio.gather(*(_run_phase(name, fn) for name, fn in PHASES.items()))
+
+    delay = WARMUP_RETRY_BASE_SECONDS
+    while failed := _failed_required():
+        logger.warning("Warm-up phases %s failed; retrying in %.1fs", ", ".join(failed), delay)
+        await asyncio.sleep(delay)
+        STARTUP_REPORT["retries"] += 1
+        await asyncio.gather(*(_run_phase(name, PHASES[name]) for name in failed))
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+
+    STARTUP_REPORT["total_seconds"] = round(time.perf_counter() - t0, 3)
+    STARTUP_REPORT["ready"] = True
+
+    timings = ", ".join(
+        f"{name}={info['status']}:{info['seconds']}s" for name, info in STARTUP_REPORT["phases"].items()
+    )
+    logger.info("Warm-up finished in %.3fs (ready=%s) — %s",
+                STARTUP_REPORT["total_seconds"], STARTUP_REPORT["ready"], timings)
+    return STARTUP_REPORT
@@ -0,0 +1,106 @@
+"""
+Memory report for the BM25 corpus: legacy (list of metadata dicts + BM25Okapi)
+vs. the columnar CompactCorpus, on a scaled copy of the data/ corpus.
+
+    python -m scripts.bench_bm25_memory --chunks 100000
+
+Both builds start from the same JSON payloads (what a Pinecone fetch hands
+us) and the report shows the memory each representation retains afterwards.
+Also checks that the top-10 rankings of both are identical.
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from rag.corpus_store import CompactCorpus
+from rag.hybrid_search import _tokenize
+from scripts.bench_utils import SAMPLE_QUERIES, scaled_corpus
+
+
+def build_legacy(payloads: list[str]):
+    from rank_bm25 import BM25Okapi
+    ids, metas, tokenized = [], [], []
+    for payload in payloads:
+        doc = json.loads(payload)
+        ids.append(doc["id"])
+        metas.append(doc["metadata"])
+        tokenized.append(_tokenize(doc["metadata"].get("text", "")))
+    return ids, metas, BM25Okapi(tokenized)
+
+
+def build_compact(payloads: list[str]):
+    corpus = CompactCorpus(_tokenize)
+    for payload in payloads:
+        doc = json.loads(payload)
+        corpus.add(doc["id"], doc["metadata"])
+    return corpus.finalize()
+
+
+def measure(build, payloads):
+    """Return (result, retained bytes, peak bytes, seconds) for one build.
+
+    Timing comes from a separate untraced run, since tracemalloc slows
+    allocation-heavy code unevenly.
+    """
+    gc.collect()
+    t0 = time.perf_counter()
+    build(payloads)
+    seconds = time.perf_counter() - t0
+
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    result = build(payloads)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current - base, peak - base, seconds
+
+
+def check_rankings(legacy, compact, top_k=10) -> int:
+    ids, _, bm25 = legacy
+    mismatches = 0
+    for query in SAMPLE_QUERIES:
+        tokens = _tokenize(query)
+        scores = bm25.get_scores(tokens)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        expected = [(ids[i], float(scores[i])) for i in ranked if scores[i] > 0]
+        got = [(compact.doc_id(i), s) for i, s in compact.top_k(tokens, top_k)]
+        if expected != got:
+            mismatches += 1
+            print(f"  ranking mismatch for {query!r}")
+    return mismatches
+
+
+def mb(n: int) -> str:
+    return f"{n / 1024 / 1024:8.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 corpus memory report")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    args = parser.parse_args()
+
+    docs = scaled_corpus(args.chunks)
+    payloads = [json.dumps(d) for d in docs]
+    del docs
+    print(f"Corpus: {len(payloads):,} chunks, {sum(map(len, payloads)) / 1024 / 1024:.1f} MB of JSON")
+
+    legacy, legacy_bytes, legacy_peak, legacy_s = measure(build_legacy, payloads)
+    compact, compact_bytes, compact_peak, compact_s = measure(build_compact, payloads)
+
+    print()
+    print(f"{'':24}{'retained':>12}{'peak':>12}{'build':>10}")
+    print(f"{'legacy (dicts+BM25Okapi)':24}{mb(legacy_bytes):>12}{mb(legacy_peak):>12}{legacy_s:>9.1f}s")
+    print(f"{'CompactCorpus':24}{mb(compact_bytes):>12}{mb(compact_peak):>12}{compact_s:>9.1f}s")
+    print(f"\nReduction: {legacy_bytes / max(compact_bytes, 1):.1f}x less retained memory")
+    print(f"Packed columns: {mb(compact.memory_bytes())}, interned strings: {len(compact.strings):,}")
+
+    mismatches = check_rankings(legacy, compact)
+    print(f"Ranking check: {'OK' if not mismatches else f'{mismatches} mismatching queries'}")
+
+
+if __name__ == "__main__":
+    main()
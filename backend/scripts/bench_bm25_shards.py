@@ -0,0 +1,70 @@
+"""
+Scaling benchmark for sharded BM25 scoring (rag/lexical_shards.py): query
+latency against the number of shard worker processes, on a scaled copy of
+the data/ corpus written as a memory-mapped lexical index.
+
+    python -m scripts.bench_bm25_shards --chunks 500000
+    python -m scripts.bench_bm25_shards --chunks 1000000 --shards 1 2 4 8 --repeat 5
+
+Every sharded ranking is checked against the unsharded one (ids and scores
+must be identical). Shard counts above the machine's core count are still
+run, but cannot be faster than it.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from rag.corpus_store import CompactCorpus
+from rag.hybrid_search import _tokenize
+from rag import lexical_shards
+from rag.lexical_store import MappedCorpus, write_corpus
+from scripts.bench_utils import SAMPLE_QUERIES, scaled_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded BM25 scaling benchmark")
+    parser.add_argument("--chunks", type=int, default=300_000)
+    parser.add_argument("--shards", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of each query")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    corpus = CompactCorpus(_tokenize)
+    for doc in scaled_corpus(args.chunks):
+        corpus.add(doc["id"], doc["metadata"])
+    corpus.finalize()
+    path = os.path.join(tempfile.mkdtemp(prefix="bm25-shards-"), "bm25.1.idx")
+    write_corpus(corpus, path)
+    del corpus
+    mapped = MappedCorpus(path, _tokenize, 1)
+    print(f"{len(mapped)} chunks, index {mapped.memory_bytes() / 2**20:.0f} MiB, "
+          f"built in {time.perf_counter() - t0:.0f}s; {os.cpu_count()} cores\n")
+
+    queries = [_tokenize(q) for q in SAMPLE_QUERIES]
+    expected = [mapped.top_k(tokens, args.top_k) for tokens in queries]
+
+    print(f"{'shards':>6}{'p50 ms':>9}{'mean ms':>9}{'speedup':>9}{'exact':>7}")
+    baseline = None
+    lexical_shards.LEXICAL_SHARD_MIN_DOCS = 0
+    for shards in args.shards:
+        # Start this many workers before timing
+        lexical_shards.LEXICAL_SHARDS = shards
+        lexical_shards.warm_shards(mapped)
+        timings, exact = [], True
+        for tokens, want in zip(queries, expected):
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                got = lexical_shards.sharded_top_k(mapped, tokens, args.top_k, shards=shards)
+                timings.append((time.perf_counter() - t) * 1000)
+                exact &= got == want
+        mean = statistics.mean(timings)
+        baseline = baseline or mean
+        print(f"{shards:>6}{statistics.median(timings):>9.1f}{mean:>9.1f}{baseline / mean:>8.2f}x{'yes' if exact else 'NO':>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Chunking throughput: LangChain RecursiveCharacterTextSplitter vs rag.chunker.
+
+    python -m scripts.bench_chunker --docs 2000
+    python -m scripts.bench_chunker --docs 2000 --workers 4
+
+The data/ files are replicated up to --docs documents. The baseline builds a
+splitter and `create_documents` per file, as ingestion used to; the chunker
+runs per file and as one batch. Chunk boundaries are checked to be identical.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from rag.chunker import Chunker
+from scripts.ingest import DATA_DIR, load_file
+
+
+def load_documents(n_docs: int) -> list[tuple[str, dict]]:
+    base = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for fname in sorted(os.listdir(DATA_DIR)):
+            fpath = os.path.join(DATA_DIR, fname)
+            loaded = load_file(fpath, fname) if os.path.isfile(fpath) else None
+            if loaded is not None:
+                base.append(loaded)
+    return [(text, dict(meta, replica=i)) for i, (text, meta) in zip(range(n_docs), base * (n_docs // len(base) + 1))]
+
+
+def bench_langchain(docs):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    out = []
+    for text, meta in docs:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        out.extend(splitter.create_documents([text], metadatas=[meta]))
+    return out
+
+
+def bench_chunker(docs):
+    chunker = Chunker(500, 50, unit="chars")
+    out = []
+    for text, meta in docs:
+        out.extend(chunker.create_chunks(text, meta))
+    return out
+
+
+def bench_chunker_batch(docs, workers):
+    return [c for chunks in Chunker(500, 50, unit="chars").chunk_many(docs, workers=workers) for c in chunks]
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunking throughput benchmark")
+    parser.add_argument("--docs", type=int, default=1000, help="number of documents to chunk")
+    parser.add_argument("--workers", type=int, default=1, help="processes for the batch run")
+    args = parser.parse_args()
+
+    docs = load_documents(args.docs)
+    total_mb = sum(len(text) for text, _ in docs) / 1e6
+    print(f"{len(docs)} documents, {total_mb:.1f} MB of text\n")
+
+    # Import outside the timed region; the baseline used to pay it per process only once
+    import langchain_text_splitters  # noqa: F401
+
+    baseline, baseline_s = timed(bench_langchain, docs)
+    single, single_s = timed(bench_chunker, docs)
+    batch, batch_s = timed(bench_chunker_batch, docs, args.workers)
+
+    expected = [d.page_content for d in baseline]
+    for name, chunks in [("chunker", single), ("chunker batch", batch)]:
+        if [c.page_content for c in chunks] != expected:
+            raise SystemExit(f"FAIL: {name} boundaries differ from the LangChain splitter")
+
+    n = len(baseline)
+    print(f"{'splitter':28}{'seconds':>10}{'chunks/s':>12}{'speedup':>9}")
+    for name, seconds in [
+        ("langchain (per file)", baseline_s),
+        ("chunker (per file)", single_s),
+        (f"chunker batch (workers={args.workers})", batch_s),
+    ]:
+        print(f"{name:28}{seconds:>10.2f}{n / seconds:>12,.0f}{baseline_s / seconds:>8.1f}x")
+    print(f"\nOK: {n} chunks, identical boundaries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Prompt-size benchmark: naive per-chunk context vs. the packed context builder.
+
+    python -m scripts.bench_context --top-k 5 10 20
+    python -m scripts.bench_context --top-k 5 10 --llm     # also time DeepSeek calls
+
+Retrieval is BM25-only over the local data/ corpus, so the token comparison
+runs offline. With --llm (needs DEEPSEEK_API_KEY) each prompt is also sent to
+DeepSeek and the mean latency of both variants is reported.
+"""
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+from rag.context import CONTEXT_TOKEN_BUDGET, build_context, estimate_tokens, naive_context
+from rag.corpus_store import CompactCorpus
+from rag.hybrid_search import _tokenize
+from rag.prompts import CONFLICT_DETECTION_PROMPT
+from scripts.bench_utils import SAMPLE_QUERIES, load_base_chunks
+
+load_dotenv()
+
+
+def retrieve(corpus: CompactCorpus, query: str, top_k: int) -> list[dict]:
+    docs = []
+    for idx, score in corpus.top_k(_tokenize(query), top_k):
+        meta = corpus.metadata(idx)
+        docs.append({"id": corpus.doc_id(idx), "score": score, "content": meta["text"], "metadata": meta})
+    return docs
+
+
+def time_llm(prompt: str) -> float:
+    from rag.llm import get_llm
+    t0 = time.perf_counter()
+    get_llm(max_tokens=1024).invoke(prompt)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Context packing benchmark")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--budget", type=int, default=CONTEXT_TOKEN_BUDGET, help="context token budget")
+    parser.add_argument("--llm", action="store_true", help="also measure DeepSeek latency (uses API credits)")
+    args = parser.parse_args()
+
+    corpus = CompactCorpus(_tokenize)
+    for doc in load_base_chunks():
+        corpus.add(doc["id"], doc["metadata"])
+    corpus.finalize()
+
+    print(f"Token budget: {args.budget}  (estimate: 1 token ≈ 4 chars)\n")
+    print(f"{'top_k':>5} {'naive tok':>10} {'packed tok':>10} {'saved':>7} {'merged':>7} {'dropped':>8}"
+          + (f" {'naive s':>8} {'packed s':>9}" if args.llm else ""))
+    for top_k in args.top_k:
+        naive_tok, packed_tok, merged, dropped = [], [], [], []
+        naive_s, packed_s = [], []
+        for query in SAMPLE_QUERIES:
+            docs = retrieve(corpus, query, top_k)
+            naive_text = naive_context(docs)
+            packed_text, stats = build_context(docs, args.budget)
+            naive_tok.append(estimate_tokens(naive_text))
+            packed_tok.append(stats["packed_tokens"])
+            merged.append(stats["chunks_merged"])
+            dropped.append(stats["segments_dropped"] + stats["segments_truncated"])
+            if args.llm:
+                naive_s.append(time_llm(CONFLICT_DETECTION_PROMPT.format(query=query, documents=naive_text)))
+                packed_s.append(time_llm(CONFLICT_DETECTION_PROMPT.format(query=query, documents=packed_text)))
+
+        n, p = statistics.mean(naive_tok), statistics.mean(packed_tok)
+        line = (f"{top_k:>5} {n:>10.0f} {p:>10.0f} {(1 - p / n) * 100:>6.1f}% "
+                f"{statistics.mean(merged):>7.1f} {statistics.mean(dropped):>8.1f}")
+        if args.llm:
+            line += f" {statistics.mean(naive_s):>8.2f} {statistics.mean(packed_s):>9.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
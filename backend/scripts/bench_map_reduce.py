@@ -0,0 +1,97 @@
+"""
+Map-reduce vs single-prompt conflict detection: latency, LLM calls, tokens
+and cost per /api/query answer.
+
+    python -m scripts.bench_map_reduce
+    python -m scripts.bench_map_reduce --llm-ms 600 --ms-per-token 25 --repeat 3
+
+Variants, over the bundled data/ corpus with the fakes of scripts.load_fakes
+(offline, no API keys):
+
+  single, top 5    the answer mode as deployed (RETRIEVAL_TOP_K chunks)
+  single, top N    the same prompt given MAP_REDUCE_TOP_K chunks (packed into
+                   CONTEXT_TOKEN_BUDGET, so the tail is truncated or dropped)
+  map-reduce       the map_reduce mode: partitions extracted concurrently,
+                   then one reduce prompt over the claims
+
+Fake DeepSeek latency = --llm-ms (jittered) + --prefill-ms per 1k prompt
+tokens + --ms-per-token per output token. Token counts are estimated at 4
+characters per token; the fake's answers are shorter than DeepSeek's, so
+completion tokens (and their share of the latency) are understated for the
+single-prompt and reduce steps alike. "dropped" counts the context segments
+(runs of adjacent chunks) that did not fit a prompt's token budget.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from scripts import load_fakes
+from scripts.bench_utils import SAMPLE_QUERIES
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map-reduce vs single-prompt benchmark")
+    parser.add_argument("--llm-ms", type=float, default=400, help="fake DeepSeek base latency (ms)")
+    parser.add_argument("--ms-per-token", type=float, default=20, help="fake generation time per output token")
+    parser.add_argument("--prefill-ms", type=float, default=40, help="fake prefill time per 1k prompt tokens")
+    parser.add_argument("--repeat", type=int, default=2, help="runs per query and variant")
+    args = parser.parse_args()
+
+    load_fakes.isolate_state()
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    from rag import graph
+    from rag.map_reduce import MAP_CONCURRENCY, MAP_REDUCE_TOP_K
+
+    fakes = load_fakes.install(embed_ms=0, pinecone_ms=0, llm_ms=args.llm_ms)
+    fakes["deepseek"].ms_per_output_token = args.ms_per_token
+    fakes["deepseek"].ms_per_1k_prompt_tokens = args.prefill_ms
+    base_top_k = graph.RETRIEVAL_TOP_K
+
+    variants = [
+        (f"single, top {base_top_k}", "answer", base_top_k),
+        (f"single, top {MAP_REDUCE_TOP_K}", "answer", MAP_REDUCE_TOP_K),
+        (f"map-reduce, top {MAP_REDUCE_TOP_K}", "map_reduce", base_top_k),
+    ]
+    print(f"{len(SAMPLE_QUERIES)} queries x {args.repeat}; fake LLM {args.llm_ms:.0f} ms + "
+          f"{args.prefill_ms:.0f} ms/1k prompt tokens + {args.ms_per_token:.0f} ms/output token; "
+          f"map concurrency {MAP_CONCURRENCY}\n")
+    print(f"{'variant':24}{'p50 ms':>8}{'p95 ms':>8}{'calls':>7}{'prompt tok':>12}{'compl tok':>11}"
+          f"{'µ$/query':>10}{'chunks':>8}{'dropped':>9}")
+
+    for name, mode, top_k in variants:
+        graph.RETRIEVAL_TOP_K = top_k
+        asyncio.run(graph.get_answer(SAMPLE_QUERIES[0], mode=mode))  # compile the graph
+        wall, calls, prompt, completion, cost, chunks, dropped = [], [], [], [], [], [], []
+        for _ in range(args.repeat):
+            for query in SAMPLE_QUERIES:
+                t0 = time.perf_counter()
+                result = asyncio.run(graph.get_answer(query, mode=mode))
+                wall.append((time.perf_counter() - t0) * 1000)
+                stats = result["context_stats"]
+                usage = stats["llm_usage"]
+                calls.append(usage.get("calls", 1))
+                prompt.append(usage["prompt_tokens"])
+                completion.append(usage["completion_tokens"])
+                cost.append(usage["cost_usd"] * 1e6)
+                if "map_reduce" in stats:
+                    parts = stats["map_reduce"]["partitions"]
+                    chunks.append(sum(p["chunks"] for p in parts))
+                    dropped.append(sum(p.get("segments_dropped", 0) for p in parts))
+                else:
+                    chunks.append(stats["chunks_in"])
+                    dropped.append(stats["segments_dropped"])
+        print(f"{name:24}{statistics.median(wall):>8.0f}{percentile(wall, 0.95):>8.0f}"
+              f"{statistics.mean(calls):>7.1f}{statistics.mean(prompt):>12.0f}{statistics.mean(completion):>11.0f}"
+              f"{statistics.mean(cost):>10.1f}{statistics.mean(chunks):>8.1f}{statistics.mean(dropped):>9.1f}")
+    graph.RETRIEVAL_TOP_K = base_top_k
+
+
+if __name__ == "__main__":
+    main()
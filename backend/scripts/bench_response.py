@@ -0,0 +1,89 @@
+"""
+Response-encoding benchmark: payload bytes and serialization time of
+/api/query responses per encoder, provenance shape and compression.
+
+    python -m scripts.bench_response
+    python -m scripts.bench_response --mode retrieve --top-k 10 --repeat 500
+
+Responses come from the real pipeline over the bundled data/ corpus, run
+against the zero-latency fakes of scripts.load_fakes (offline, no API keys).
+"before" is what FastAPI did for the old handler: jsonable_encoder plus the
+stdlib encoder, with every chunk's text in both `content` and `metadata`.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import time
+
+from scripts import load_fakes
+from scripts.bench_utils import SAMPLE_QUERIES
+
+
+def time_us(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response encoding benchmark")
+    parser.add_argument("--mode", choices=["answer", "retrieve"], default="answer")
+    parser.add_argument("--top-k", type=int, help="override RETRIEVAL_TOP_K (chunks per response)")
+    parser.add_argument("--repeat", type=int, default=200, help="encodings timed per response")
+    args = parser.parse_args()
+
+    load_fakes.isolate_state()
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    if args.top_k:
+        os.environ["RETRIEVAL_TOP_K"] = str(args.top_k)
+    from fastapi.encoders import jsonable_encoder
+    from rag import response_format as rf
+    from rag.graph import get_answer
+
+    load_fakes.install(embed_ms=0, pinecone_ms=0, llm_ms=0)
+    results = [asyncio.run(get_answer(q, mode=args.mode)) for q in SAMPLE_QUERIES]
+
+    def stdlib(payload):
+        return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    variants = [
+        ("before: stdlib, full", lambda r: r, stdlib),
+        ("json, full", lambda r: rf.shape_result(r, provenance="full"), rf.dumps_json),
+        ("json, compact", lambda r: rf.shape_result(r), rf.dumps_json),
+        ("json, refs", lambda r: rf.shape_result(r, provenance="refs"), rf.dumps_json),
+        ("json, answer,confidence", lambda r: rf.shape_result(r, "answer,confidence"), rf.dumps_json),
+    ]
+    if rf.msgpack is not None:
+        variants.append(("msgpack, compact", lambda r: rf.shape_result(r), rf.dumps_msgpack))
+
+    print(f"{len(results)} {args.mode} responses, "
+          f"{statistics.mean(len(r.get('provenance', [])) for r in results):.1f} chunks each; "
+          f"json = {rf.get_response_stats()['json_encoder']}, "
+          f"msgpack = {rf.get_response_stats()['msgpack_encoder']}\n")
+    header = f"{'variant':26}{'bytes':>8}{'gzip':>8}" + (f"{'br':>8}" if rf.brotli else "")
+    header += f"{'encode µs':>11}{'gzip µs':>9}"
+    print(header)
+    for name, shape, encode in variants:
+        sizes, gz_sizes, br_sizes, enc_us, gz_us = [], [], [], [], []
+        for result in results:
+            body = encode(shape(result))
+            sizes.append(len(body))
+            gz_sizes.append(len(gzip.compress(body, compresslevel=6)))
+            if rf.brotli:
+                br_sizes.append(len(rf.brotli.compress(body, quality=rf.BROTLI_QUALITY)))
+            enc_us.append(time_us(lambda: encode(shape(result)), args.repeat))
+            gz_us.append(time_us(lambda: gzip.compress(body, compresslevel=6), max(1, args.repeat // 10)))
+        line = f"{name:26}{statistics.mean(sizes):>8.0f}{statistics.mean(gz_sizes):>8.0f}"
+        if rf.brotli:
+            line += f"{statistics.mean(br_sizes):>8.0f}"
+        line += f"{statistics.mean(enc_us):>11.1f}{statistics.mean(gz_us):>9.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Shared helpers for the benchmark scripts: load the bundled data/ corpus as
+chunks and scale it up to an arbitrary number of chunks.
+"""
+import contextlib
+import io
+import os
+
+from scripts.ingest import DATA_DIR, process_file
+
+SAMPLE_QUERIES = [
+    "Has patient satisfaction improved in Q1?",
+    "Is the new MRI machine operational?",
+    "Are infection rates decreasing?",
+    "How many night shift nursing positions are filled?",
+    "Did overtime costs go down?",
+    "What is the lab turnaround time?",
+    "How is the pharmacy performing?",
+]
+
+
+def load_base_chunks() -> list[dict]:
+    """Chunk every file in data/ and return [{"id", "metadata"}] like Pinecone does."""
+    docs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for fname in sorted(os.listdir(DATA_DIR)):
+            fpath = os.path.join(DATA_DIR, fname)
+            if not os.path.isfile(fpath):
+                continue
+            for i, chunk in enumerate(process_file(fpath, fname)):
+                meta = chunk.metadata.copy()
+                meta["text"] = chunk.page_content
+                docs.append({"id": f"{fname}_chunk_{i}", "metadata": meta})
+    return docs
+
+
+def scaled_corpus(n_chunks: int, base: list[dict] | None = None) -> list[dict]:
+    """Replicate the base chunks up to `n_chunks`, as if many more files existed.
+
+    Each replica gets its own filename and a replica-specific token in the
+    text so the vocabulary and per-file metadata grow with the corpus.
+    """
+    base = base or load_base_chunks()
+    docs = []
+    replica = 0
+    while len(docs) < n_chunks:
+        for doc in base:
+            if len(docs) >= n_chunks:
+                break
+            meta = dict(doc["metadata"])
+            meta["filename"] = f"r{replica}_{meta['filename']}"
+            meta["source"] = f"r{replica}/{meta['source']}"
+            meta["text"] = f"{meta['text']} replica{replica}"
+            docs.append({"id": f"r{replica}_{doc['id']}", "metadata": meta})
+        replica += 1
+    return docs
@@ -0,0 +1,52 @@
+"""
+Build the shared BM25 index of a namespace and publish it as a new generation.
+
+The chunks are read from a Pinecone scan (backfilling the docstore), or from
+the docstore alone once it holds the namespace with DOCSTORE_SLIM_PINECONE
+(see rag/docstore.py).
+
+Run this as the single builder (deploy hook or cron; scripts.ingest already
+republishes after a bulk ingest); every API worker maps the published file and
+switches to it on its next query:
+
+    python -m scripts.build_lexical_index
+    python -m scripts.build_lexical_index --namespace v20250101T000000
+"""
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from rag.corpus_scan import get_scan_stats
+from rag.hybrid_search import build_and_publish
+from rag.lexical_store import LEXICAL_INDEX_DIR, build_lock, lexical_dir, open_generation
+from rag.pinecone_utils import live_namespace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and publish the shared BM25 index")
+    parser.add_argument("--namespace", default=None, help="Pinecone namespace to index (default: the live one)")
+    args = parser.parse_args()
+    if not LEXICAL_INDEX_DIR:
+        raise SystemExit("LEXICAL_INDEX_DIR is empty; the shared lexical index is disabled.")
+
+    namespace = live_namespace() if args.namespace is None else args.namespace
+    directory = lexical_dir(namespace)
+    t0 = time.perf_counter()
+    with build_lock(directory=directory):
+        generation = build_and_publish(namespace)
+    corpus = open_generation(generation, str.split, directory)
+    size = os.path.getsize(corpus.path)
+    print(f"Published generation {generation}: {len(corpus)} chunks, "
+          f"{size / 1e6:.1f} MB in {time.perf_counter() - t0:.1f}s -> {corpus.path}")
+    scan = get_scan_stats()
+    if scan:
+        print(f"Pinecone scan: {scan['docs']} docs, {scan['fetch_calls']} fetches x{scan['concurrency']} "
+              f"in {scan['seconds']:.1f}s ({scan['docs_per_second']:.0f} docs/s, "
+              f"{scan['resumed_docs']} resumed from checkpoint)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,32 @@
+"""
+Ingest every file in data/ into the live namespace.
+
+    python -m scripts.ingest
+    python -m scripts.ingest --clear    # wipe the live namespace first
+
+Ends by republishing the shared lexical index, so running API workers serve
+BM25 over the new contents on their next query.
+"""
+import argparse
 import os
 import json
-import PyPDF2
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from rag.embeddings import get_embeddings
-from rag.pinecone_utils import get_pinecone_index
+from rag.pinecone_utils import get_pinecone_index, live_namespace
+from rag.claims import index_claims, clear_claims
+from rag.dedup import dedup_records, clear_lsh_index
+from rag.docstore import put_chunks, pinecone_records, clear_namespace
+from rag.hybrid_search import republish_bm25_index
+from rag.chunker import get_chunker
+from rag.pdf_extract import extract_pdf_text
 
 load_dotenv()
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data")
 
 def extract_text_pypdf(file_path):
-    text = ""
-    with open(file_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                text += t + "\n"
-    return text
+    # Cached by content hash; large PDFs are extracted page-parallel
+    return extract_pdf_text(file_path)
 
 def parse_txt_md(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
@@ -34,7 +42,8 @@ def parse_txt_md(file_path):
             pass
     return content, metadata
 
-def process_file(file_path, filename):
+def load_file(file_path, filename):
+    """Return (content, metadata) for a supported file, or None."""
     print(f"Processing {filename}...")
     ext = filename.split('.')[-1].lower()
     content = ""
@@ -47,51 +56,101 @@ def process_file(file_path, filename):
         metadata.update(meta)
     else:
         print(f"Skipping {filename}: Unsupported extension")
+        return None
+    return content, metadata
+
+def process_file(file_path, filename):
+    loaded = load_file(file_path, filename)
+    if loaded is None:
         return []
-        
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = splitter.create_documents([content], metadatas=[metadata])
+    chunks = get_chunker().create_chunks(*loaded)
     return chunks
 
+def clear_index():
+    """Delete the live namespace's vectors, chunk texts, claims and LSH index
+    (as DELETE /api/delete-embeddings does)."""
+    namespace = live_namespace()
+    get_pinecone_index().delete(delete_all=True, namespace=namespace)
+    clear_namespace(namespace)
+    clear_claims()
+    clear_lsh_index()
+    print(f"Cleared namespace {namespace or '(default)'!r}.")
+
+def publish_lexical_index():
+    generation = republish_bm25_index()
+    if generation is not None:
+        print(f"Published lexical index generation {generation}.")
+
 def ingest_all():
-    docs = []
+    files = []
     for f in os.listdir(DATA_DIR):
         file_path = os.path.join(DATA_DIR, f)
         if os.path.isfile(file_path):
-            docs.extend(process_file(file_path, f))
+            loaded = load_file(file_path, f)
+            if loaded is not None:
+                files.append(loaded)
+
+    # Chunk the whole corpus in one batch (CHUNK_WORKERS processes)
+    docs = [chunk for chunks in get_chunker().chunk_many(files) for chunk in chunks]
             
     if not docs:
         print("No documents found.")
+        publish_lexical_index()
         return
 
     print(f"Total chunks generated: {len(docs)}")
     
-    # Extract text and prepare for pinecone
-    texts = [d.page_content for d in docs]
-    print("Generating embeddings...")
-    vectors = get_embeddings(texts)
-    
-    print("Upserting to Pinecone...")
-    index = get_pinecone_index()
-    
     records = []
-    for i, (doc, vec) in enumerate(zip(docs, vectors)):
+    for i, doc in enumerate(docs):
         meta = doc.metadata.copy()
         meta["text"] = doc.page_content
         records.append({
             "id": f"{meta['filename']}_chunk_{i}",
-            "values": vec,
             "metadata": meta
         })
+
+    print("Detecting near-duplicates...")
+    records, dedup_stats = dedup_records(records)
+    print(f"Near-duplicates: {dedup_stats['near_duplicates']} "
+          f"(skipped {dedup_stats['skipped']}, clustered {dedup_stats['clustered']}, "
+          f"{(dedup_stats['text_bytes_saved'] + dedup_stats['vector_bytes_saved']) / 1024:.1f} KB saved)")
+
+    # Extract text and prepare for pinecone
+    texts = [r["metadata"]["text"] for r in records]
+    print("Generating embeddings...")
+    vectors = get_embeddings(texts)
+    for record, vec in zip(records, vectors):
+        record["values"] = vec
+    
+    print("Upserting to Pinecone...")
+    index = get_pinecone_index()
+    namespace = live_namespace()
         
-    # Batch upsert
+    # Text and full metadata go to the docstore (Pinecone keeps the text too
+    # unless DOCSTORE_SLIM_PINECONE, see rag/docstore.py)
+    put_chunks(records, namespace)
     batch_size = 100
     for i in range(0, len(records), batch_size):
-        batch = records[i:i+batch_size]
-        index.upsert(vectors=batch)
+        batch = pinecone_records(records[i:i+batch_size])
+        index.upsert(vectors=batch, namespace=namespace)
         print(f"Upserted batch {i//batch_size + 1}")
-        
+
+    print("Indexing numeric claims...")
+    n_claims = index_claims(records)
+    print(f"Extracted {n_claims} claims.")
+
+    print("Publishing the lexical index...")
+    publish_lexical_index()
+
     print("Ingestion complete.")
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Ingest data/ into the live Pinecone namespace")
+    parser.add_argument("--clear", action="store_true", help="delete the live namespace's contents first")
+    args = parser.parse_args()
+    if args.clear:
+        clear_index()
     ingest_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Local, latency-injecting stand-ins for Pinecone, Gemini and DeepSeek.
+
+Used by scripts.load_test so the API can be driven at full speed without
+network access, API keys or cost. Every fake call sleeps for a jittered
+latency (lognormal around the configured median), the way the real SDK
+calls block their thread.
+
+Run a fake-backed API server on its own (what `load_test --target uvicorn`
+starts in a subprocess):
+
+    python -m scripts.load_fakes --port 8765 --llm-ms 1200
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+import zlib
+
+DIMENSIONS = 384
+
+
+# Share of calls that hit a slow replica / GC pause / cold shard (10x slower)
+SLOW_CALL_RATE = 0.02
+
+
+class Latency:
+    """Median latency in ms with lognormal jitter (sigma 0.3) and rare 10x outliers."""
+
+    def __init__(self, median_ms: float):
+        self.median_ms = median_ms
+
+    def sleep(self):
+        if self.median_ms > 0:
+            outlier = 10 if random.random() < SLOW_CALL_RATE else 1
+            time.sleep(self.median_ms / 1000 * outlier * math.exp(random.gauss(0, 0.3)))
+
+
+def fake_embedding(text: str) -> list[float]:
+    """Hashed bag-of-words vector: texts sharing words are close in cosine."""
+    vec = [0.0] * DIMENSIONS
+    for word in re.findall(r"\w+", text.lower()):
+        vec[zlib.crc32(word.encode()) % DIMENSIONS] += 1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+# ─── Gemini ─────────────────────────────────────────────────────────────────
+
+class _Embedding:
+    def __init__(self, values):
+        self.values = values
+
+
+class _EmbedResult:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+
+class FakeGenaiClient:
+    """embed_content with at most `max_concurrency` calls in flight (quota /
+    connection-pool limit); further calls queue like they would upstream."""
+
+    def __init__(self, latency: Latency, max_concurrency: int = 8):
+        self.models = self
+        self.latency = latency
+        self.calls = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def embed_content(self, model, contents, config=None):
+        with self._slots:
+            self.latency.sleep()
+        self.calls += 1
+        texts = [contents] if isinstance(contents, str) else contents
+        return _EmbedResult([_Embedding(fake_embedding(t)) for t in texts])
+
+
+# ─── Pinecone ───────────────────────────────────────────────────────────────
+
+class _Vector:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeIndex:
+    """In-memory index with namespaces; vectors are kept sparse so queries stay cheap."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.namespaces: dict[str, dict[str, tuple[dict, dict]]] = {}
+        self.calls = 0
+
+    def _call(self):
+        self.latency.sleep()
+        self.calls += 1
+
+    def _ns(self, namespace) -> dict[str, tuple[dict, dict]]:
+        return self.namespaces.setdefault(namespace or "", {})
+
+    def upsert(self, vectors, namespace=None):
+        self._call()
+        store = self._ns(namespace)
+        for v in vectors:
+            sparse = {i: x for i, x in enumerate(v["values"]) if x}
+            store[v["id"]] = (sparse, v.get("metadata", {}))
+
+    def query(self, vector, top_k, include_metadata=True, include_values=False, namespace=None, **kwargs):
+        self._call()
+        store = self._ns(namespace)
+        dense = {i: x for i, x in enumerate(vector) if x}
+        scored = []
+        for vid, (sparse, _) in list(store.items()):
+            scored.append((sum(x * sparse.get(i, 0.0) for i, x in dense.items()), vid))
+        scored.sort(reverse=True)
+        matches = []
+        for score, vid in scored[:top_k]:
+            if vid in store:
+                sparse, metadata = store[vid]
+                matches.append({"id": vid, "score": score, "metadata": metadata})
+                if include_values:
+                    matches[-1]["values"] = [sparse.get(i, 0.0) for i in range(DIMENSIONS)]
+        return {"matches": matches}
+
+    def describe_index_stats(self):
+        self._call()
+        namespaces = {ns: _Result(vector_count=len(store)) for ns, store in self.namespaces.items() if store}
+        return _Result(total_vector_count=sum(len(store) for store in self.namespaces.values()),
+                       namespaces=namespaces)
+
+    def list(self, prefix=None, namespace=None, **kwargs):
+        store = self._ns(namespace)
+        ids = sorted(vid for vid in store if prefix is None or vid.startswith(prefix))
+        for i in range(0, len(ids), 100):
+            self._call()
+            yield ids[i:i + 100]
+
+    def fetch(self, ids, namespace=None):
+        self._call()
+        store = self._ns(namespace)
+        return _Result(vectors={vid: _Vector(store[vid][1]) for vid in ids if vid in store})
+
+    def delete(self, ids=None, delete_all=False, namespace=None, **kwargs):
+        self._call()
+        store = self._ns(namespace)
+        if delete_all:
+            store.clear()
+        for vid in ids or []:
+            store.pop(vid, None)
+
+
+# ─── DeepSeek ───────────────────────────────────────────────────────────────
+
+class _Message:
+    def __init__(self, content, prompt=""):
+        self.content = content
+        # ~4 characters per token, as rag.context estimates
+        self.usage_metadata = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4,
+                               "total_tokens": (len(prompt) + len(content)) // 4}
+
+
+class FakeLLM:
+    """Returns well-formed answers for the conflict-detection, claim-extraction
+    and explain prompts.
+
+    Real generation time grows with the output: `ms_per_output_token` (and
+    `ms_per_1k_prompt_tokens` for prefill) add that on top of the latency.
+    """
+
+    def __init__(self, latency: Latency, ms_per_output_token: float = 0.0, ms_per_1k_prompt_tokens: float = 0.0):
+        self.latency = latency
+        self.ms_per_output_token = ms_per_output_token
+        self.ms_per_1k_prompt_tokens = ms_per_1k_prompt_tokens
+        self.calls = 0
+        self.root_client = _Result(models=_Result(list=lambda: []))
+
+    def invoke(self, prompt):
+        message = self._respond(prompt)
+        self.latency.sleep()
+        usage = message.usage_metadata
+        extra_ms = (usage["output_tokens"] * self.ms_per_output_token
+                    + usage["input_tokens"] / 1000 * self.ms_per_1k_prompt_tokens)
+        if extra_ms > 0:
+            time.sleep(extra_ms / 1000)
+        self.calls += 1
+        return message
+
+    def _respond(self, prompt):
+        if '"claims"' in prompt:
+            blocks = re.finditer(r"^ID: (.+)\nScore: [^\n]*\nContent: ([^\n]{0,160})", prompt, re.MULTILINE)
+            return _Message(json.dumps({"claims": [
+                {"chunk_id": ids.split(",")[0], "subject": "Load test", "claim": text.strip(), "date": ""}
+                for ids, text in (b.groups() for b in blocks)
+            ]}), prompt)
+        if "JSON array" in prompt:
+            ids = re.findall(r"^ID: (.+)$", prompt, re.MULTILINE)
+            return _Message(json.dumps([
+                {"chunk_id": i, "title": "Load test", "relevance": "fake", "key_claims": [], "stance": "neutral"}
+                for i in ids
+            ]), prompt)
+        return _Message(json.dumps({
+            "answer": "Fake answer for load testing.",
+            "conflicting_evidence": [],
+            "confidence_level": "Medium",
+            "reasoning": "Generated by scripts.load_fakes.",
+            "llm_confidence": 60,
+        }), prompt)
+
+
+# ─── Installation ───────────────────────────────────────────────────────────
+
+_state_root = None
+
+
+def isolate_state():
+    """Point every on-disk cache at a temp dir so runs never touch real state."""
+    global _state_root
+    root = _state_root = tempfile.mkdtemp(prefix="rag-loadtest-")
+    os.environ["LEXICAL_INDEX_DIR"] = os.path.join(root, "lexical")
+    os.environ["CLAIMS_INDEX_PATH"] = os.path.join(root, "claims_index.json")
+    os.environ["LSH_INDEX_PATH"] = os.path.join(root, "lsh_index.json")
+    os.environ["PDF_CACHE_DIR"] = os.path.join(root, "pdf_text")
+    os.environ["INDEX_VERSION_DIR"] = os.path.join(root, "index_versions")
+    os.environ["SLOW_QUERY_LOG"] = os.path.join(root, "slow_queries.jsonl")
+    os.environ["DOCSTORE_PATH"] = os.path.join(root, "docstore.sqlite3")
+    os.environ["DEEPSEEK_API_KEY"] = "fake"
+    os.environ["PINECONE_API_KEY"] = "fake"
+    return root
+
+
+def install(embed_ms: float = 80, pinecone_ms: float = 40, llm_ms: float = 1500, seed: bool = True,
+            embed_concurrency: int = 8) -> dict:
+    """Install the fakes into the rag modules (call isolate_state() before importing main)."""
+    from rag import embeddings, llm, pinecone_utils
+
+    fakes = {
+        "gemini": FakeGenaiClient(Latency(embed_ms), embed_concurrency),
+        "pinecone": FakeIndex(Latency(pinecone_ms)),
+        "deepseek": FakeLLM(Latency(llm_ms)),
+    }
+    embeddings._client = fakes["gemini"]
+    pinecone_utils._index = fakes["pinecone"]
+    from rag.map_reduce import MAP_MAX_OUTPUT_TOKENS
+    for key in [(1024, None), (800, 0.3), (MAP_MAX_OUTPUT_TOKENS, None)]:
+        llm._clients[key] = fakes["deepseek"]
+
+    if seed:
+        _seed(fakes)
+    if _state_root is not None:
+        # Uploads during the run land in the temp dir, not in data/
+        import main
+        main.DATA_DIR = os.path.join(_state_root, "uploads")
+    return fakes
+
+
+def _seed(fakes: dict):
+    """Ingest the bundled data/ corpus into the fake index (latency off)."""
+    import contextlib
+    import io
+    import main
+
+    saved = [fake.latency.median_ms for fake in fakes.values()]
+    for fake in fakes.values():
+        fake.latency.median_ms = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for fname in sorted(os.listdir(main.DATA_DIR)):
+            path = os.path.join(main.DATA_DIR, fname)
+            if os.path.isfile(path):
+                main._ingest_chunks(main._parse_file(path, fname), fname)
+    for fake, median_ms in zip(fakes.values(), saved):
+        fake.latency.median_ms = median_ms
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.05):
+    """Append event-loop lag samples (seconds a timer fired late) forever."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - t0 - interval))
+
+
+def lag_summary(samples: list) -> dict:
+    if not samples:
+        return {"samples": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {
+        "samples": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p50_ms": round(pick(0.50), 2),
+        "p99_ms": round(pick(0.99), 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+# ─── Fake-backed server ─────────────────────────────────────────────────────
+
+def serve(port: int, embed_ms: float, pinecone_ms: float, llm_ms: float, rate_limit: bool = True,
+          embed_concurrency: int = 8):
+    isolate_state()
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    import uvicorn
+    import main
+
+    install(embed_ms, pinecone_ms, llm_ms, embed_concurrency=embed_concurrency)
+    main.limiter.enabled = rate_limit
+    samples: list = []
+
+    @main.app.get("/__loadtest/lag", include_in_schema=False)
+    async def loop_lag(reset: bool = False):
+        summary = lag_summary(samples)
+        if reset:
+            samples.clear()
+        return summary
+
+    async def run():
+        monitor = asyncio.create_task(monitor_loop_lag(samples))
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        try:
+            await server.serve()
+        finally:
+            monitor.cancel()
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API against latency-injecting fakes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--embed-ms", type=float, default=80)
+    parser.add_argument("--pinecone-ms", type=float, default=40)
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--embed-concurrency", type=int, default=8)
+    parser.add_argument("--no-rate-limit", action="store_true")
+    args = parser.parse_args()
+    serve(args.port, args.embed_ms, args.pinecone_ms, args.llm_ms, rate_limit=not args.no_rate_limit,
+          embed_concurrency=args.embed_concurrency)
+
+
+if __name__ == "__main__":
+    main()
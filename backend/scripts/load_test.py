@@ -0,0 +1,262 @@
+"""
+Async load generator for the API.
+
+Drives /api/query, /api/query?mode=retrieve, /api/explain-chunks and
+/api/upload-file with a weighted mix of closed-loop virtual users and
+reports throughput, latency percentiles, error / 429 rates and the
+server's event-loop lag.
+
+Targets:
+  inprocess : main:app via httpx's ASGI transport, external services replaced
+              by the latency-injecting fakes in scripts.load_fakes (default)
+  uvicorn   : a local uvicorn server running against the same fakes,
+              started in a subprocess
+  --url     : any running server (real services — uploads are real too!)
+
+    python -m scripts.load_test --users 50 --ramp 10 --duration 60
+    python -m scripts.load_test --target uvicorn --mix query=6,retrieve=3,explain=1 --no-rate-limit
+    python -m scripts.load_test --url http://localhost:8000 --mix retrieve=1 --users 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from scripts.load_fakes import lag_summary, monitor_loop_lag
+
+DEFAULT_MIX = "query=6,retrieve=3,explain=1,upload=0"
+
+
+# ─── Operations ─────────────────────────────────────────────────────────────
+
+class Workload:
+    def __init__(self, queries: list[str], chunks: list[dict], unique_queries: bool):
+        self.queries = queries
+        self.chunks = chunks
+        self.unique_queries = unique_queries
+        self.uploads = 0
+
+    def _query(self, rnd: random.Random) -> str:
+        query = rnd.choice(self.queries)
+        # A nonce defeats request coalescing, so every request runs the pipeline
+        return f"{query} #{rnd.getrandbits(32)}" if self.unique_queries else query
+
+    async def query(self, client, rnd):
+        return await client.post("/api/query", json={"query": self._query(rnd)})
+
+    async def retrieve(self, client, rnd):
+        return await client.post("/api/query?mode=retrieve", json={"query": self._query(rnd)})
+
+    async def explain(self, client, rnd):
+        chunks = [
+            {"id": c["id"], "score": round(rnd.random(), 3), "content": c["metadata"]["text"], "metadata": c["metadata"]}
+            for c in rnd.sample(self.chunks, 3)
+        ]
+        return await client.post("/api/explain-chunks", json={"query": self._query(rnd), "chunks": chunks})
+
+    async def upload(self, client, rnd):
+        self.uploads += 1
+        text = "\n\n".join(c["metadata"]["text"] for c in rnd.sample(self.chunks, 4))
+        files = {"file": (f"loadtest_{self.uploads}_{rnd.getrandbits(24)}.txt", text.encode(), "text/plain")}
+        return await client.post("/api/upload-file", files=files)
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("query", "retrieve", "explain", "upload"):
+            raise SystemExit(f"Unknown operation in --mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    mix = {k: v for k, v in mix.items() if v > 0}
+    if not mix:
+        raise SystemExit("--mix has no operation with a positive weight")
+    return mix
+
+
+def classify(response) -> str:
+    if response.status_code == 429:
+        return "rate_limited"
+    if response.status_code >= 400:
+        return "error"
+    try:
+        body = response.json()
+    except ValueError:
+        return "error"
+    # Upload / admin endpoints report failures as 200 {"status": "error"}
+    return "error" if isinstance(body, dict) and body.get("status") == "error" else "ok"
+
+
+# ─── Runner ─────────────────────────────────────────────────────────────────
+
+async def virtual_user(user_id, client, workload, mix, start_delay, deadline, results):
+    rnd = random.Random(user_id)
+    await asyncio.sleep(start_delay)
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        name = rnd.choices(names, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            outcome = classify(await getattr(workload, name)(client, rnd))
+        except httpx.HTTPError:
+            outcome = "error"
+        results.append((name, outcome, t0, time.perf_counter() - t0))
+
+
+async def run_load(client, args, lag_samples=None) -> tuple[list, float]:
+    # Imported here: the rag modules read their cache paths from the environment
+    # at import time, and the fake targets redirect those first.
+    from scripts.bench_utils import SAMPLE_QUERIES, load_base_chunks
+    workload = Workload(SAMPLE_QUERIES, load_base_chunks(), args.unique_queries)
+    mix = parse_mix(args.mix)
+    results: list = []
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples)) if lag_samples is not None else None
+
+    t_start = time.perf_counter()
+    deadline = t_start + args.ramp + args.duration
+    users = [
+        virtual_user(u, client, workload, mix, args.ramp * u / args.users, deadline, results)
+        for u in range(args.users)
+    ]
+    await asyncio.gather(*users)
+    elapsed = time.perf_counter() - t_start
+    if monitor is not None:
+        monitor.cancel()
+    return results, elapsed
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def report(results: list, elapsed: float, ramp: float, lag: dict) -> dict:
+    steady_start = min((t0 for _, _, t0, _ in results), default=0) + ramp
+    by_op = defaultdict(list)
+    for name, outcome, t0, seconds in results:
+        by_op[name].append((outcome, t0, seconds))
+        by_op["ALL"].append((outcome, t0, seconds))
+
+    summary = {"elapsed_seconds": round(elapsed, 2), "operations": {}, "event_loop_lag": lag}
+    print(f"\n{'operation':10}{'count':>8}{'rps':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'err %':>7}{'429 %':>7}")
+    for name in sorted(by_op, key=lambda n: (n == "ALL", n)):
+        rows = by_op[name]
+        ok_latencies = sorted(s for outcome, _, s in rows if outcome == "ok")
+        steady = [r for r in rows if r[1] >= steady_start]
+        steady_window = max(elapsed - ramp, 1e-9)
+        stats = {
+            "count": len(rows),
+            # Throughput counts only requests started after the ramp-up
+            "rps": round(len(steady) / steady_window, 2),
+            "p50_ms": round(percentile(ok_latencies, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(ok_latencies, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(ok_latencies, 0.99) * 1000, 1),
+            "max_ms": round((ok_latencies[-1] if ok_latencies else 0) * 1000, 1),
+            "error_rate": round(sum(o == "error" for o, _, _ in rows) / len(rows), 4),
+            "rate_limited_rate": round(sum(o == "rate_limited" for o, _, _ in rows) / len(rows), 4),
+        }
+        summary["operations"][name] = stats
+        print(f"{name:10}{stats['count']:>8}{stats['rps']:>8.1f}{stats['p50_ms']:>9.0f}{stats['p90_ms']:>9.0f}"
+              f"{stats['p99_ms']:>9.0f}{stats['max_ms']:>9.0f}{stats['error_rate'] * 100:>7.1f}{stats['rate_limited_rate'] * 100:>7.1f}")
+    if lag.get("samples"):
+        print(f"\nEvent-loop lag: mean {lag['mean_ms']} ms, p50 {lag['p50_ms']} ms, "
+              f"p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms ({lag['samples']} samples)")
+    return summary
+
+
+# ─── Targets ────────────────────────────────────────────────────────────────
+
+async def run_inprocess(args):
+    from scripts import load_fakes
+    load_fakes.isolate_state()
+    os.environ["WARMUP_ON_STARTUP"] = "0"
+    import main
+
+    load_fakes.install(args.embed_ms, args.pinecone_ms, args.llm_ms, embed_concurrency=args.embed_concurrency)
+    main.limiter.enabled = not args.no_rate_limit
+    lag_samples: list = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+        results, elapsed = await run_load(client, args, lag_samples)
+    # Client and app share one loop here, so the lag includes the generator itself
+    return results, elapsed, lag_summary(lag_samples)
+
+
+async def run_http(args, url: str, fetch_lag: bool):
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        if fetch_lag:
+            await client.get("/__loadtest/lag", params={"reset": True})
+        results, elapsed = await run_load(client, args)
+        lag = (await client.get("/__loadtest/lag")).json() if fetch_lag else {"samples": 0}
+    return results, elapsed, lag
+
+
+def start_fake_server(args) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "scripts.load_fakes", "--port", str(args.port),
+           "--embed-ms", str(args.embed_ms), "--pinecone-ms", str(args.pinecone_ms), "--llm-ms", str(args.llm_ms),
+           "--embed-concurrency", str(args.embed_concurrency)]
+    if args.no_rate_limit:
+        cmd.append("--no-rate-limit")
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("Fake-backed server exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    proc.terminate()
+    raise SystemExit("Fake-backed server did not become healthy within 60s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the RAG API")
+    parser.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--url", help="load an already running server instead (no fakes)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds to start all users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds at full concurrency")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout (s)")
+    parser.add_argument("--unique-queries", action="store_true", help="defeat request coalescing")
+    parser.add_argument("--no-rate-limit", action="store_true", help="disable slowapi limits (fake targets)")
+    parser.add_argument("--embed-ms", type=float, default=80, help="fake Gemini latency")
+    parser.add_argument("--pinecone-ms", type=float, default=40, help="fake Pinecone latency")
+    parser.add_argument("--llm-ms", type=float, default=1500, help="fake DeepSeek latency")
+    parser.add_argument("--embed-concurrency", type=int, default=8, help="fake Gemini calls in flight")
+    parser.add_argument("--port", type=int, default=8765, help="port for --target uvicorn")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    target = args.url or args.target
+    print(f"Load test: target={target} users={args.users} ramp={args.ramp}s duration={args.duration}s mix={args.mix}")
+
+    if args.url:
+        results, elapsed, lag = asyncio.run(run_http(args, args.url, fetch_lag=False))
+    elif args.target == "uvicorn":
+        server = start_fake_server(args)
+        try:
+            results, elapsed, lag = asyncio.run(run_http(args, f"http://127.0.0.1:{args.port}", fetch_lag=True))
+        finally:
+            server.terminate()
+            server.wait()
+    else:
+        results, elapsed, lag = asyncio.run(run_inprocess(args))
+
+    summary = report(results, elapsed, args.ramp, lag)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": target, "args": vars(args), **summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Per-page PDF extraction timings — find the pathological PDFs.
+
+    python -m scripts.profile_pdfs                 # every PDF in data/
+    python -m scripts.profile_pdfs path/a.pdf --top 20 --no-cache
+
+Timings come from the extraction cache when available (they were recorded
+when the PDF was first parsed); --no-cache re-extracts and times afresh.
+"""
+import argparse
+import glob
+import os
+
+from rag import pdf_extract
+from scripts.ingest import DATA_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF extraction timings")
+    parser.add_argument("paths", nargs="*", help="PDF files (default: data/*.pdf)")
+    parser.add_argument("--top", type=int, default=10, help="slowest pages to list")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached text and re-extract")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        pdf_extract.PDF_CACHE_DIR = os.path.join(pdf_extract.PDF_CACHE_DIR, "profile-tmp")
+    paths = args.paths or sorted(glob.glob(os.path.join(DATA_DIR, "*.pdf")))
+
+    pages = []
+    print(f"{'file':44}{'pages':>7}{'seconds':>10}{'cached':>8}")
+    for path in paths:
+        result = pdf_extract.extract_pdf(path)
+        name = os.path.basename(path)
+        print(f"{name:44}{result['pages']:>7}{result['seconds']:>10.3f}{'yes' if result['cached'] else 'no':>8}")
+        pages.extend((seconds, name, page_no) for page_no, seconds in enumerate(result["page_seconds"], 1))
+
+    print(f"\nSlowest pages (threshold for warnings: {pdf_extract.PDF_SLOW_PAGE_SECONDS}s)")
+    for seconds, name, page_no in sorted(pages, reverse=True)[:args.top]:
+        print(f"  {seconds:>8.3f}s  {name} p.{page_no}")
+
+    if args.no_cache:
+        for path in glob.glob(os.path.join(pdf_extract.PDF_CACHE_DIR, "*.json")):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
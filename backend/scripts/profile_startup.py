@@ -0,0 +1,121 @@
+"""
+Startup profiler — measures per-module import cost of the API and CLI entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter (so
+nothing is already cached in sys.modules), parses the report and prints the
+most expensive imports by cumulative time.
+
+Also doubles as the startup-budget check for CI:
+
+    python -m scripts.profile_startup --module main --budget-ms 1500
+    python -m scripts.profile_startup --module scripts.ingest --budget-ms 1000
+
+exits non-zero if the import exceeds the budget or if any of the heavy SDKs
+(which must only load on first use) shows up at import time.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that must only be imported by the endpoint / stage that needs them.
+HEAVY_MODULES = [
+    "PyPDF2",
+    "langchain_text_splitters",
+    "langchain_openai",
+    "langchain_core",
+    "langgraph",
+    "google.genai",
+    "pinecone",
+    "rank_bm25",
+    "numpy",
+]
+
+
+def profile_imports(module: str) -> dict:
+    """Import `module` in a fresh interpreter and return its import-time profile."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+
+    target = next((m for m in modules if m["module"] == module), None)
+    return {
+        "module": module,
+        "wall_ms": wall_ms,
+        "import_ms": target["cumulative_ms"] if target else sum(m["self_ms"] for m in modules),
+        "modules": modules,
+    }
+
+
+def heavy_imports(profile: dict) -> list[str]:
+    """Heavy dependencies that were loaded as a side effect of the import."""
+    loaded = {m["module"] for m in profile["modules"]}
+    return [h for h in HEAVY_MODULES if h in loaded]
+
+
+def print_report(profile: dict, top: int = 20):
+    print(f"Import profile for `{profile['module']}`")
+    print(f"  import time : {profile['import_ms']:.1f} ms")
+    print(f"  process wall: {profile['wall_ms']:.1f} ms (interpreter start + import)")
+    print(f"  modules     : {len(profile['modules'])}")
+    print()
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    ranked = sorted(profile["modules"], key=lambda m: m["cumulative_ms"], reverse=True)
+    for m in ranked[:top]:
+        print(f"{m['cumulative_ms']:>14.1f} {m['self_ms']:>9.1f}  {m['module']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--top", type=int, default=20, help="number of modules to list")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if the import takes longer than this many milliseconds")
+    parser.add_argument("--allow-heavy", action="store_true",
+                        help="do not fail when heavy SDKs are imported eagerly")
+    args = parser.parse_args()
+
+    profile = profile_imports(args.module)
+    print_report(profile, args.top)
+
+    failures = []
+    if args.budget_ms is not None and profile["import_ms"] > args.budget_ms:
+        failures.append(f"import took {profile['import_ms']:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    eager = heavy_imports(profile)
+    if eager and not args.allow_heavy:
+        failures.append(f"heavy modules imported eagerly: {', '.join(eager)}")
+
+    print()
+    if failures:
+        for f in failures:
+            print(f"FAIL: {f}")
+        sys.exit(1)
+    print("OK: startup within budget" if args.budget_ms is not None else "OK")
+
+
+if __name__ == "__main__":
+    main()
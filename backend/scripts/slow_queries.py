@@ -0,0 +1,127 @@
+"""
+Summarize the slow-query log (see rag/slow_log.py).
+
+    python -m scripts.slow_queries                          # every worker's log + rotated files
+    python -m scripts.slow_queries --since 3600 --top 20    # last hour only
+    python -m scripts.slow_queries --collapsed out.folded   # merged profile for flamegraph.pl
+
+Prints the count, latency percentiles and LLM token spend of logged queries,
+each stage's median / p95 and how often it was the dominant stage, the
+slowest queries, and the hottest frames of the merged profiles.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+from collections import Counter, defaultdict
+
+from rag.slow_log import SLOW_QUERY_LOG, process_log_path
+
+
+def log_files(path: str) -> list[str]:
+    """Every worker's log (slow_queries.<pid>.jsonl, see rag/slow_log.py) and
+    its rotated files, plus `path` itself if a single-file log exists."""
+    files = []
+    for live in [path, *sorted(glob.glob(process_log_path(path, "*")))]:
+        # Oldest rotated file first (.5 ... .1), then the live file
+        rotated = [p for p in glob.glob(f"{glob.escape(live)}.*") if p.rsplit(".", 1)[1].isdigit()]
+        files += sorted(rotated, key=lambda p: -int(p.rsplit(".", 1)[1])) + [live]
+    return files
+
+
+def load_entries(path: str, since: float | None = None) -> list[dict]:
+    files = log_files(path)
+    cutoff = time.time() - since if since else None
+    entries = []
+    for file in files:
+        if not os.path.exists(file):
+            continue
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn line from a crash mid-write
+                if cutoff is None or entry.get("ts", 0) >= cutoff:
+                    entries.append(entry)
+    # Workers' files interleave in time
+    entries.sort(key=lambda e: e.get("ts", 0))
+    return entries
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the slow-query log")
+    parser.add_argument("--log", default=SLOW_QUERY_LOG,
+                        help=f"log file; its per-process files are read too (default: {SLOW_QUERY_LOG})")
+    parser.add_argument("--since", type=float, help="only entries from the last N seconds")
+    parser.add_argument("--top", type=int, default=10, help="slowest queries / hottest frames to list")
+    parser.add_argument("--collapsed", help="write the merged collapsed-stack profile to this file")
+    args = parser.parse_args()
+
+    entries = load_entries(args.log, args.since)
+    if not entries:
+        print(f"No slow queries logged in {args.log}")
+        return
+
+    totals = sorted(e["total_ms"] for e in entries)
+    modes = Counter(e.get("mode", "answer") for e in entries)
+    print(f"{len(entries)} slow queries ({', '.join(f'{n} {m}' for m, n in modes.most_common())}), "
+          f"{sum(1 for e in entries if e.get('failed'))} failed, "
+          f"{sum(1 for e in entries if e.get('degraded'))} degraded")
+    print(f"total ms: p50 {percentile(totals, 0.5):.0f}  p95 {percentile(totals, 0.95):.0f}  max {totals[-1]:.0f}")
+    spend = [e.get("counts", {}) for e in entries if "llm_prompt_tokens" in e.get("counts", {})]
+    if spend:
+        print(f"LLM: {sum(c['llm_prompt_tokens'] for c in spend)} prompt + "
+              f"{sum(c.get('llm_completion_tokens', 0) for c in spend)} completion tokens, "
+              f"${sum(c.get('llm_cost_usd', 0.0) for c in spend):.4f} over {len(spend)} calls")
+
+    stage_ms = defaultdict(list)
+    dominant = Counter()
+    for e in entries:
+        stages = e.get("stages", {})
+        for name, ms in stages.items():
+            stage_ms[name].append(ms)
+        if stages:
+            dominant[max(stages, key=stages.get)] += 1
+
+    print(f"\n{'stage':14}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'dominant':>10}")
+    for name in sorted(stage_ms, key=lambda n: -statistics.median(stage_ms[n])):
+        ordered = sorted(stage_ms[name])
+        print(f"{name:14}{len(ordered):>7}{percentile(ordered, 0.5):>9.0f}{percentile(ordered, 0.95):>9.0f}"
+              f"{ordered[-1]:>9.0f}{dominant[name]:>10}")
+
+    print(f"\nSlowest {min(args.top, len(entries))}:")
+    for e in sorted(entries, key=lambda e: -e["total_ms"])[:args.top]:
+        stages = e.get("stages", {})
+        worst = max(stages, key=stages.get) if stages else "-"
+        counts = e.get("counts", {})
+        print(f"  {e['total_ms']:>8.0f} ms  {worst:>12}  prompt {counts.get('prompt_chars', 0):>6} ch  "
+              f"{counts.get('llm_prompt_tokens', 0):>5}+{counts.get('llm_completion_tokens', 0):<4} tok  "
+              f"resp {e.get('response_bytes', 0):>6} B  {e['query'][:60]!r}")
+
+    merged = Counter()
+    for e in entries:
+        merged.update(e.get("profile", {}))
+    if merged:
+        samples = sum(merged.values())
+        self_time = Counter()
+        for stack, n in merged.items():
+            self_time[stack.rsplit(";", 1)[-1]] += n
+        print(f"\nHottest frames ({sum(1 for e in entries if 'profile' in e)} profiles, {samples} samples):")
+        for frame, n in self_time.most_common(args.top):
+            print(f"  {n / samples:>6.1%}  {frame}")
+        if args.collapsed:
+            with open(args.collapsed, "w", encoding="utf-8") as f:
+                for stack, n in merged.most_common():
+                    f.write(f"{stack} {n}\n")
+            print(f"Collapsed stacks written to {args.collapsed}")
+
+
+if __name__ == "__main__":
+    main()